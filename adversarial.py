@@ -1,7 +1,9 @@
 """ Run avalanche in an adversarial environment
 """
-from avalanche import AvalancheMaster, BasicNode
+import avalanche
+from avalanche import BasicNode
 from avalanche import Block, Transaction, rand
+from eventlog import Kind
 
 class Settings:
     # Environment parameters
@@ -20,8 +22,8 @@ class Settings:
     conflict_transaction_spawn = .001
 
 class Adversary(BasicNode):
-    def __init__(self, settings):
-        super().__init__(-1, settings)
+    def __init__(self, settings, block_store):
+        super().__init__(-1, settings, block_store)
 
         self.node_count = settings.node_count
         self.byz_node_count = int(self.node_count * settings.byzantine_percent)
@@ -68,9 +70,9 @@ class Adversary(BasicNode):
         blk0 = Block(tx0, parents)
         blk1 = Block(tx1, parents)
 
-        self.log("Create-Block", blk0.id, blk0.parents)
-        self.log("Create-Block", blk1.id, blk1.parents)
-        self.log("Create-Conflict", blk0.id, blk1.id)
+        self.log(Kind.CREATE_BLOCK, blk0.id, blk0.parents)
+        self.log(Kind.CREATE_BLOCK, blk1.id, blk1.parents)
+        self.log(Kind.CREATE_CONFLICT, blk0.id, [blk1.id])
 
         conflict_count = self.conflict_count
         self.conflict_id[conflict_count] = [blk0, blk1]
@@ -112,8 +114,7 @@ class Adversary(BasicNode):
 
 
 def main():
-    master = AvalancheMaster(Settings, Adversary)
-    master.run()
+    avalanche.main(Settings, Adversary)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
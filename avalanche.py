@@ -4,15 +4,17 @@
     [1] Snowflake to Avalanche: A Novel Metastable Consensus Protocol Family for Cryptocurrencies
 """
 
+import argparse
+import heapq
 import random
-import copy
+import signal
+import sys
 from queue import Queue
-from io import StringIO
 
 import logger
-logger_avalanche = logger.get_logger_avalanche()
-
-ACTIVE_LOG = True
+from eventlog import Kind, Level, LEVELS
+from snowball import profiling
+event_log = logger.RunEventLog('avalanche')
 
 # Turn on for reproductible experiments
 random.seed(0)
@@ -41,39 +43,97 @@ def sample(n, k, u):
     return [x + int(x >= u) for x in random.sample(range(n - 1), k)]
 
 class Transaction:
+    __slots__ = ('id', 'sender', 'receiver')
+
     def __init__(self, sender, receiver):
         self.id = rand()
         self.sender = sender
         self.receiver = receiver
 
 class Block:
+    """ Blocks are immutable and shared by every node of a simulation through its `BlockStore`.
+        Per node state (such as acceptance) is kept by each node.
+    """
+    __slots__ = ('id', 'body', 'parents', 'index')
+
     genesis_id = 0
 
     def __init__(self, body, parents):
         self.id = rand()
         self.body = body
 
-        # List with id of parent blocks
-        self.parents = parents
+        # Tuple with id of parent blocks
+        self.parents = tuple(parents)
 
-        # Whether this block has been already accepted or not
-        self.accepted = False
+        # Position in the `BlockStore`. Assigned when the block is interned
+        self.index = None
 
     def __repr__(self):
         name = 'TX' if isinstance(self.body, Transaction) else 'NoP'
-        return f"Block({name},{str(self.id)},{len(self.parents)},{int(self.accepted)})"
+        return f"Block({name},{str(self.id)},{len(self.parents)})"
 
     @classmethod
-    def fromblock(cls, block):
-        nblock = copy.deepcopy(block)
-        nblock.accepted = False
-        return nblock
+    def genesis(cls, block_store):
+        if Block.genesis_id in block_store:
+            return block_store[Block.genesis_id]
 
-    @classmethod
-    def genesis(cls):
         block = Block(None, [])
         block.id = Block.genesis_id
-        return block
+        return block_store.intern(block)
+
+
+class BlockStore:
+    """ Interned blocks shared by all nodes of a simulation, owned by its `AvalancheMaster`.
+        Each block gets a dense index, so nodes can keep their state about blocks in compact arrays.
+    """
+    def __init__(self):
+        self.blocks = []
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __contains__(self, blockid):
+        return blockid in self.ids
+
+    def __getitem__(self, blockid):
+        return self.ids[blockid]
+
+    def intern(self, block):
+        """ Return the shared instance of `block`, adding it to the store if it is new
+        """
+        shared = self.ids.get(block.id)
+
+        if shared is None:
+            block.index = len(self.blocks)
+            self.blocks.append(block)
+            self.ids[block.id] = block
+            shared = block
+
+        return shared
+
+
+# Per node block flags. See `BasicNode.flags`
+KNOWN = 0b01
+ACCEPTED = 0b10
+
+
+class Vertex:
+    """ Undecided vertex of the DAG as seen by a single node
+    """
+    __slots__ = ('block', 'order', 'parents', 'children')
+
+    def __init__(self, block, order):
+        self.block = block
+
+        # Arrival number. Parents always arrive before their children so it is a topological order
+        self.order = order
+
+        # Number of undecided parents
+        self.parents = 0
+
+        # Id of undecided children
+        self.children = []
 
 
 class Snowball:
@@ -99,16 +159,19 @@ class Snowball:
 
 
 class BasicNode:
-    def __init__(self, ix, settings):
+    def __init__(self, ix, settings, block_store):
         self.settings = settings
         self.index = ix
 
+        # Blocks of the simulation, shared with the other nodes
+        self.block_store = block_store
+
         # Participants list is initialized in `set_participants`
         # It will be used by honest nodes only to call `query` method
         self.participants = None
 
-        # DAG information. (block_id -> block)
-        self.blocks = {}
+        # DAG information. Flags of each block indexed by `Block.index`
+        self.flags = bytearray()
 
         # Id of blocks without children
         self.roots = set()
@@ -123,38 +186,56 @@ class BasicNode:
         # Transactions that haven't been processed yet.
         self.pending_blocks = Queue()
 
+        # Undecided (non accepted) region of the DAG in topological order
+        # Map: block_id -> Vertex
+        self.undecided = {}
+        self.received_count = 0
+
+        # Undecided blocks in each conflict set. Map: utxo -> set(block_id)
+        self.conflict_blocks = {}
+
+        # Received blocks that haven't been checked for acceptance yet
+        self.unchecked = []
+
         # Initialize DAG
         self.init()
 
         # Statistic variables
         self.accepted_blocks_count = 1 # Only genesis in the begining
 
-    def log(self, *args, **kwargs):
-        """ Implement print interface
+    def log(self, kind, blockid, ids=()):
+        """ Write an event of kind `Kind` to the event log, if its level is enabled
         """
-
-        if ACTIVE_LOG:
-            output = StringIO()
-            print(*args, **kwargs, file=output, end="")
-            message = output.getvalue()
-
-            logger_avalanche.info(f"NODE {self.index}: {message}")
+        if LEVELS[kind] <= event_log.level:
+            event_log.write(self.index, kind, blockid, ids)
 
     def init(self):
         """ Create genesis block
         """
-        genesis = Block.genesis()
+        genesis = Block.genesis(self.block_store)
         self.on_receive(genesis)
 
     def set_participants(self, participants):
         self.participants = participants
 
+    def has_block(self, blockid):
+        block = self.block_store.ids.get(blockid)
+        return block is not None and block.index < len(self.flags) and bool(self.flags[block.index] & KNOWN)
+
+    def is_decided(self, block):
+        return bool(self.flags[block.index] & ACCEPTED)
+
     def on_receive(self, block):
         """ procedure onReceiveTx(T)
             Figure 5: Avalanche: transaction generation. [1]
         """
-        if not block.id in self.blocks:
-            self.blocks[block.id] = block
+        block = self.block_store.intern(block)
+
+        if block.index >= len(self.flags):
+            self.flags.extend(bytes(len(self.block_store) - len(self.flags)))
+
+        if not self.flags[block.index] & KNOWN:
+            self.flags[block.index] = KNOWN
 
             if isinstance(block.body, Transaction):
                 txid = block.body.id
@@ -165,34 +246,65 @@ class BasicNode:
                 else:
                     self.conflict_set[utxo].add(txid)
 
+                self.conflict_blocks.setdefault(utxo, set()).add(block.id)
                 self.pending_blocks.put(block)
 
+            vertex = Vertex(block, self.received_count)
+            self.received_count += 1
+
             # Update current roots
             for parid in block.parents:
-                assert parid in self.blocks
+                assert self.has_block(parid)
 
                 if parid in self.roots:
                     self.roots.remove(parid)
 
+                parent = self.undecided.get(parid)
+                if parent is not None:
+                    vertex.parents += 1
+                    parent.children.append(block.id)
+
+            self.undecided[block.id] = vertex
+            self.unchecked.append(block.id)
+
             self.roots.add(block.id)
-            self.log("Receive-Block", block.id, block.parents)
+            self.log(Kind.RECEIVE_BLOCK, block.id, block.parents)
 
     def get(self, blockid):
-        # assert blockid in self.blocks
-        return Block.fromblock(self.blocks[blockid])
+        # Blocks are immutable so a reference to the shared instance is returned
+        return self.block_store[blockid]
+
+    def missing_ancestors(self, blockid, known):
+        """ Blocks in the past of `blockid` (including itself) for which `known` is false.
+            Returned in topological order (parents first).
+        """
+        missing = {}
+        stack = [blockid]
+
+        while stack:
+            curid = stack.pop()
+
+            if curid in missing or known(curid):
+                continue
+
+            block = self.get(curid)
+            missing[curid] = block
+            stack.extend(block.parents)
+
+        # Blocks are interned after their parents so the store index is a topological order
+        return sorted(missing.values(), key=lambda block: block.index)
 
     def sync(self, blockid, participant):
         """ Mechanism that allow two participants sync their DAG blocks.
+
+            The peer walks back from `blockid` until it reaches blocks this node already has
+            and sends every missing block in a single batch.
         """
-        if blockid in self.blocks:
+        if self.has_block(blockid):
             return
 
-        block = participant.get(blockid)
-        for parid in block.parents:
-            self.sync(parid, participant)
-
-        # Call on_receive after processing parents
-        self.on_receive(block)
+        for block in participant.missing_ancestors(blockid, self.has_block):
+            self.on_receive(block)
 
     def get_conflict_set(self, block):
         """ Return snowball instance of blocks that contains a transaction
@@ -232,10 +344,10 @@ class BasicNode:
             yield cur_block
 
             for parid in cur_block.parents:
-                par_block = self.blocks[parid]
+                par_block = self.block_store[parid]
 
                 # Prune at accepted nodes
-                if par_block.accepted:
+                if self.is_decided(par_block):
                     continue
 
                 par_block_id = par_block.id
@@ -249,7 +361,7 @@ class BasicNode:
         """ procedure isStronglyPreferred(T)
             Figure 6: Avalanche: voting and decision primitives [1]
         """
-        if block.accepted:
+        if self.is_decided(block):
             return True
 
         if not self.is_preferred(block):
@@ -261,41 +373,27 @@ class BasicNode:
         """ procedure onQuery(j, T)
             Figure 6: Avalanche: voting and decision primitives [1]
         """
-        block = self.blocks[blockid]
+        block = self.block_store[blockid]
         value = int(self.is_strongly_preferred(block))
         return value
 
-    def topological_sort(self):
-        order = []
-        degree = {}
-
-        def update_degree(block):
-            for parid in block.parents:
-                degree[parid] = degree.get(parid, 0) + 1
-
-        for blockid in self.roots:
-            block = self.blocks[blockid]
-
-            order.append(block)
-            update_degree(block)
-
-        i = 0
-        while i < len(order):
-            block = order[i]
-            i += 1
-
-            if block.accepted:
-                continue
-
-            for parid in block.parents:
-                degree[parid] -= 1
+    def frontier(self):
+        """ Accepted blocks bordering the undecided region and the undecided blocks,
+            parents always before their children.
+        """
+        accepted = [blockid for blockid in self.roots if blockid not in self.undecided]
+        seen = set(accepted)
 
-                if degree[parid] == 0:
-                    nblock = self.blocks[parid]
-                    order.append(nblock)
-                    update_degree(nblock)
+        for vertex in self.undecided.values():
+            for parid in vertex.block.parents:
+                if parid not in self.undecided and parid not in seen:
+                    seen.add(parid)
+                    accepted.append(parid)
 
-        return order
+        # Children can be accepted before their parents, so accepted blocks aren't always first.
+        # Blocks are interned after their parents so the store index is a topological order
+        blocks = [self.block_store[blockid] for blockid in accepted] + [vertex.block for vertex in self.undecided.values()]
+        return sorted(blocks, key=lambda block: block.index)
 
     def parent_selection(self):
         """
@@ -312,13 +410,13 @@ class BasicNode:
 
             TODO: Retreat parent selection as previous selection fails
         """
-        order = list(reversed(self.topological_sort()))
+        order = self.frontier()
 
         parents = set()
         strongly_preferred = set()
 
         for block in order:
-            if block.accepted:
+            if self.is_decided(block):
                 parents.add(block.id)
                 strongly_preferred.add(block.id)
             else:
@@ -356,40 +454,85 @@ class BasicNode:
         parents = self.parent_selection()
         tx = Transaction(rand(), rand())
         block = Block(tx, parents)
-        self.log("Create-Block", block.id, block.parents)
+        self.log(Kind.CREATE_BLOCK, block.id, block.parents)
         self.on_receive(block)
 
     def is_accepted(self, block):
         """ procedure isAccepted(T)
             Figure 6: Avalanche: voting and decision primitives. [1]
         """
-        if block.accepted:
+        if self.is_decided(block):
             return True
 
         snowball = self.get_conflict_set(block)
+        accepted = False
 
         # consecutive counter
         if snowball is not None and\
             snowball.pref == block.body.id and snowball.cnt >= self.settings.beta2:
-            block.accepted = True
+            accepted = True
 
         # safe early commitment
         elif snowball is None or\
             snowball.size == 1 and snowball.confidence[block.body.id] >= self.settings.beta1:
 
-            for parid in block.parents:
-                parblock = self.blocks[parid]
+            if self.undecided[block.id].parents == 0:
+                accepted = True
 
-                if not parblock.accepted:
-                    break
-            else:
-                block.accepted = True
+        if accepted:
+            self.accept(block)
 
-        if block.accepted:
-            self.accepted_blocks_count += 1
-            self.log("Accept-Block", block.id)
+        return accepted
+
+    def accept(self, block):
+        """ Remove an accepted block from the undecided region
+        """
+        vertex = self.undecided.pop(block.id)
+        self.flags[block.index] |= ACCEPTED
+
+        if isinstance(block.body, Transaction):
+            utxo = block.body.sender
+            undecided = self.conflict_blocks[utxo]
+            undecided.discard(block.id)
 
-        return block.accepted
+            if not undecided:
+                del self.conflict_blocks[utxo]
+
+        # Children might have been accepted first through the consecutive counter
+        for childid in vertex.children:
+            child = self.undecided.get(childid)
+            if child is not None:
+                child.parents -= 1
+
+        self.accepted_blocks_count += 1
+        self.log(Kind.ACCEPT_BLOCK, block.id)
+
+    def update_accepted(self, conflicts):
+        """ Check acceptance of new blocks and blocks in `conflicts` (utxo of conflict sets that changed),
+            ancestors first. Children of accepted blocks are checked as well.
+        """
+        candidates = set(self.unchecked)
+        self.unchecked.clear()
+
+        for utxo in conflicts:
+            candidates.update(self.conflict_blocks.get(utxo, ()))
+
+        queue = [(self.undecided[blockid].order, blockid) for blockid in candidates if blockid in self.undecided]
+        heapq.heapify(queue)
+
+        while queue:
+            _, blockid = heapq.heappop(queue)
+            vertex = self.undecided.get(blockid)
+
+            # Already accepted
+            if vertex is None:
+                continue
+
+            if self.is_accepted(vertex.block):
+                for childid in vertex.children:
+                    if childid not in candidates and childid in self.undecided:
+                        candidates.add(childid)
+                        heapq.heappush(queue, (self.undecided[childid].order, childid))
 
     def step(self):
         """ Figure 4: Avalanche: the main loop. [1]
@@ -417,6 +560,8 @@ class BasicNode:
                     break
 
             if value >= self.settings.success:
+                conflicts = set()
+
                 for headblock in self.dag_head(block):
 
                     # Ignore nop blocks
@@ -424,6 +569,7 @@ class BasicNode:
                         txid = headblock.body.id
                         utxo = headblock.body.sender
                         snowball = self.conflict_set[utxo]
+                        conflicts.add(utxo)
 
                         snowball.confidence[txid] += 1
                         cur_confidence = snowball.confidence[txid]
@@ -440,15 +586,14 @@ class BasicNode:
                             snowball.cnt += 1
 
                 # Accept blocks
-                for block in reversed(self.topological_sort()):
-                    self.is_accepted(block)
+                self.update_accepted(conflicts)
 
 
 class DummyAdversary:
     """ From the point of view of honest participants there are several indistiguishible hidden
         adversaries but in practice there is a single adversarial instance.
     """
-    def __init__(self, settings):
+    def __init__(self, settings, block_store):
         pass
 
     def set_participants(self, participants):
@@ -473,10 +618,12 @@ class AvalancheMaster:
         self.node_count = settings.node_count
         self.byz_node_count = int(self.node_count * settings.byzantine_percent)
         self.honest_node_count = self.node_count - self.byz_node_count
-        self.adversary = adversarial_cls(settings)
+        # Blocks of this simulation. Every node, honest or not, interns the blocks it receives here
+        self.block_store = BlockStore()
+        self.adversary = adversarial_cls(settings, self.block_store)
 
         # Adversaries behave as a single entity, so a single instance is used for all of them
-        self.participants = [BasicNode(i, self.settings) for i in range(self.honest_node_count)] +\
+        self.participants = [BasicNode(i, self.settings, self.block_store) for i in range(self.honest_node_count)] +\
                             [self.adversary] * self.byz_node_count
 
         for part in self.participants:
@@ -485,18 +632,55 @@ class AvalancheMaster:
     def adversary_update(self, active_node):
         self.adversary.step(active_node)
 
-    def run(self):
-        """ Using global scheduler to run avalanche
+    def run(self, steps=None):
+        """ Using global scheduler to run avalanche. Forever unless `steps` is given
         """
-        while True:
+        step = 0
+        while steps is None or step < steps:
             u = random.choice(range(self.honest_node_count))
             self.adversary_update(u)
             self.participants[u].step()
+            step += 1
+
+
+def instrument():
+    """ Time node phases and count DAG traversal lengths and acceptance checks. See `snowball/profiling.py`
+    """
+    for name in ['step', 'generate_tx', 'parent_selection', 'frontier', 'on_receive', 'sync',
+                 'query', 'update_accepted', 'is_accepted', 'log']:
+        profiling.instrument(BasicNode, name)
+
+    profiling.instrument(AvalancheMaster, 'adversary_update')
+    profiling.instrument_generator(BasicNode, 'dag_head')
+
+
+def main(settings=Settings, adversarial_cls=DummyAdversary):
+    parser = argparse.ArgumentParser(description='Avalanche simulation')
+    parser.add_argument('--steps', type=int, default=None)
+    parser.add_argument('--log_level', type=str, default='ALL', choices=['NONE', 'CREATE', 'ACCEPT', 'ALL'],
+                        help='Events written to logs/RUN_ID/avalanche.events. See `eventlog.Level`')
+    parser.add_argument('--run_id', type=str, default=None, help='Name of the log directory. Time and pid by default')
+    parser.add_argument('--profile', action='store_true', default=False)
+    parser.add_argument('--profile_dump', type=str, default=None)
+    args = parser.parse_args()
+
+    event_log.level = getattr(Level, args.log_level)
+    event_log.run_id = args.run_id
+
+    if args.profile:
+        profiling.enable()
+        instrument()
+
+    # Stopped by `run.sh` with SIGTERM. Leave through `sys.exit` so the profile is reported
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
+    master = AvalancheMaster(settings, adversarial_cls)
 
-def main():
-    master = AvalancheMaster(Settings)
-    master.run()
+    with profiling.session(args.profile_dump):
+        try:
+            master.run(args.steps)
+        except KeyboardInterrupt:
+            pass
 
 
 if __name__ == '__main__':
@@ -0,0 +1,272 @@
+import copy
+import random
+import unittest
+
+import avalanche
+from avalanche import ACCEPTED, KNOWN, AvalancheMaster, BasicNode, Block, BlockStore, Settings, Transaction, rand
+from eventlog import Level
+
+
+class SmallSettings(Settings):
+    node_count = 10
+    k = 4
+    success = int(k * Settings.alpha + .5)
+    beta1 = 3
+    beta2 = 5
+    transaction_spawn = .1
+
+
+def known_blocks(node):
+    return [block for block in node.block_store.blocks[:len(node.flags)] if node.flags[block.index] & KNOWN]
+
+
+def would_accept(node, block):
+    """ Acceptance rule of `BasicNode.is_accepted`, with every parent looked up instead of the undecided count
+    """
+    snowball = node.get_conflict_set(block)
+
+    if snowball is not None and snowball.pref == block.body.id and snowball.cnt >= node.settings.beta2:
+        return True
+
+    if snowball is None or snowball.size == 1 and snowball.confidence[block.body.id] >= node.settings.beta1:
+        return all(node.is_decided(node.block_store[parid]) for parid in block.parents)
+
+    return False
+
+
+class AcceptanceTest(unittest.TestCase):
+
+    def setUp(self):
+        avalanche.event_log.level = Level.NONE
+
+    def check(self, node):
+        """ Compare the incremental state of `node` with a full recomputation from every block it knows
+        """
+        blocks = known_blocks(node)
+        undecided = {block.id for block in blocks if not node.is_decided(block)}
+        children = {block.id: set() for block in blocks}
+        for block in blocks:
+            for parid in block.parents:
+                children[parid].add(block.id)
+
+        self.assertEqual(set(node.undecided), undecided)
+        self.assertEqual(node.roots, {blockid for blockid, ids in children.items() if not ids})
+
+        for blockid, vertex in node.undecided.items():
+            block = vertex.block
+            self.assertEqual(vertex.parents, sum(parid in undecided for parid in block.parents))
+            self.assertEqual(set(vertex.children), children[blockid])
+            for childid in children[blockid] & undecided:
+                self.assertLess(vertex.order, node.undecided[childid].order)
+
+        # Accepted blocks that are roots or parents of undecided blocks, and the undecided ones, parents first
+        border = {block.id for block in blocks if block.id not in undecided and
+                  (not children[block.id] or children[block.id] & undecided)}
+        frontier = [block.id for block in node.frontier()]
+        self.assertEqual(len(frontier), len(set(frontier)))
+        self.assertEqual(set(frontier), border | undecided)
+
+        position = {blockid: ix for ix, blockid in enumerate(frontier)}
+        for blockid in frontier:
+            for parid in node.block_store[blockid].parents:
+                if parid in position:
+                    self.assertLess(position[parid], position[blockid])
+
+        # Nothing left for a full recomputation to accept
+        self.assertEqual([block.id for block in blocks if block.id in undecided and would_accept(node, block)], [])
+
+    def test_simulation(self):
+        random.seed(0)
+        master = AvalancheMaster(SmallSettings)
+
+        for _ in range(10):
+            master.run(300)
+
+            for node in master.participants:
+                self.check(node)
+
+        for node in master.participants:
+            self.assertGreater(node.accepted_blocks_count, 100)
+            self.assertGreater(len(node.undecided), 0)
+
+    def test_child_accepted_first(self):
+        """ A child accepted through the consecutive counter before its parent. Walking down from the roots
+            stops at accepted blocks, so the parent must still be checked and kept in the frontier, before the child
+        """
+        node = BasicNode(0, SmallSettings, BlockStore())
+        node.update_accepted(set())
+        genesis = Block.genesis(node.block_store)
+        self.assertTrue(node.is_decided(genesis))
+
+        parent = Block(Transaction(rand(), rand()), [genesis.id])
+        node.on_receive(parent)
+        child = Block(Transaction(rand(), rand()), [parent.id])
+        node.on_receive(child)
+        node.update_accepted(set())
+        self.check(node)
+
+        node.conflict_set[child.body.sender].cnt = SmallSettings.beta2
+        node.update_accepted({child.body.sender})
+        self.check(node)
+
+        self.assertEqual(node.flags[child.index], KNOWN | ACCEPTED)
+        self.assertEqual(list(node.undecided), [parent.id])
+        self.assertEqual([block.id for block in node.frontier()], [genesis.id, parent.id, child.id])
+
+        node.conflict_set[parent.body.sender].confidence[parent.body.id] = SmallSettings.beta1
+        node.update_accepted({parent.body.sender})
+        self.check(node)
+
+        self.assertEqual(node.undecided, {})
+        self.assertTrue(node.is_decided(parent))
+
+
+
+class BlockStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        avalanche.event_log.level = Level.NONE
+
+    def test_intern(self):
+        store = BlockStore()
+        genesis = Block.genesis(store)
+        self.assertIs(Block.genesis(store), genesis)
+
+        blocks = [genesis]
+        for _ in range(5):
+            blocks.append(store.intern(Block(Transaction(rand(), rand()), [blocks[-1].id])))
+
+        # Dense indexes in interning order, a copy received later resolves to the shared instance
+        self.assertEqual([block.index for block in blocks], list(range(6)))
+        self.assertEqual(store.blocks, blocks)
+        self.assertIs(store.intern(copy.copy(blocks[3])), blocks[3])
+        self.assertIs(store[blocks[3].id], blocks[3])
+        self.assertEqual(len(store), 6)
+
+        # Every simulation starts from its own store
+        first, second = AvalancheMaster(SmallSettings), AvalancheMaster(SmallSettings)
+        self.assertIsNot(first.block_store, second.block_store)
+        for master in (first, second):
+            self.assertEqual(len(master.block_store), 1)
+            self.assertTrue(all(node.block_store is master.block_store for node in master.participants))
+
+        first.run(300)
+        self.assertGreater(len(first.block_store), 1)
+        self.assertEqual(len(second.block_store), 1)
+
+    def test_flags(self):
+        random.seed(0)
+        master = AvalancheMaster(SmallSettings)
+        master.run(1000)
+        store = master.block_store
+
+        for node in master.participants:
+            # One byte per block interned when the node last received one
+            self.assertLessEqual(len(node.flags), len(store))
+
+            for block in store.blocks:
+                flags = node.flags[block.index] if block.index < len(node.flags) else 0
+                self.assertEqual(node.has_block(block.id), bool(flags & KNOWN))
+                self.assertIn(flags, (0, KNOWN, KNOWN | ACCEPTED))
+
+                if flags & KNOWN:
+                    self.assertEqual(node.is_decided(block), block.id not in node.undecided)
+                    self.assertTrue(all(node.has_block(parid) for parid in block.parents))
+
+        self.assertTrue(all(node.flags[0] == KNOWN | ACCEPTED for node in master.participants))
+        self.assertFalse(master.participants[0].has_block(rand()))
+
+        # A new block is only known by its creator until it is synced
+        creator, other = master.participants[:2]
+        creator.generate_tx()
+        block = store.blocks[-1]
+        self.assertEqual(creator.flags[block.index], KNOWN)
+        self.assertFalse(other.has_block(block.id))
+
+        other.sync(block.id, creator)
+        self.assertEqual(len(other.flags), len(store))
+        self.assertEqual(other.flags[block.index], KNOWN)
+
+
+
+def sync_one_at_a_time(node, blockid, peer):
+    """ Sync as it was done before `missing_ancestors`: fetch a single block, recursing on its parents first
+    """
+    if node.has_block(blockid):
+        return
+
+    block = peer.get(blockid)
+    for parid in block.parents:
+        sync_one_at_a_time(node, parid, peer)
+
+    node.on_receive(block)
+
+
+class SyncTest(unittest.TestCase):
+
+    def setUp(self):
+        avalanche.event_log.level = Level.NONE
+
+    def check_sync(self, store, peer, held, blockid):
+        """ Sync `blockid` from `peer` on two new nodes already holding the past of `held` blocks
+        """
+        batched, single = BasicNode(0, SmallSettings, store), BasicNode(1, SmallSettings, store)
+        for node in (batched, single):
+            for heldid in held:
+                sync_one_at_a_time(node, heldid, peer)
+        known = {block.id for block in known_blocks(batched)}
+
+        missing = peer.missing_ancestors(blockid, batched.has_block)
+        self.assertEqual({block.id for block in missing} & known, set())
+        self.assertEqual([block.index for block in missing], sorted(block.index for block in missing))
+
+        batched.sync(blockid, peer)
+        sync_one_at_a_time(single, blockid, peer)
+
+        received = {block.id for block in known_blocks(batched)}
+        self.assertEqual(received, {block.id for block in known_blocks(single)})
+        self.assertEqual(received - known, {block.id for block in missing})
+        self.assertIn(blockid, received)
+
+        self.assertEqual(batched.roots, single.roots)
+        self.assertEqual(batched.flags, single.flags)
+        self.assertEqual(set(batched.undecided), set(single.undecided))
+        self.assertEqual(set(batched.unchecked), set(single.unchecked))
+        self.assertEqual({block.id for block in batched.pending_blocks.queue},
+                         {block.id for block in single.pending_blocks.queue})
+
+        for vertex in batched.undecided.values():
+            for parid in vertex.block.parents:
+                parent = batched.undecided.get(parid)
+                if parent is not None:
+                    self.assertLess(parent.order, vertex.order)
+
+        return len(missing)
+
+    def test_missing_ancestors(self):
+        random.seed(0)
+        master = AvalancheMaster(SmallSettings)
+        master.run(1000)
+        peer = master.participants[0]
+        store = master.block_store
+
+        blocks = known_blocks(peer)
+        target = blocks[-1].id
+        self.assertGreater(len(blocks), 50)
+
+        # Nothing held but the genesis
+        full = self.check_sync(store, peer, [], target)
+        self.assertGreater(full, 50)
+
+        # Some ancestors already held, on one branch or several
+        partial = self.check_sync(store, peer, [blocks[len(blocks) // 2].id], target)
+        self.assertLess(0, partial)
+        self.assertLess(partial, full)
+        self.check_sync(store, peer, [block.id for block in blocks[10:40:7]], target)
+
+        # Every block already held
+        self.assertEqual(self.check_sync(store, peer, [target], target), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
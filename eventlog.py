@@ -0,0 +1,160 @@
+""" Binary event log of Avalanche nodes.
+
+    A log is a magic header followed by length prefixed records:
+
+        kind (u8) | node (i32) | block id (u64) | count (u16) | count ids (u64)
+
+    little endian and without padding. The ids are the parents of Create-Block and Receive-Block and the
+    rest of the conflict set of Create-Conflict.
+
+    `EventWriter` appends records through a buffered file and `EventReader` reads them back, also from
+    a log that is still being written.
+"""
+import struct
+import sys
+from collections import namedtuple
+
+MAGIC = b'AVLOG\x00\x00\x01'
+
+HEADER = struct.Struct('<BiQH')
+
+
+class Kind:
+    CREATE_BLOCK = 0
+    CREATE_CONFLICT = 1
+    ACCEPT_BLOCK = 2
+    RECEIVE_BLOCK = 3
+
+
+NAMES = {
+    Kind.CREATE_BLOCK: 'Create-Block',
+    Kind.CREATE_CONFLICT: 'Create-Conflict',
+    Kind.ACCEPT_BLOCK: 'Accept-Block',
+    Kind.RECEIVE_BLOCK: 'Receive-Block',
+}
+
+
+class Level:
+    """ Events written at each level. Every level includes the previous ones
+    """
+    NONE = 0
+    # Blocks and conflicts, once per block. Enough to draw the DAG, without acceptance
+    CREATE = 1
+    # Acceptance of blocks by every node
+    ACCEPT = 2
+    # Blocks received by every node
+    ALL = 3
+
+
+LEVELS = {
+    Kind.CREATE_BLOCK: Level.CREATE,
+    Kind.CREATE_CONFLICT: Level.CREATE,
+    Kind.ACCEPT_BLOCK: Level.ACCEPT,
+    Kind.RECEIVE_BLOCK: Level.ALL,
+}
+
+Event = namedtuple('Event', ['node', 'kind', 'block', 'ids'])
+
+
+class EventWriter:
+    """ Writes events to `path`. Callers filter events by level, see `LEVELS`
+    """
+
+    def __init__(self, path, buffering=1 << 16):
+        self.file = open(path, 'wb', buffering=buffering)
+        self.file.write(MAGIC)
+        # Record format by number of ids
+        self.formats = {}
+
+    def write(self, node, kind, block, ids=()):
+        count = len(ids)
+        record = self.formats.get(count)
+
+        if record is None:
+            record = self.formats[count] = struct.Struct(f'<BiQH{count}Q')
+
+        self.file.write(record.pack(kind, node, block, count, *ids))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class EventReader:
+    """ Reads events from binary file `f`.
+
+        `read` returns the events of all complete records available, so a log can be followed while it
+        is written by calling it again. Partial records are kept until the rest arrives.
+    """
+
+    def __init__(self, f):
+        self.file = f
+        self.buffer = b''
+        self.started = False
+
+    def read(self):
+        data = self.file.read()
+        if data:
+            self.buffer += data
+
+        if not self.started:
+            if len(self.buffer) < len(MAGIC):
+                return []
+
+            if self.buffer[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"Not an event log: {getattr(self.file, 'name', self.file)}")
+
+            self.buffer = self.buffer[len(MAGIC):]
+            self.started = True
+
+        events = []
+        buffer = self.buffer
+        size = len(buffer)
+        position = 0
+
+        while position + HEADER.size <= size:
+            kind, node, block, count = HEADER.unpack_from(buffer, position)
+            end = position + HEADER.size + 8 * count
+
+            if end > size:
+                break
+
+            ids = struct.unpack_from(f'<{count}Q', buffer, position + HEADER.size)
+            events.append(Event(node, kind, block, ids))
+            position = end
+
+        self.buffer = buffer[position:]
+        return events
+
+
+def read_events(path):
+    """ All events of the log at `path`
+    """
+    with open(path, 'rb') as f:
+        return EventReader(f).read()
+
+
+def format_event(event):
+    """ Event as a line of the former text log
+    """
+    name = NAMES[event.kind]
+
+    if event.kind == Kind.ACCEPT_BLOCK:
+        message = f"{name} {event.block}"
+    elif event.kind == Kind.CREATE_CONFLICT:
+        message = ' '.join(map(str, (name, event.block) + event.ids))
+    else:
+        message = f"{name} {event.block} {list(event.ids)}"
+
+    return f"NODE {event.node}: {message}"
+
+
+def main():
+    for event in read_events(sys.argv[1]):
+        print(format_event(event))
+
+
+if __name__ == '__main__':
+    main()
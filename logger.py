@@ -1,40 +1,88 @@
-import logging
+import atexit
+import itertools
 import os
+import time
 
-def setup_logger(name, log_file, level=logging.INFO):
-    formatter = logging.Formatter('%(asctime)s| %(message)s')
+from eventlog import EventWriter, Level
 
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setFormatter(formatter)
+LOG_ROOT = 'logs'
 
-    logger = logging.getLogger(name)
-    logger.setLevel(level)
+# Next to the run directories, `run_id.run` holds the name of the directory used by the last run with that id
+RUN_SUFFIX = '.run'
 
-    if not logger.handlers:
-        logger.addHandler(file_handler)
 
-    return logger
+def new_run_id():
+    # Concurrent runs have different pids
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
 
-def find_id():
-    lo = 0
-    hi = 1
-    while os.path.exists(f'logs/avalanche-{hi}.log'):
-        hi *= 2
-    while lo + 1 < hi:
-        mid = (lo + hi) >> 1
-        if os.path.exists(f'logs/avalanche-{mid}.log'):
-            lo = mid
-        else:
-            hi = mid
-    return hi
 
+def make_run_directory(run_id=None, root=LOG_ROOT):
+    """ Create the log directory of a new run, `root/run_id`, and return its path. Creating a directory is
+        atomic, so if the name is taken (run ids can be given) a suffix is added instead of sharing it.
+        The directory used is recorded, see `run_directory`.
+    """
+    os.makedirs(root, exist_ok=True)
+    run_id = run_id or new_run_id()
 
-def get_logger_avalanche():
+    for attempt in itertools.count():
+        name = run_id if attempt == 0 else f'{run_id}-{attempt}'
+        try:
+            os.mkdir(os.path.join(root, name))
+            break
+        except FileExistsError:
+            pass
+
+    # Replaced atomically, so readers never see a partial name
+    pointer = os.path.join(root, f'{run_id}{RUN_SUFFIX}')
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(name)
+    os.replace(pointer + '.tmp', pointer)
+
+    return os.path.join(root, name)
+
+
+def run_directory(run_id, root=LOG_ROOT):
+    """ Log directory of the last run started with `run_id`, which has a suffix if the id was taken.
+        None if no run with that id created its directory yet
+    """
+    try:
+        with open(os.path.join(root, f'{run_id}{RUN_SUFFIX}')) as f:
+            return os.path.join(root, f.read())
+    except FileNotFoundError:
+        return None
+
+
+def latest_run_directory(root=LOG_ROOT):
+    """ Log directory of the last run started, None if there is none
+    """
     try:
-        os.mkdir('logs')
-    except:
-        pass
+        runs = [entry for entry in os.scandir(root) if entry.is_dir()]
+    except FileNotFoundError:
+        return None
+
+    if not runs:
+        return None
+    return max(runs, key=lambda entry: entry.stat().st_mtime).path
+
+
+class RunEventLog:
+    """ Event log `name.events` in the log directory of the run, which is only created when the first event
+        is written. Nothing touches the file system before that, so it can be created at import time.
+    """
+
+    def __init__(self, name, level=Level.ALL, run_id=None):
+        self.name = name
+        self.level = level
+        self.run_id = run_id
+        self.path = None
+        self.writer = None
+
+    def write(self, node, kind, block, ids=()):
+        self.path = os.path.join(make_run_directory(self.run_id), f'{self.name}.events')
+        self.writer = EventWriter(self.path)
+        # Write buffered events on exit
+        atexit.register(self.writer.close)
 
-    logger_avalanche = setup_logger('avalanche', f'logs/avalanche-{find_id()}.log')
-    logger_avalanche.disabled = False
-    return logger_avalanche
+        # Next events go straight to the writer
+        self.write = self.writer.write
+        self.write(node, kind, block, ids)
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+
+from eventlog import Kind, read_events
+from logger import RunEventLog, make_run_directory, run_directory
+
+
+class RunDirectoryTest(unittest.TestCase):
+
+    def test_collision(self):
+        with tempfile.TemporaryDirectory() as root:
+            self.assertIsNone(run_directory('run', root))
+
+            first = make_run_directory('run', root)
+            self.assertEqual(first, os.path.join(root, 'run'))
+            self.assertEqual(run_directory('run', root), first)
+
+            # Runs reusing the id get their own directory, recorded as the one of the id
+            second = make_run_directory('run', root)
+            third = make_run_directory('run', root)
+            self.assertEqual([second, third], [os.path.join(root, 'run-1'), os.path.join(root, 'run-2')])
+            self.assertEqual(run_directory('run', root), third)
+
+            # Other ids are independent
+            self.assertEqual(make_run_directory('other', root), os.path.join(root, 'other'))
+            self.assertEqual(run_directory('run', root), third)
+            self.assertTrue(all(os.path.isdir(path) for path in (first, second, third)))
+
+    def test_default_id(self):
+        with tempfile.TemporaryDirectory() as root:
+            first, second = make_run_directory(root=root), make_run_directory(root=root)
+            self.assertNotEqual(first, second)
+            self.assertTrue(os.path.isdir(first) and os.path.isdir(second))
+
+    def test_event_log(self):
+        with tempfile.TemporaryDirectory() as root:
+            cwd = os.getcwd()
+            os.chdir(root)
+            try:
+                make_run_directory('run')
+                log = RunEventLog('avalanche', run_id='run')
+                self.assertIsNone(log.path)
+
+                log.write(0, Kind.RECEIVE_BLOCK, 1)
+                log.writer.close()
+            finally:
+                os.chdir(cwd)
+
+            # The log was written in the directory of this run, not the one of the previous run with its id
+            self.assertEqual(log.path, os.path.join('logs', 'run-1', 'avalanche.events'))
+            self.assertEqual(run_directory('run', os.path.join(root, 'logs')), os.path.join(root, 'logs', 'run-1'))
+            self.assertEqual(len(list(read_events(os.path.join(root, log.path)))), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,11 @@
 #!/bin/bash
-python adversarial.py &
+# Both processes find the log of the run through its id
+RUN_ID=$(date +%Y%m%d-%H%M%S)-$$
+
+python adversarial.py --run_id $RUN_ID &
 AVALANCHE_PID=$!
 
-python watch.py &
+python watch.py $RUN_ID &
 WATCH_PID=$!
 
 echo "Press Ctrl+C to stop"
@@ -1,5 +1,5 @@
-from learning.model import pick_action, load_net
-from participant import SnowballParticipant
+from learning.model import pick_action, load_net, load_policy
+from participant import ColorTally, SnowballParticipant
 
 
 class Strategy:
@@ -10,17 +10,36 @@ class Strategy:
     NON_ANSWER = 4
     BREAK_SAFETY = 5
     BREAK_LIVENESS = 6
+    # Same as RL using a policy exported with `learning.model.export_policy`
+    RL_EXPORTED = 7
+
+
+# Strategies answering with a policy network
+POLICY_STRATEGIES = (Strategy.RL, Strategy.RL_EXPORTED)
+
+
+def load_strategy_net(strategy, net_name):
+    if strategy == Strategy.RL_EXPORTED:
+        return load_policy(net_name)
+    return load_net(net_name)
 
 
 class AugmentedSnowballParticipant(SnowballParticipant):
-    def __init__(self, self_id, participants, adversary, strategy, alpha, beta, k, net_name='nn'):
-        super().__init__(self_id, participants, alpha, beta, k)
+    def __init__(self, self_id, participants, adversary, strategy, alpha, beta, k, net_name='nn', net=None,
+                 num_colors=2):
+        super().__init__(self_id, participants, alpha, beta, k, num_colors)
         self.adversary = adversary
 
+        # Live color tally of all participants. Set by `SnowballProtocol`
+        self.color_tally = None
+
+        # Shared incremental policy evaluation. Set by `SnowballProtocol`
+        self.policy = None
+
         if self.adversary:
             self.strategy = strategy
-            if strategy == Strategy.RL:
-                self.net = load_net(net_name)
+            if strategy in POLICY_STRATEGIES:
+                self.net = net if net is not None else load_strategy_net(strategy, net_name)
 
     def is_finished(self):
         if self.adversary:
@@ -29,6 +48,22 @@ class AugmentedSnowballParticipant(SnowballParticipant):
         else:
             return super().is_finished()
 
+    def least_frequent(self, participants_objects):
+        if self.color_tally is not None:
+            return self.color_tally.least_frequent
+
+        tally = ColorTally(len(self.colors))
+        for par_id in self.participants:
+            tally[participants_objects[par_id].color] += 1
+
+        return tally.least_frequent
+
+    def split(self, from_id, size, offset=0):
+        """ Color of `from_id` when senders are split in consecutive groups of `size` ids, one per color
+        """
+        group = max(from_id % (size * len(self.colors)) - offset, 0) // size
+        return self.colors[group]
+
     def respond_to_query(self, from_id, color, participants_objects=None, iteration=None):
         if self.adversary:
             # Use private information stored on `self.participants`
@@ -36,12 +71,7 @@ class AugmentedSnowballParticipant(SnowballParticipant):
             if self.strategy == Strategy.TRY_BALANCE:
                 # Return less frequent color
                 # This strategy tries greedily to balance participants
-                snowball_map = {False: 0, True: 0}
-                for par_id in self.participants:
-                    par = participants_objects[par_id]
-                    snowball_map[par.color] += 1
-
-                return snowball_map[True] < snowball_map[False]
+                return self.least_frequent(participants_objects)
 
             elif self.strategy == Strategy.INCREASE_CONFIDENCE:
                 # Return same color as received
@@ -49,21 +79,18 @@ class AugmentedSnowballParticipant(SnowballParticipant):
                 return color
 
             elif self.strategy == Strategy.EQUAL_SPLIT:
-                # Split agents into two groups.
-                return from_id % 2 == 0
+                # Split agents into one group per color.
+                return self.colors[-1 - from_id % len(self.colors)]
 
-            elif self.strategy == Strategy.RL:
+            elif self.strategy in POLICY_STRATEGIES:
                 # Use policy learned through RL
+                if self.policy is not None:
+                    return self.policy.pick_action(from_id)
                 return pick_action(self.net, participants_objects, from_id)
             elif self.strategy == Strategy.NON_ANSWER:
                 # Returning `None` must be interpreted as an adversary simulating a timeout
                 # A correct node must be prepared to this situation as every node can crash at any point
-                snowball_map = {False: 0, True: 0}
-                for par_id in self.participants:
-                    par = participants_objects[par_id]
-                    snowball_map[par.color] += 1
-
-                least_frequent = snowball_map[True] < snowball_map[False]
+                least_frequent = self.least_frequent(participants_objects)
 
                 if least_frequent == color:
                     return color
@@ -73,20 +100,15 @@ class AugmentedSnowballParticipant(SnowballParticipant):
                 if iteration < 100000:
                     # Return less frequent color
                     # This strategy tries greedily to balance participants
-                    snowball_map = {False: 0, True: 0}
-                    for par_id in self.participants:
-                        par = participants_objects[par_id]
-                        snowball_map[par.color] += 1
-
-                    return snowball_map[True] < snowball_map[False]
+                    return self.least_frequent(participants_objects)
                 else:
                     return color
 
             elif self.strategy == Strategy.BREAK_SAFETY:
-                # Split agents into two groups.
+                # Split agents into one group per color.
                 assert iteration is not None
                 if iteration < 100000:
-                    return from_id % 200 >= 100
+                    return self.split(from_id, 100)
                 else:
                     has_finished = False
                     for par_id in self.participants[:10]:
@@ -94,10 +116,10 @@ class AugmentedSnowballParticipant(SnowballParticipant):
                         if par.is_finished():
                             has_finished = True
                     if not has_finished:
-                        return from_id % 200 >= 110
+                        return self.split(from_id, 100, offset=10)
                     else:
                         print('.')
-                        return True
+                        return self.colors[-1]
             else:
                 raise AssertionError(self.strategy)
         else:
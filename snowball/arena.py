@@ -1,62 +1,155 @@
-import logging
-import sys
+""" Parameter sweeps over snowball simulations.
+
+    Every point of the grid (participants, adversary percent, strategy, k, alpha, beta, seed) is run once
+    on a persistent process pool. Results are appended to a CSV table as they arrive, so an interrupted
+    sweep can be resumed: grid points already present in the table with the same settings (engine,
+    iterations, ...) are skipped.
+
+    With `--decrees M` (vectorized engine) every simulation runs M independent decrees and adds one
+    row per decree.
+"""
+import copy
+import csv
+import multiprocessing as mp
+import os
+import time
+from itertools import product
 
 import adversary
 import experiment
-import run
 
-import multiprocessing as mp
-from itertools import repeat, product
+# Columns identifying a grid point. Names match `run.get_arg_parser` arguments
+GRID_COLUMNS = ['num_participants', 'adversary_percent', 'adversary_strategy', 'snowball_k', 'snowball_alpha',
+                'snowball_beta', 'seed']
+
+# Arguments of the whole sweep that change results. Rows are keyed on them too, so sweeps with other
+# settings can share a table
+SETTING_COLUMNS = ['engine', 'batch_size', 'decrees', 'num_colors', 'part_iterations', 'early_stop']
+
+KEY_COLUMNS = GRID_COLUMNS + SETTING_COLUMNS
+
+# `color_counts` are the good participants of each color, space separated in color order.
+# `stop_reason` is empty unless the run was stopped early (`--early_stop`)
+RESULT_COLUMNS = ['decree', 'consensus', 'iterations', 'color_counts', 'wall_time', 'stop_reason']
+
+COLUMNS = KEY_COLUMNS + RESULT_COLUMNS
+
+
+def grid(args):
+    """ List of grid points described by sweep arguments. Unset axes use the single value from `args`
+    """
+    axes = [
+        args.participants or [args.num_participants],
+        args.percents,
+        args.strategies,
+        args.ks or [args.snowball_k],
+        args.alphas or [args.snowball_alpha],
+        args.betas or [args.snowball_beta],
+        args.seeds,
+    ]
+    settings = {column: getattr(args, column) for column in SETTING_COLUMNS}
+    return [dict(zip(GRID_COLUMNS, values), **settings) for values in product(*axes)]
+
+
+def point_key(point):
+    # Unset arguments are written as empty cells
+    return tuple('' if point[column] is None else str(point[column]) for column in KEY_COLUMNS)
+
 
+def estimated_cost(point, part_iterations):
+    # Honest networks finish after a few times beta iterations per participant while
+    # adversarial ones often run until `part_iterations` per participant.
+    iterations = part_iterations if point['adversary_percent'] > 0 else 2 * point['snowball_beta']
+    return point['num_participants'] * point['snowball_k'] * iterations
 
-def setup_logger(name, log_file, level=logging.INFO):
-    formatter = logging.Formatter('%(asctime)s| %(message)s')
 
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setFormatter(formatter)
+def table_columns(path):
+    """ Header of the table at `path`, None if there is no table yet
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
 
-    stdout_handler = logging.StreamHandler(sys.stdout)
-    stdout_handler.setFormatter(formatter)
+    with open(path, newline='') as f:
+        return next(csv.reader(f))
 
-    logger = logging.getLogger(name)
-    logger.setLevel(level)
 
-    if not logger.handlers:
-        logger.addHandler(file_handler)
-        logger.addHandler(stdout_handler)
+def load_done(path):
+    if not os.path.exists(path):
+        return set()
 
-    return logger
+    with open(path, newline='') as f:
+        return {point_key(row) for row in csv.DictReader(f)}
+
+
+def color_counts(counts):
+    return ' '.join(str(int(count)) for count in counts)
 
 
 def execute_snowball(inputs):
-    args, (p, s) = inputs
-    args.adversary_percent = p
-    args.adversary_strategy = getattr(adversary.Strategy, s)
+    args, point = inputs
+
+    args = copy.copy(args)
+    for column, value in point.items():
+        setattr(args, column, value)
+
+    args.adversary_strategy = getattr(adversary.Strategy, point['adversary_strategy'])
+    args.verbose_every = None
+    args.record = False
+
+    start = time.time()
     proto = experiment.snowball(args)
+    wall_time = round(time.time() - start, 3)
+
+    if args.decrees == 1:
+        row = dict(point)
+        row.update(decree=0, consensus=int(proto.consensus), iterations=proto.iteration,
+                   color_counts=color_counts(proto.snowball_map.values()), wall_time=wall_time,
+                   stop_reason=proto.stop_reason or '')
+        return [row]
+
+    rows = []
+    for decree, (consensus, iterations, counts) in enumerate(
+            zip(proto.decree_consensus, proto.decree_iteration, proto.color_counts)):
+        row = dict(point)
+        row.update(decree=decree, consensus=int(consensus), iterations=int(iterations),
+                   color_counts=color_counts(counts), wall_time=wall_time, stop_reason='')
+        rows.append(row)
+    return rows
+
+
+def main(args):
+    points = grid(args)
+    done = load_done(args.output)
+
+    pending = [point for point in points if point_key(point) not in done]
+    # Schedule longest jobs first so the pool doesn't wait on a straggler at the end
+    pending.sort(key=lambda point: estimated_cost(point, args.part_iterations), reverse=True)
 
-    logger.info(f"Percent: {p} Strategy: {s}")
-    logger.info(f"Consensus: {int(proto.consensus)} Iteration: {proto.iteration}")
-    logger.info(str(proto.snowball_map))
+    print(f"Grid points: {len(points)} Done: {len(points) - len(pending)} Pending: {len(pending)}")
 
+    if not pending:
+        return
 
-def main(args, logger):
-    S = adversary.Strategy
-    percents = [0., .05, .1, .15, .17, .18, .19, .20]
-    strategies = ["INCREASE_CONFIDENCE", "EQUAL_SPLIT", "NON_ANSWER"]
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
 
-    logger.info("Start run")
-    num_proc = mp.cpu_count() + 2
+    write_header = table_columns(args.output) is None
 
-    for i in range(5):
-        params = list(zip(repeat(args), product(percents, strategies)))
+    with open(args.output, 'a', newline='') as f, mp.Pool(args.workers or mp.cpu_count()) as pool:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
 
-        with mp.Pool(num_proc) as p:
-            p.map(execute_snowball, params)
+        if write_header:
+            writer.writeheader()
 
+        jobs = [(args, point) for point in pending]
 
-if __name__ == '__main__':
-    parser = run.get_arg_parser()
-    args = parser.parse_args()
+        for count, rows in enumerate(pool.imap_unordered(execute_snowball, jobs, args.chunksize), 1):
+            writer.writerows(rows)
+            f.flush()
 
-    logger = setup_logger('measure', 'log/test09172018.log')
-    main(args, logger)
+            point = rows[0]
+            consensus = sum(row['consensus'] for row in rows)
+            iterations = sum(row['iterations'] for row in rows) / len(rows)
+            print(f"[{count}/{len(jobs)}] Percent: {point['adversary_percent']} Strategy: {point['adversary_strategy']}"
+                  f" Consensus: {consensus}/{len(rows)} Iteration: {iterations:.0f}")
@@ -0,0 +1,226 @@
+import heapq
+import itertools
+import math
+from bisect import bisect_right
+
+import numpy as np
+
+from protocol import SnowballProtocol
+
+# Event kinds
+QUERY = 0
+ROUND = 1
+
+
+def percentiles(values, q=(50, 90, 99, 100)):
+    """ Percentiles `q` of `values` as {percentile: value}, empty without values
+    """
+    values = list(values)
+    if not values:
+        return {}
+    return dict(zip(q, np.percentile(values, q).tolist()))
+
+
+class RandomLatency:
+    """ Independent message delays with distribution `draw(rng, size)`, drawn in blocks
+    """
+
+    def __init__(self, draw, rng, block=1 << 16):
+        self.draw = draw
+        self.rng = rng
+        self.block = block
+        self.delays = []
+        self.position = 0
+
+    def __call__(self, from_id, to_ids):
+        size = len(to_ids)
+        start = self.position
+
+        if start + 2 * size > len(self.delays):
+            self.delays = self.draw(self.rng, self.block).tolist()
+            start = 0
+
+        self.position = start + 2 * size
+        return self.delays[start:start + size], self.delays[start + size:self.position]
+
+
+def make_latency(name, mean, rng):
+    """ Message delays in seconds with distribution `name` and given mean.
+
+        Latencies are callables `latency(from_id, to_ids)` returning the delays of queries sent from
+        `from_id` to each of `to_ids` and of their responses, as two lists. Any such callable can be
+        used instead, for example to model topology. A delay of `math.inf` drops the message.
+    """
+    if name == 'constant':
+        return lambda from_id, to_ids: ([mean] * len(to_ids), [mean] * len(to_ids))
+    elif name == 'uniform':
+        return RandomLatency(lambda rng, size: rng.uniform(0, 2 * mean, size), rng)
+    elif name == 'exponential':
+        return RandomLatency(lambda rng, size: rng.exponential(mean, size), rng)
+    elif name == 'lognormal':
+        # Heavy tail with sigma = 1
+        mu = math.log(mean) - .5
+        return RandomLatency(lambda rng, size: rng.lognormal(mu, 1., size), rng)
+    else:
+        raise AssertionError(name)
+
+
+class EventSnowballProtocol(SnowballProtocol):
+    """ Snowball simulation driven by a priority queue of timestamped events on simulated time.
+
+        Every good participant runs query rounds back to back, `query_interval` seconds apart. A round
+        sends `k` queries at once and ends when all responses arrived or `timeout` seconds after it
+        started. Each message is delayed by `latency` and a response arriving after the timeout is a
+        `None` vote, the same as an adversary not answering. Queried participants answer with their
+        color at the time the query arrives.
+
+        Good participants only change color at the end of their rounds, so their colors are kept as a
+        log of changes and looked up when the round ends. Besides round ends, only queries to adversaries
+        are events.
+
+        `iteration` is the number of rounds completed and `step` advances the simulation until the
+        next one. Adversaries don't query, so the budget is `part_iterations` rounds per good participant.
+    """
+
+    def __init__(self, args, net=None, latency=None):
+        self.rng = np.random.default_rng(args.seed)
+        self.latency = latency or make_latency(args.latency, args.latency_mean, self.rng)
+        self.timeout = args.timeout
+        self.query_interval = args.query_interval
+
+        self.events = None
+        self.sequence = None
+        self.time = 0.
+        self.color_log = None
+        self.subsets = []
+        self.finality = None
+        self.timeouts = 0
+
+        super().__init__(args, net)
+        self.top_iterations = args.part_iterations * self.good_num
+
+    def reset(self):
+        super().reset()
+
+        self.time = 0.
+        self.timeouts = 0
+        self.events = []
+        # Ties are resolved in scheduling order
+        self.sequence = itertools.count()
+
+        # Color changes of every participant as (times, colors)
+        self.color_log = [([-math.inf], [part.color]) for part in self.participant_objects]
+        # Simulated time each good participant finished at
+        self.finality = {}
+
+        for part in self.running_participants:
+            if not part.adversary:
+                self.start_round(part, 0.)
+
+    def schedule(self, time, kind, payload):
+        heapq.heappush(self.events, (time, next(self.sequence), kind, payload))
+
+    def get_subset(self, from_id):
+        """ Sample `k` distinct participants other than `from_id`, drawn in blocks
+        """
+        if not self.subsets:
+            num_participants = len(self.participant_objects)
+            rows = self.rng.integers(0, num_participants - 1, size=(1 << 12, self.k))
+            distinct = (np.diff(np.sort(rows, axis=1), axis=1) != 0).all(axis=1)
+            # A flat list holds no containers, which keeps garbage collection cheap
+            self.subsets = rows[distinct].ravel().tolist()
+
+        subset = self.subsets[-self.k:]
+        del self.subsets[-self.k:]
+
+        # Same trick as `VectorizedSnowballProtocol.get_subsets`: shift values to skip the sender
+        return [part_id + (part_id >= from_id) for part_id in subset]
+
+    def start_round(self, part, start):
+        from_id = part.self_id
+        subset = self.get_subset(from_id)
+        votes = [None] * self.k
+        # Good participants queried and the time the query reached them
+        arrivals = []
+
+        deadline = start + self.timeout
+        end = start
+
+        query_delays, response_delays = self.latency(from_id, subset)
+
+        for ix, (part_id, query_delay, response_delay) in enumerate(zip(subset, query_delays, response_delays)):
+            arrival = start + query_delay
+            response = arrival + response_delay
+
+            if response > deadline:
+                self.timeouts += 1
+                end = deadline
+                continue
+
+            if response > end:
+                end = response
+
+            # Participants [good_num, num_participants) are adversaries
+            if part_id >= self.good_num:
+                self.schedule(arrival, QUERY, (from_id, part_id, part.color, votes, ix))
+            else:
+                arrivals.append((ix, part_id, arrival))
+
+        self.schedule(end, ROUND, (part, subset, votes, arrivals))
+
+    def query(self, from_id, part_id, color, votes, ix):
+        votes[ix] = self.participant_objects[part_id].respond_to_query(
+            from_id, color, self.participant_objects, iteration=self.iteration)
+
+    def end_round(self, part, subset, votes, arrivals):
+        color_log = self.color_log
+        for ix, part_id, arrival in arrivals:
+            times, colors = color_log[part_id]
+            votes[ix] = colors[bisect_right(times, arrival) - 1]
+
+        color = part.color
+        part.snowball_iteration_post(subset, votes)
+        self.log(part.self_id, subset, votes)
+
+        if part.color != color:
+            times, colors = self.color_log[part.self_id]
+            times.append(self.time)
+            colors.append(part.color)
+
+        for observer in self.observers:
+            observer.update(part)
+
+        if self.terminations and self.terminated(part):
+            return
+
+        if part.is_finished():
+            self.finality[part.self_id] = self.time
+            self.running_participants.remove(part)
+        else:
+            self.start_round(part, self.time + self.query_interval)
+
+    def advance(self):
+        while self.events:
+            self.time, _, kind, payload = heapq.heappop(self.events)
+
+            if kind == QUERY:
+                self.query(*payload)
+                continue
+
+            self.end_round(*payload)
+            self.iteration += 1
+            break
+
+        if self.stop_reason is not None:
+            return True
+
+        if len(self.running_participants) == self.adversaries_num:
+            # All good participants are committed to some value
+            return True
+
+        return self.iteration == self.top_iterations
+
+    def finality_percentiles(self, q=(50, 90, 99, 100)):
+        """ Simulated time until good participants finished, as {percentile: seconds}
+        """
+        return percentiles(self.finality.values(), q)
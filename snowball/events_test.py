@@ -0,0 +1,57 @@
+import math
+import unittest
+
+from snowball.adversary import Strategy
+from snowball.events import EventSnowballProtocol
+from snowball.testing import make_args, run_protocol
+
+NETWORK = dict(latency='constant', latency_mean=.1, timeout=1., seed=0)
+
+
+class EventSnowballTest(unittest.TestCase):
+
+    def test_finality(self):
+        args = make_args(200, 0., Strategy.INCREASE_CONFIDENCE, **NETWORK)
+        proto = run_protocol(EventSnowballProtocol(args))
+
+        self.assertTrue(proto.consensus)
+        self.assertEqual(len(proto.finality), proto.good_num)
+
+        # Rounds take a round trip and participants need at least beta + 1 successful rounds
+        round_time = 2 * args.latency_mean
+        self.assertGreaterEqual(min(proto.finality.values()), (args.snowball_beta + 1) * round_time - 1e-9)
+
+        percentiles = list(proto.finality_percentiles().values())
+        self.assertEqual(percentiles, sorted(percentiles))
+        self.assertAlmostEqual(percentiles[-1], proto.time)
+
+    def test_timeout(self):
+        # Responses never arrive in time
+        args = make_args(50, 0., Strategy.INCREASE_CONFIDENCE, **dict(NETWORK, timeout=.15, part_iterations=10))
+        proto = run_protocol(EventSnowballProtocol(args))
+
+        self.assertEqual(proto.iteration, proto.top_iterations)
+        self.assertEqual(proto.timeouts, proto.k * (proto.iteration + proto.good_num))
+        self.assertFalse(proto.finality)
+        self.assertAlmostEqual(proto.time, args.part_iterations * args.timeout)
+
+    def test_dropped_messages(self):
+        args = make_args(100, .1, Strategy.INCREASE_CONFIDENCE, record=True, **NETWORK)
+
+        good_num = 90
+
+        def latency(from_id, to_ids):
+            # Adversaries are unreachable
+            delays = [math.inf if to_id >= good_num else .05 for to_id in to_ids]
+            return delays, delays
+
+        proto = run_protocol(EventSnowballProtocol(args, latency=latency))
+
+        self.assertTrue(proto.consensus)
+        for step in proto.history:
+            for part_id, vote in zip(step['q_participants'], step['votes']):
+                self.assertEqual(vote is None, part_id >= good_num)
+
+
+if __name__ == "__main__":
+    unittest.main()
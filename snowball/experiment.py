@@ -1,19 +1,54 @@
-import matplotlib
-
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
-import numpy as np
-import scipy.stats as ss
-from matplotlib.animation import FuncAnimation
+import random
 
 from protocol import SnowballProtocol
 
 
+def make_protocol(args):
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    if args.engine == 'vectorized':
+        from vectorized import VectorizedSnowballProtocol
+        return VectorizedSnowballProtocol(args)
+
+    # Only the vectorized engine runs several decrees at once
+    assert args.decrees == 1, args.decrees
+
+    if args.engine == 'events':
+        from events import EventSnowballProtocol
+        return EventSnowballProtocol(args)
+
+    if args.engine == 'async':
+        from runtime import AsyncSnowballProtocol
+        return AsyncSnowballProtocol(args)
+
+    return SnowballProtocol(args)
+
+
+def format_percentiles(percentiles):
+    return " ".join(f"p{q}: {t:.3f}s" for q, t in percentiles.items())
+
+
 def snowball(args):
-    proto = SnowballProtocol(args)
+    proto = make_protocol(args)
+
+    if args.early_stop:
+        from termination import make_terminations
+
+        assert args.engine != 'vectorized', args.engine
+        proto.terminations = make_terminations(args, proto)
 
     verbose = args.verbose_every is not None
 
+    recorder = None
+    if args.metrics_dir is not None:
+        from metrics import MetricsRecorder
+
+        assert args.engine != 'vectorized', args.engine
+        recorder = MetricsRecorder(args.metrics_dir, args.metrics_every, proto.participant_objects, proto.num_colors,
+                                   proto.beta)
+        proto.observers.append(recorder)
+
     if verbose:
         print("Running snowball")
         print(proto.snowball_map)
@@ -30,34 +65,45 @@ def snowball(args):
     if verbose:
         print("Consensus:", proto.consensus)
         print("Snowball iterations:", proto.iteration)
+        if proto.stop_reason is not None:
+            print("Stopped early:", proto.stop_reason)
         print(proto.snowball_map)
 
-    return proto
+        if args.decrees > 1:
+            iterations = proto.decree_iteration
+            print(f"Decrees with consensus: {proto.decree_consensus.sum()}/{args.decrees}")
+            print(f"Decree iterations: mean {iterations.mean():.1f} std {iterations.std():.1f}"
+                  f" min {iterations.min()} max {iterations.max()}")
 
+        if args.engine == 'events':
+            print(f"Simulated time: {proto.time:.3f}s Rounds per second: {proto.iteration / proto.time:.1f}"
+                  f" Timeouts: {proto.timeouts}")
+            print("Time to finality:", format_percentiles(proto.finality_percentiles()))
 
-def snowball_plt(args):
-    proto = SnowballProtocol(args)
+        if args.engine == 'async':
+            print(f"Wall time: {proto.wall_time:.3f}s Rounds per second: {proto.iteration / proto.wall_time:.1f}"
+                  f" Timeouts: {proto.timeouts} Max queries in flight: {proto.max_in_flight}")
+            print("Round time:", format_percentiles(proto.round_percentiles()))
+            print("Time to finality:", format_percentiles(proto.finality_percentiles()))
 
-    snowball_map = proto.snowball_map
-    fig = plt.figure()
+    if recorder is not None:
+        recorder.close()
 
-    col_dist = fig.add_subplot(221)
-    pnts = col_dist.scatter([0, 1], [snowball_map[True], snowball_map[False]], color="red blue".split())
-    col_dist.set_xlim(-1, 2)
-    col_dist.set_ylim(0, proto.good_num)
+    return proto
+
+
+def snowball_plt(args):
+    import matplotlib.pyplot as plt
+    from matplotlib.animation import FuncAnimation
 
-    corr_ax = fig.add_subplot(222)
-    corr_ax.set_title("Count confidence correlation")
+    from metrics import MetricsView, SnowballMetrics
 
-    count_ax = fig.add_subplot(223)
-    count_ax.set_title("Participants count distribution")
-    count_true_line, = count_ax.plot([], [], color="red")
-    count_false_line, = count_ax.plot([], [], color="blue")
+    proto = SnowballProtocol(args)
 
-    confidence_ax = fig.add_subplot(224)
-    confidence_ax.set_title("Participants confidence distribution")
-    confidence_true_line, = confidence_ax.plot([], [], color="red")
-    confidence_false_line, = confidence_ax.plot([], [], color="blue")
+    # Histograms are updated as participants change, so frames don't scan the participants
+    metrics = SnowballMetrics(proto.participant_objects, proto.num_colors, proto.beta)
+    proto.observers.append(metrics)
+    view = MetricsView(proto.num_colors)
 
     proto._removed = False
 
@@ -68,78 +114,17 @@ def snowball_plt(args):
                 break
 
         if args.remove_after is not None and not proto._removed:
-            min_confidence = min(x.confidence for x in proto.participant_objects if not x.adversary)
-
             # Remove adversaries after all participants has confidence greater than some threshold
-            if min_confidence >= args.remove_after:
+            if metrics.min_confidence() >= args.remove_after:
                 proto._removed = True
                 proto.remove_adversaries()
 
-        snowball_map = {False: 0, True: 0}
-        count_map = {False: [], True: []}
-        confidence_map = {False: [], True: []}
-
-        for part in proto.participant_objects:
-            # Only check for color of non adversarial participants
-            if not part.adversary:
-                snowball_map[part.color] += 1
-                count_map[part.color].append(part.count)
-                confidence_map[part.color].append(part.confidence)
-
-        def kde_helper(data, x, line):
-            max_y = 0
-            try:
-                kde = ss.gaussian_kde(data)
-                y = kde(x)
-                max_y = max(y)
-                line.set_data(x, y)
-            # Exceptions to handle degenerated data
-            except np.linalg.linalg.LinAlgError:
-                pass
-            except ValueError:
-                pass
-            finally:
-                return max_y
-
-        # Count graphic update
-        max_count = max(count_map[True] + count_map[False])
-        xcount = np.linspace(0, max_count, 1000)
-        count_ax.set_xlim(0, max_count)
-        count_ax_ylim = 0
-
-        count_ax_ylim = max(count_ax_ylim, kde_helper(count_map[True], xcount, count_true_line))
-        count_ax_ylim = max(count_ax_ylim, kde_helper(count_map[False], xcount, count_false_line))
-
-        count_ax.set_ylim(0, count_ax_ylim)
-
-        # Confidence graphic update
-
-        max_confidence = max(confidence_map[True] + confidence_map[False])
-        xconfidence = np.linspace(0, max_confidence, 1000)
-        confidence_ax.set_xlim(0, max_confidence)
-        confidence_ax_ylim = 0
-        confidence_ax_ylim = max(confidence_ax_ylim,
-                                 kde_helper(confidence_map[True], xconfidence, confidence_true_line))
-        confidence_ax_ylim = max(confidence_ax_ylim,
-                                 kde_helper(confidence_map[False], xconfidence, confidence_false_line))
-
-        confidence_ax.set_ylim(0, confidence_ax_ylim)
-
-        pnts.set_offsets([[0, snowball_map[True]], [1, snowball_map[False]]])
-
-        corr_ax.clear()
-        corr_ax.set_title("Count confidence correlation")
-        corr_ax.scatter(count_map[True], confidence_map[True], color='red')
-        corr_ax.scatter(count_map[False], confidence_map[False], color='blue')
-        corr_ax.set_ylim(0, None)
-
-        col_dist.set_title(
-            f"Iteration: {proto.iteration} Red: {snowball_map[True]} Blue: {snowball_map[False]}"
-            f" {'OFF' if proto._removed else 'ON'}")
-
-        return pnts, count_true_line, count_false_line
+        snowball_map = proto.snowball_map
+        view.update(metrics.snapshot(),
+                    f"Iteration: {proto.iteration} Red: {snowball_map[True]} Blue: {snowball_map[False]}"
+                    f" {'OFF' if proto._removed else 'ON'}")
 
     print("Snowball")
 
-    _ = FuncAnimation(fig, update, interval=1, repeat=False)
+    _ = FuncAnimation(view.figure, update, interval=1, repeat=False, cache_frame_data=False)
     plt.show()
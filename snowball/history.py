@@ -0,0 +1,177 @@
+import json
+import os
+
+import numpy as np
+
+from participant import BINARY_COLORS, color_values
+
+# Vote encoding. `None` stands for a node that didn't answer on timeout
+VOTE_FALSE = 0
+VOTE_TRUE = 1
+NO_VOTE = -1
+
+# Participants row of steps performed by an adversary (nobody is queried)
+NO_QUERY = -1
+
+COLUMNS = (('senders', np.int32), ('participants', np.int32), ('votes', np.int8))
+
+
+def encode_vote(vote):
+    return NO_VOTE if vote is None else int(vote)
+
+
+def decode_vote(vote, colors=BINARY_COLORS):
+    return None if vote == NO_VOTE else colors[vote]
+
+
+class History:
+    """ Record of protocol steps stored in growable typed arrays.
+
+        Every step stores the sender (int32), the `k` queried participants (int32) and their votes (int8),
+        as color index for Snowball with `num_colors` colors.
+        When `path` is given arrays are memory mapped files in that directory, so long runs can be kept
+        on disk and replayed later with `History.load`.
+    """
+
+    def __init__(self, k, path=None, capacity=1 << 12, num_colors=2):
+        self.k = k
+        self.colors = color_values(num_colors)
+        self.path = path
+        self.length = 0
+        self.readonly = False
+
+        self._senders = None
+        self._participants = None
+        self._votes = None
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+        self._allocate(capacity)
+
+    @classmethod
+    def load(cls, path):
+        """ Read only history previously recorded on `path`
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        history = cls.__new__(cls)
+        history.k = meta['k']
+        history.colors = color_values(meta.get('num_colors', 2))
+        history.path = path
+        history.length = meta['length']
+        history.readonly = True
+
+        for name, dtype in COLUMNS:
+            shape = history._shape(name, history.length)
+            data = np.memmap(os.path.join(path, f'{name}.bin'), dtype=dtype, mode='r', shape=shape) \
+                if history.length > 0 else np.zeros(shape, dtype=dtype)
+            setattr(history, f'_{name}', data)
+
+        return history
+
+    def _shape(self, name, capacity):
+        return (capacity,) if name == 'senders' else (capacity, self.k)
+
+    def _allocate(self, capacity):
+        for name, dtype in COLUMNS:
+            shape = self._shape(name, capacity)
+            old = getattr(self, f'_{name}')
+
+            if self.path is None:
+                data = np.empty(shape, dtype=dtype)
+                if old is not None:
+                    data[:self.length] = old[:self.length]
+            else:
+                filename = os.path.join(self.path, f'{name}.bin')
+
+                if old is not None:
+                    old.flush()
+                    del old
+
+                # Grow file in place and map it again
+                with open(filename, 'ab') as f:
+                    f.truncate(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+
+                data = np.memmap(filename, dtype=dtype, mode='r+', shape=shape)
+
+            setattr(self, f'_{name}', data)
+
+    @property
+    def capacity(self):
+        return len(self._senders)
+
+    def _view(self, data):
+        view = data[:self.length]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def senders(self):
+        return self._view(self._senders)
+
+    @property
+    def participants(self):
+        return self._view(self._participants)
+
+    @property
+    def votes(self):
+        return self._view(self._votes)
+
+    def append(self, from_id, participants, votes):
+        assert not self.readonly
+
+        if self.length == self.capacity:
+            self._allocate(2 * self.capacity)
+
+        n = self.length
+        self._senders[n] = from_id
+
+        if participants is None:
+            self._participants[n] = NO_QUERY
+            self._votes[n] = NO_VOTE
+        else:
+            self._participants[n] = participants
+            self._votes[n] = [encode_vote(v) for v in votes]
+
+        self.length += 1
+
+    def clear(self):
+        self.length = 0
+
+    def flush(self):
+        if self.path is None:
+            return
+
+        for name, _ in COLUMNS:
+            getattr(self, f'_{name}').flush()
+
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump({'k': self.k, 'length': self.length, 'num_colors': len(self.colors)}, f)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, ix):
+        """ Step `ix` in the same format as `SnowballProtocol.log` used to store it
+        """
+        if ix < 0:
+            ix += self.length
+        if not 0 <= ix < self.length:
+            raise IndexError(ix)
+
+        participants = self._participants[ix]
+
+        if participants[0] == NO_QUERY:
+            return {'from': int(self._senders[ix]), 'q_participants': None, 'votes': None}
+
+        return {
+            'from': int(self._senders[ix]),
+            'q_participants': participants.tolist(),
+            'votes': [decode_vote(v, self.colors) for v in self._votes[ix]]
+        }
+
+    def __iter__(self):
+        for ix in range(self.length):
+            yield self[ix]
@@ -0,0 +1,50 @@
+import tempfile
+import unittest
+
+from snowball.adversary import Strategy
+from snowball.history import History
+from snowball.protocol import SnowballProtocol
+from snowball.testing import make_args, run_protocol
+
+
+class HistoryTest(unittest.TestCase):
+
+    def _fill(self, history, steps):
+        for i in range(steps):
+            if i % 3 == 0:
+                history.append(i, None, None)
+            else:
+                history.append(i, [i, i + 1, i + 2], [True, None, False])
+
+    def test_growth(self):
+        history = History(3, capacity=2)
+        self._fill(history, 100)
+
+        self.assertEqual(len(history), 100)
+        self.assertEqual(history[0], {'from': 0, 'q_participants': None, 'votes': None})
+        self.assertEqual(history[-2], {'from': 98, 'q_participants': [98, 99, 100], 'votes': [True, None, False]})
+        self.assertEqual(history.participants.shape, (100, 3))
+        self.assertFalse(history.votes.flags.writeable)
+
+    def test_memory_mapped(self):
+        with tempfile.TemporaryDirectory() as path:
+            history = History(3, path, capacity=4)
+            self._fill(history, 50)
+            history.flush()
+
+            loaded = History.load(path)
+            self.assertEqual(len(loaded), 50)
+            self.assertEqual(list(loaded), list(history))
+
+    def test_protocol_record(self):
+        with tempfile.TemporaryDirectory() as path:
+            args = make_args(100, .1, Strategy.EQUAL_SPLIT, part_iterations=20, history_path=path, record=True)
+            proto = run_protocol(SnowballProtocol(args))
+
+            loaded = History.load(path)
+            self.assertEqual(len(loaded), proto.iteration)
+            self.assertEqual(loaded[-1], proto.history[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
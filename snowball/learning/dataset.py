@@ -0,0 +1,181 @@
+""" Columnar on-disk dataset for supervised training.
+
+    A dataset is a directory of shards. Each shard is a directory with one `.npy` file per column,
+    written by a single process, so workers never need to synchronize. Shards are written to a
+    temporary directory and renamed when complete, so readers never see partial shards.
+
+    States are stored once per step as delta encoded `Snapshots` and samples refer to them by index.
+"""
+import bisect
+import os
+
+import numpy as np
+import torch.utils.data
+
+from learning.model import path
+
+NUM_FEATURES = 12
+
+KEYFRAME_INTERVAL = 32
+
+# Column name -> dtype
+COLUMNS = {
+    'keyframe_interval': np.int32,  # [1]
+    'keyframes': np.float32,  # [K, P, NUM_FEATURES] full snapshots
+    'delta_rows': np.int32,  # [D] participant of each changed row
+    'delta_values': np.float32,  # [D, NUM_FEATURES]
+    'delta_offsets': np.int64,  # [S + 1] rows of snapshot i are delta_offsets[i]:delta_offsets[i + 1]
+    'state_index': np.int32,  # [N] snapshot of each sample
+    'sender': np.float32,  # [N, NUM_FEATURES]
+    'action': np.uint8,  # [N]
+    'value': np.float32,  # [N]
+}
+
+TMP_SUFFIX = '.tmp'
+
+
+class Snapshots:
+    """ Sequence of participant feature matrices.
+
+        Every `keyframe_interval` snapshots one is stored in full; the others only store the rows
+        that changed since the previous snapshot.
+    """
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.keyframes = []
+        self.delta_rows = []
+        self.delta_values = []
+        self.delta_offsets = [0]
+
+        # Last decoded snapshot as (index, features)
+        self.cache = (None, None)
+
+    @classmethod
+    def from_arrays(cls, keyframes, delta_rows, delta_values, delta_offsets, keyframe_interval=KEYFRAME_INTERVAL):
+        snapshots = cls(keyframe_interval)
+        snapshots.keyframes = keyframes
+        snapshots.delta_rows = delta_rows
+        snapshots.delta_values = delta_values
+        snapshots.delta_offsets = delta_offsets
+        return snapshots
+
+    def __len__(self):
+        return len(self.delta_offsets) - 1
+
+    def append(self, features, rows):
+        """ Add snapshot `features` where only `rows` changed since the previous one. Return its index
+        """
+        ix = len(self)
+
+        if ix % self.keyframe_interval == 0:
+            self.keyframes.append(np.asarray(features, dtype=np.float32))
+        else:
+            rows = np.fromiter(sorted(rows), dtype=np.int32, count=len(rows))
+            self.delta_rows.extend(rows)
+            self.delta_values.extend(features[rows])
+
+        self.delta_offsets.append(len(self.delta_rows))
+        return ix
+
+    def __getitem__(self, ix):
+        cached_ix, cached = self.cache
+
+        if cached_ix is not None and cached_ix <= ix and cached_ix // self.keyframe_interval == ix // self.keyframe_interval:
+            # Continue decoding from last snapshot of the same group
+            start, features = cached_ix + 1, cached.copy()
+        else:
+            keyframe = ix // self.keyframe_interval
+            start, features = keyframe * self.keyframe_interval + 1, np.array(self.keyframes[keyframe])
+
+        if start <= ix:
+            lo, hi = self.delta_offsets[start], self.delta_offsets[ix + 1]
+            rows = np.asarray(self.delta_rows[lo:hi], dtype=np.int32)
+            values = np.asarray(self.delta_values[lo:hi], dtype=np.float32).reshape(-1, NUM_FEATURES)
+            # Later snapshots come last so they overwrite older values of the same row
+            features[rows] = values
+
+        self.cache = (ix, features)
+        return features.copy()
+
+    def arrays(self):
+        if len(self.keyframes) > 0:
+            keyframes = np.asarray(self.keyframes, dtype=np.float32).reshape(-1, len(self.keyframes[0]), NUM_FEATURES)
+        else:
+            # Simulations without samples have no snapshots
+            keyframes = np.zeros((0, 0, NUM_FEATURES), dtype=np.float32)
+
+        return {
+            'keyframe_interval': np.array([self.keyframe_interval], dtype=np.int32),
+            'keyframes': keyframes,
+            'delta_rows': np.asarray(self.delta_rows, dtype=np.int32),
+            'delta_values': np.asarray(self.delta_values, dtype=np.float32).reshape(-1, NUM_FEATURES),
+            'delta_offsets': np.asarray(self.delta_offsets, dtype=np.int64),
+        }
+
+
+def dataset_path(name):
+    return os.path.join(path('dataset'), name)
+
+
+def write_shard(directory, name, snapshots, state_index, sender, action, value):
+    columns = snapshots.arrays()
+    columns.update(state_index=state_index, sender=sender, action=action, value=value)
+
+    shard = os.path.join(directory, name)
+    tmp = shard + TMP_SUFFIX
+    os.makedirs(tmp, exist_ok=True)
+
+    for column, dtype in COLUMNS.items():
+        data = np.asarray(columns[column], dtype=dtype)
+
+        if column == 'sender':
+            data = data.reshape(-1, NUM_FEATURES)
+
+        np.save(os.path.join(tmp, f'{column}.npy'), data)
+
+    os.replace(tmp, shard)
+    return shard
+
+
+def list_shards(directory):
+    if not os.path.exists(directory):
+        return []
+
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if not name.endswith(TMP_SUFFIX))
+
+
+class ShardedDataset(torch.utils.data.Dataset):
+    """ Memory mapped view over every shard of a dataset directory
+    """
+
+    def __init__(self, directory):
+        self.shards = []
+        self.snapshots = []
+        self.offsets = [0]
+
+        for shard in list_shards(directory):
+            # Copy on write mapping gives writable arrays without reading the file
+            columns = {column: np.load(os.path.join(shard, f'{column}.npy'), mmap_mode='c') for column in COLUMNS}
+
+            if len(columns['action']) == 0:
+                continue
+
+            self.shards.append(columns)
+            self.snapshots.append(Snapshots.from_arrays(columns['keyframes'], columns['delta_rows'],
+                                                        columns['delta_values'], columns['delta_offsets'],
+                                                        int(columns['keyframe_interval'][0])))
+            self.offsets.append(self.offsets[-1] + len(columns['action']))
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def __getitem__(self, ix):
+        shard = bisect.bisect_right(self.offsets, ix) - 1
+        columns = self.shards[shard]
+        ix -= self.offsets[shard]
+
+        return (torch.from_numpy(self.snapshots[shard][columns['state_index'][ix]]),
+                torch.from_numpy(columns['sender'][ix]),
+                int(columns['action'][ix]),
+                float(columns['value'][ix]))
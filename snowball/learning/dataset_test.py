@@ -0,0 +1,67 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from snowball.learning.dataset import ShardedDataset, Snapshots, write_shard
+
+
+class DatasetTest(unittest.TestCase):
+
+    def _snapshots(self, count, num_participants=50):
+        snapshots = Snapshots(keyframe_interval=4)
+        states = []
+
+        features = np.random.rand(num_participants, 12).astype(np.float32)
+        for _ in range(count):
+            rows = set(np.random.choice(num_participants, 3).tolist())
+            for row in rows:
+                features[row] = np.random.rand(12)
+
+            snapshots.append(features.copy(), rows)
+            states.append(features.copy())
+
+        return snapshots, states
+
+    def test_snapshots(self):
+        snapshots, states = self._snapshots(30)
+
+        for ix in list(range(30)) + list(np.random.permutation(30)):
+            np.testing.assert_array_equal(snapshots[ix], states[ix])
+
+    def test_shards(self):
+        with tempfile.TemporaryDirectory() as directory:
+            expected = []
+
+            for num in range(3):
+                snapshots, states = self._snapshots(10)
+                state_index = np.random.randint(0, 10, 20)
+                sender = np.random.rand(20, 12)
+                action = np.random.randint(0, 2, 20)
+                value = np.random.rand(20)
+
+                write_shard(directory, f'shard-{num}', snapshots, state_index, sender, action, value)
+                expected.extend((states[s], f, a) for s, f, a in zip(state_index, sender, action))
+
+            dataset = ShardedDataset(directory)
+            self.assertEqual(len(dataset), 60)
+
+            for ix, (state, sender, action) in enumerate(expected):
+                s, f, a, _ = dataset[ix]
+                np.testing.assert_array_equal(s.numpy(), state)
+                np.testing.assert_allclose(f.numpy(), sender, rtol=1e-6)
+                self.assertEqual(a, action)
+
+    def test_empty_shard(self):
+        with tempfile.TemporaryDirectory() as directory:
+            write_shard(directory, 'shard-0', Snapshots(), [], [], [], [])
+
+            columns = Snapshots().arrays()
+            self.assertEqual(columns['keyframes'].shape, (0, 0, 12))
+            self.assertEqual(columns['delta_values'].shape, (0, 12))
+
+            self.assertEqual(len(ShardedDataset(directory)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,6 @@
 import os
+import random
+from typing import Optional
 
 import numpy as np
 import torch
@@ -21,32 +23,50 @@ class PolicyValueNetwork(nn.Module):
         self.value_head = nn.Linear(self.H, 1)
         self.action_head = nn.Linear(2 * self.H, 2)
 
+    @torch.jit.export
     def participants_embed(self, participants):
         participants = F.relu(self.participant0(participants))
         participants = F.relu(self.participant1(participants))
         return participants
 
-    def forward(self, participants, sender=None):
+    @torch.jit.export
+    def state_embed(self, pooled):
+        state = F.relu(self.state0(pooled))
+        state = F.relu(self.state1(state))
+        return state
+
+    @torch.jit.export
+    def value(self, state):
+        return self.value_head(state)
+
+    @torch.jit.export
+    def action(self, sender, state):
+        encode = torch.cat([sender, state], -1)
+        return self.action_head(encode)  # Return logits
+
+    def forward(self, participants, sender: Optional[torch.Tensor] = None):
         # Use DeepSet idea from https://arxiv.org/abs/1703.06114 to encode current state
         # since the order of participants is not relevant.
 
         participants = self.participants_embed(participants)
-        state = participants.sum(1)
-        state = F.relu(self.state0(state))
-        state = F.relu(self.state1(state))
+        state = self.state_embed(participants.sum(1))
 
-        value = self.value_head(state)
+        value = self.value(state)
 
         if sender is not None:
-            sender = self.participants_embed(sender)
-            encode = torch.cat([sender, state], 1)
-            action_prob = self.action_head(encode)  # Return logits
+            action_prob = self.action(self.participants_embed(sender), state)
         else:
             action_prob = None
 
         return value, action_prob
 
 
+# Methods used by `BatchedPolicy`, kept on exported policies
+POLICY_METHODS = ['participants_embed', 'state_embed', 'value', 'action']
+
+# Weights are stored as pickled modules (`.pth`), exported inference only policies as TorchScript (`.pt`)
+
+
 def path(folder):
     return os.path.join(os.path.split(__file__)[0], folder)
 
@@ -59,7 +79,8 @@ def reset_net(name):
 def load_net(name='nn'):
     try:
         with open(os.path.join(path('model'), f'{name}.pth'), 'rb') as f:
-            net = torch.load(f)
+            # Full module pickle, not only weights
+            net = torch.load(f, weights_only=False)
     except FileNotFoundError:
         print(f"Warning! Model not found. Creating new neural network at model/{name}.pth")
         net = reset_net(name)
@@ -75,6 +96,33 @@ def save_net(net, name='nn'):
     return net
 
 
+def export_policy(net, name='nn', quantize=False):
+    """ Save `net` as an inference only TorchScript module, optionally with int8 dynamically
+        quantized Linear layers. Load it with `load_policy`.
+    """
+    net.eval()
+
+    if quantize:
+        net = torch.ao.quantization.quantize_dynamic(net, {nn.Linear}, dtype=torch.qint8)
+
+    for param in net.parameters():
+        param.requires_grad_(False)
+
+    policy = torch.jit.freeze(torch.jit.script(net), preserved_attrs=POLICY_METHODS)
+
+    if not os.path.exists(path('model')):
+        os.mkdir(path('model'))
+
+    torch.jit.save(policy, os.path.join(path('model'), f'{name}.pt'))
+    return policy
+
+
+def load_policy(name='nn'):
+    policy = torch.jit.load(os.path.join(path('model'), f'{name}.pt'))
+    policy.eval()
+    return policy
+
+
 def part2feat(participant):
     # participant 2 feature
     # features: true_count, true_confidence, false_count, false_confidence, adversary, bits
@@ -105,17 +153,158 @@ def capture_state(proto):
     return [part2feat(part) for part in proto.participant_objects]
 
 
+class StateTracker:
+    """ Features of every participant (as in `capture_state`) kept up to date while a protocol runs.
+
+        Register it in `SnowballProtocol.observers`: only the participant that queried is recomputed
+        after each step.
+    """
+
+    def __init__(self, participants):
+        self.features = np.stack([part2feat(part) for part in participants])
+
+        # Rows changed since last capture
+        self.changed = set()
+
+        # Participant updated last and its features before that update
+        self.last = None
+
+    def update(self, participant):
+        ix = participant.self_id
+        self.last = (ix, self.features[ix].copy())
+        self.features[ix] = part2feat(participant)
+        self.changed.add(ix)
+
+    def capture(self):
+        """ Features before the last update, as seen while that participant was querying,
+            and rows that changed since previous capture.
+        """
+        features = self.features.copy()
+        rows = self.changed
+        self.changed = set()
+
+        if self.last is not None:
+            ix, feat = self.last
+            features[ix] = feat
+            # Current row differs from the captured one
+            self.changed.add(ix)
+
+        return features, rows
+
+
 def pick_action(net, participants, from_id):
     participants_feat = [part2feat(part) for part in participants]
 
     participants_feat = torch.Tensor(participants_feat).unsqueeze(0)
     from_participant_feat = participants_feat[:, from_id]
 
-    _, action_prob = net(participants_feat, from_participant_feat)
+    with torch.no_grad():
+        _, action_prob = net(participants_feat, from_participant_feat)
 
     return bool(action_prob[0, 1] > action_prob[0, 0])  # Pick action greedy
 
 
+class BatchedPolicy:
+    """ Greedy policy of `net` evaluated incrementally while a protocol runs.
+
+        Participant embeddings and their pooled sum are kept between queries and only the rows
+        of participants passed to `update` are recomputed, lazily and in a single batch. The state
+        embedding is computed once per protocol step and a sender asking several adversaries in that
+        step is scored once. Only greedy actions are cached: with `epsilon`, every answer explores
+        independently.
+    """
+
+    def __init__(self, net, participants):
+        self.net = net
+        self.participants = participants
+
+        self.features = None
+        self.embeddings = None
+        self.pooled = None
+
+        # Participants whose features changed since last evaluation. Map: index -> participant
+        self.dirty = {}
+        self.state = None
+        self.actions = {}
+
+        # Probability of answering at random instead of greedy
+        self.epsilon = 0.
+
+        self.reload()
+
+    def reload(self):
+        """ Recompute every embedding. Call it after the weights of `net` change
+        """
+        with torch.no_grad():
+            self.features = torch.from_numpy(np.stack([part2feat(part) for part in self.participants]))
+            self.embeddings = self.net.participants_embed(self.features)
+            # Accumulate in double precision to avoid drift over millions of updates
+            self.pooled = self.embeddings.sum(0).double()
+
+        self.dirty.clear()
+        self.state = None
+        self.actions.clear()
+
+    def update(self, participant):
+        self.dirty[participant.self_id] = participant
+        self.state = None
+        self.actions.clear()
+
+    def refresh(self):
+        if not self.dirty:
+            return
+
+        index = list(self.dirty.keys())
+        feat = torch.from_numpy(np.stack([part2feat(part) for part in self.dirty.values()]))
+        self.dirty.clear()
+
+        with torch.no_grad():
+            embedding = self.net.participants_embed(feat)
+            self.pooled += (embedding - self.embeddings[index]).sum(0).double()
+
+        self.features[index] = feat
+        self.embeddings[index] = embedding
+
+    def state_embedding(self):
+        if self.state is None:
+            self.state = self.embed_state()
+        return self.state
+
+    def embed_state(self):
+        if self.dirty:
+            self.refresh()
+
+        with torch.no_grad():
+            return self.net.state_embed(self.pooled.float().unsqueeze(0))
+
+    def value(self):
+        with torch.no_grad():
+            return float(self.net.value(self.state_embedding()))
+
+    def greedy_actions(self, from_ids):
+        state = self.state_embedding()
+
+        with torch.no_grad():
+            sender = self.embeddings[from_ids]
+            action_prob = self.net.action(sender, state.expand(len(from_ids), -1))
+
+        actions = (action_prob[:, 1] > action_prob[:, 0]).tolist()
+        self.actions.update(zip(from_ids, actions))
+        return actions
+
+    def explore(self, action):
+        # Decided for every answer, so adversaries asked in the same step explore independently
+        if self.epsilon > 0. and random.random() < self.epsilon:
+            return random.random() < .5
+        return action
+
+    def pick_action(self, from_id):
+        action = self.actions.get(from_id)
+        if action is None:
+            action, = self.greedy_actions([from_id])
+        return self.explore(action)
+
+
 if __name__ == '__main__':
     net = load_net('supervised')
     save_net(net)
@@ -0,0 +1,50 @@
+import random
+import unittest
+
+import torch
+
+from snowball.adversary import Strategy
+from snowball.learning.model import PolicyValueNetwork
+from snowball.protocol import SnowballProtocol
+from snowball.testing import make_args
+
+
+class BatchedPolicyTest(unittest.TestCase):
+
+    def _run(self, net, batched, steps=1000):
+        random.seed(0)
+        proto = SnowballProtocol(make_args(100, .1, Strategy.RL, seed=0, record=True), net=net)
+
+        if not batched:
+            # Adversaries evaluate the whole network on every query
+            proto.observers.remove(proto.policy)
+            for part in proto.participant_objects:
+                part.policy = None
+
+        for _ in range(steps):
+            if proto.step():
+                break
+
+        return proto
+
+    def test_matches_full_inference(self):
+        # Weights answering both colors often, so actions are close to ties
+        torch.manual_seed(6)
+        net = PolicyValueNetwork()
+
+        batched = self._run(net, True)
+        full = self._run(net, False)
+
+        self.assertEqual([step['votes'] for step in batched.history], [step['votes'] for step in full.history])
+
+        # Adversaries answered with both colors
+        adversary_votes = {vote for step in full.history if step['votes'] is not None
+                           for part_id, vote in zip(step['q_participants'], step['votes'])
+                           if full.participant_objects[part_id].adversary}
+        self.assertEqual(adversary_votes, {False, True})
+        self.assertEqual([part.color for part in batched.participant_objects],
+                         [part.color for part in full.participant_objects])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,10 @@
 # A3C from http://arxiv.org/abs/1602.01783
 
-import selectors
+import contextlib
+import multiprocessing.connection
+import time
 
+import numpy as np
 import torch
 import torch.multiprocessing as mp
 import torch.nn.functional as F
@@ -10,110 +13,194 @@ import adversary
 import learning.model
 import learning.supervised
 import protocol
+from learning.dataset import Snapshots
 
 
-def worker(conn: "mp.Connection", worker_id, args):
-    def log(*args, **kwargs):
-        print(f"Worker[{worker_id}]:", *args, **kwargs)
+class SharedAdam(torch.optim.Adam):
+    """ Adam optimizer with its state in shared memory, so every worker updates the same moments
+    """
 
-    log(worker_id)
+    def __init__(self, params, **kwargs):
+        super().__init__(params, **kwargs)
 
-    net = learning.model.load_net('a3c')
+        for group in self.param_groups:
+            for param in group['params']:
+                state = self.state[param]
+                state['step'] = torch.zeros(())
+                state['exp_avg'] = torch.zeros_like(param.data)
+                state['exp_avg_sq'] = torch.zeros_like(param.data)
 
-    while True:
-        sd = conn.recv()
+                if group['amsgrad']:
+                    state['max_exp_avg_sq'] = torch.zeros_like(param.data)
+
+    def share_memory(self):
+        for group in self.param_groups:
+            for param in group['params']:
+                for value in self.state[param].values():
+                    value.share_memory_()
+
+
+def discounted_returns(count, discount, bootstrap=0.):
+    """ Return of each of `count` consecutive adversary decisions, each one with reward 1.
+        Closed form of `value = 1 + discount * value` accumulated from the last decision,
+        starting from `bootstrap` (value of the state after the last decision).
+    """
+    remaining = np.arange(count, 0, -1, dtype=np.float64)
+
+    if discount == 1.:
+        return (remaining + bootstrap).astype(np.float32)
+
+    returns = (1. - discount ** remaining) / (1. - discount) + discount ** remaining * bootstrap
+    return returns.astype(np.float32)
 
-        if sd is None:  # Flag to terminate run
-            break
 
-        net.load_state_dict(sd)
+class Rollout:
+    """ Simulation played by adversaries using `net`, kept running across updates.
 
+        Each call to `collect` continues the same simulation and it is only restarted after
+        consensus or timeout.
+    """
+
+    def __init__(self, args, net, epsilon=0.):
         args.record = True
-        args.adversary_strategy = 1  # Different from RL (to avoid loading useless net)
+        args.adversary_strategy = adversary.Strategy.RL
 
-        proto = protocol.SnowballProtocol(args)
+        self.proto = protocol.SnowballProtocol(args, net=net)
+        self.epsilon = epsilon
+        self.tracker = None
+        self.done = True
 
-        # Update policy network to adversaries
-        for part in proto.participant_objects:
-            if part.adversary:
-                part.strategy = adversary.Strategy.RL
-                part.net = net
+    def start(self):
+        self.proto.reset()
+        self.proto.policy.epsilon = self.epsilon
+        self.tracker = learning.model.StateTracker(self.proto.participant_objects)
+        self.proto.observers.append(self.tracker)
+        self.done = False
 
-        # Run simulation
-        log("Run simulation")
-        states, sender, action, values = learning.supervised.get_samples(proto, take_percent=1.)
-        log("Simulation over")
+    def collect(self, limit=None):
+        """ Step the simulation until `limit` adversary decisions were taken (or it is over).
 
-        # Compute gradient
-        net.zero_grad()
-        loss, value = 0., torch.zeros(1, 1)
+            Returns state snapshots, per decision state index, sender features and action, and the
+            estimated value of the state reached (zero if simulation is over).
+        """
+        if self.done:
+            self.start()
+        else:
+            # Weights changed since last call
+            self.proto.policy.reload()
 
-        for st, s, a, v in reversed(list(zip(states, sender, action, values))):
-            vp, ap = net(torch.Tensor(st).unsqueeze(0), torch.Tensor(s).unsqueeze(0))
-            value = 1. + args.discount * value
-            value_loss = F.mse_loss(vp, value)
-            action_loss = F.cross_entropy(ap, torch.LongTensor([a]))
-            loss += value_loss + action_loss
+        snapshots = Snapshots()
+        state_index, sender, action = [], [], []
 
-        loss.backward()
+        while not self.done and (limit is None or len(action) < limit):
+            self.done = self.proto.step()
+            learning.supervised.record_step(self.proto, self.tracker, snapshots, state_index, sender, action)
 
-        grad = [param.grad for param in net.parameters()]
-        conn.send(grad)
+        bootstrap = 0. if self.done else self.proto.policy.value()
+        return snapshots, state_index, sender, action, bootstrap
 
 
-def train(args):
-    num_workers = mp.cpu_count()
-    print("Number of workers:", num_workers)
+def accumulate_gradient(net, snapshots, state_index, sender, action, discount, batch_size, bootstrap=0.):
+    """ Accumulate on `net` the gradient of the A3C loss summed over a whole rollout.
+        Samples are evaluated in mini-batches, so the autograd graph is bounded by `batch_size`.
+    """
+    returns = torch.from_numpy(discounted_returns(len(action), discount, bootstrap))
+    sender = np.asarray(sender, dtype=np.float32).reshape(-1, 12)
+    action = np.asarray(action, dtype=np.int64)
 
-    net = learning.model.load_net('a3c')
-    optim = torch.optim.Adam(net.parameters())
+    for start in range(0, len(action), batch_size):
+        end = min(start + batch_size, len(action))
+
+        states = torch.from_numpy(np.stack([snapshots[ix] for ix in state_index[start:end]]))
+        vp, ap = net(states, torch.from_numpy(sender[start:end]))
+
+        value_loss = F.mse_loss(vp.squeeze(1), returns[start:end], reduction='sum')
+        action_loss = F.cross_entropy(ap, torch.from_numpy(action[start:end]), reduction='sum')
+        (value_loss + action_loss).backward()
+
+
+def apply_gradient(shared_net, net, optim, lock=None):
+    """ Step `optim` (over the parameters of `shared_net`) with the gradient accumulated on `net`.
+        Updates are applied directly on shared parameters (Hogwild!) unless `lock` serializes them.
+    """
+    with lock or contextlib.nullcontext():
+        for shared_param, param in zip(shared_net.parameters(), net.parameters()):
+            shared_param._grad = param.grad
+        optim.step()
 
-    start_sel = selectors.DefaultSelector()
-    active = 0
 
-    for i in range(num_workers):
-        conn0, conn1 = mp.Pipe(True)
-        mp.Process(target=worker, args=(conn1, i, args)).start()
-        start_sel.register(conn0, selectors.EVENT_WRITE)
-        active += 1
+def worker(worker_id, shared_net, optim, counter, lock, args):
+    def log(*args, **kwargs):
+        print(f"Worker[{worker_id}]:", *args, **kwargs)
+
+    log(worker_id)
 
-    iteration = 0
+    net = learning.model.PolicyValueNetwork()
+    net.load_state_dict(shared_net.state_dict())
 
-    running_sell = selectors.DefaultSelector()
+    # Adversaries share the network being trained
+    rollout = Rollout(args, net)
 
-    while active > 0:
-        events = start_sel.select()
+    while True:
+        with counter.get_lock():
+            if counter.value >= args.rl_updates:
+                break
+            counter.value += 1
+            iteration = counter.value
 
-        for key, _ in events:
-            conn = key.fileobj
-            conn.send(net.state_dict())
-            iteration += 1
-            active -= 1
+        net.load_state_dict(shared_net.state_dict())
 
-            start_sel.unregister(conn)
-            running_sell.register(conn, selectors.EVENT_READ)
+        # Run simulation for `rl_nstep` decisions, or until it is over
+        snapshots, state_index, sender, action, bootstrap = rollout.collect(args.rl_nstep)
 
-    active = num_workers
+        if rollout.done:
+            log("Simulation over. Iteration:", iteration, rollout.proto.snowball_map)
 
-    while active > 0:
-        print("Iteration:", iteration, "Active:", active)
-        events = running_sell.select()
+        if len(action) == 0:
+            # No adversary was queried
+            continue
 
-        for key, _ in events:
-            conn = key.fileobj
-            gradient = conn.recv()
+        # Compute gradient
+        net.zero_grad()
+        accumulate_gradient(net, snapshots, state_index, sender, action, args.discount, args.rl_batch_size, bootstrap)
+
+        apply_gradient(shared_net, net, optim, lock)
+
+
+def train(args):
+    num_workers = args.rl_workers or mp.cpu_count()
+    print("Number of workers:", num_workers)
+
+    net = learning.model.load_net('a3c')
+    net.share_memory()
+
+    optim = SharedAdam(net.parameters())
+    optim.share_memory()
+
+    counter = mp.Value('i', 0)
+    lock = mp.Lock() if args.rl_lock else None
+
+    workers = [mp.Process(target=worker, args=(i, net, optim, counter, lock, args)) for i in range(num_workers)]
+    for process in workers:
+        process.start()
+
+    # Parameters are updated by workers. Master only saves checkpoints every `checkpoint_interval` seconds
+    last_checkpoint = time.time()
+
+    while True:
+        alive = [process.sentinel for process in workers if process.is_alive()]
+        if not alive:
+            break
 
-            for param, grad in zip(net.parameters(), gradient):
-                param.grad = grad
+        timeout = last_checkpoint + args.checkpoint_interval - time.time()
+        multiprocessing.connection.wait(alive, timeout=max(timeout, 0.))
 
-            optim.step()
+        if time.time() - last_checkpoint >= args.checkpoint_interval:
+            print("Iteration:", counter.value)
+            learning.model.save_net(net, 'a3c')
+            last_checkpoint = time.time()
 
-            if iteration == args.rl_updates:
-                conn.send(None)
-                running_sell.unregister(conn)
-                active -= 1
-            else:
-                conn.send(net.state_dict())
-                iteration += 1
+    for process in workers:
+        process.join()
 
-        learning.model.save_net(net, 'a3c')
+    learning.model.save_net(net, 'a3c')
@@ -0,0 +1,144 @@
+import copy
+import unittest
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from snowball.adversary import Strategy
+from snowball.learning.model import PolicyValueNetwork, capture_state
+from snowball.learning.rl import Rollout, SharedAdam, accumulate_gradient, apply_gradient, discounted_returns
+from snowball.testing import make_args
+
+DISCOUNT = .99
+
+BATCH_SIZE = 8
+
+
+def recursive_returns(count, discount, bootstrap=0.):
+    """ Returns as defined by the original worker: `value = 1 + discount * value` from the last decision
+    """
+    returns = []
+    value = bootstrap
+    for _ in range(count):
+        value = 1. + discount * value
+        returns.append(value)
+    return returns[::-1]
+
+
+class ReturnsTest(unittest.TestCase):
+
+    def test_discounted_returns(self):
+        for discount in (.9, .99, 1.):
+            # Terminal reward (episode over) and bootstrapped from the value of the state reached
+            for bootstrap in (0., 5., -2.5):
+                for count in (0, 1, 7, 100):
+                    np.testing.assert_allclose(discounted_returns(count, discount, bootstrap),
+                                               recursive_returns(count, discount, bootstrap), rtol=1e-5)
+
+    def test_terminal(self):
+        # Last decision of a finished episode only gets its own reward
+        self.assertEqual(discounted_returns(3, .5)[-1], 1.)
+        self.assertEqual(discounted_returns(3, .5, 4.)[-1], 3.)
+
+
+
+def state_value(proto):
+    """ Value of the current state of `proto` by full inference of its network
+    """
+    with torch.no_grad():
+        value, _ = proto.net(torch.from_numpy(np.stack(capture_state(proto))).unsqueeze(0))
+    return float(value)
+
+
+def make_rollout(seed=0, **options):
+    torch.manual_seed(seed)
+    return Rollout(make_args(30, .2, Strategy.RL, seed=seed, **options), PolicyValueNetwork())
+
+
+class RolloutTest(unittest.TestCase):
+
+    def test_truncation(self):
+        rollout = make_rollout(part_iterations=50)
+
+        _, _, _, action, bootstrap = rollout.collect(10)
+        self.assertGreaterEqual(len(action), 10)
+        self.assertFalse(rollout.done)
+        iteration = rollout.proto.iteration
+
+        # Truncated rollouts are bootstrapped from the value of the state reached
+        self.assertAlmostEqual(bootstrap, state_value(rollout.proto), places=4)
+        returns = discounted_returns(len(action), DISCOUNT, bootstrap)
+        self.assertAlmostEqual(returns[-1], 1. + DISCOUNT * bootstrap, places=4)
+
+        # Next rollout continues the same simulation up to its end, where nothing is bootstrapped
+        _, _, _, rest, bootstrap = rollout.collect()
+        self.assertTrue(rollout.done)
+        self.assertGreater(rollout.proto.iteration, iteration)
+        self.assertGreater(len(rest), 0)
+        self.assertEqual(bootstrap, 0.)
+
+        rest_returns = discounted_returns(len(rest), DISCOUNT, bootstrap)
+        self.assertEqual(rest_returns[-1], 1.)
+
+        # Bootstrapping with the return actually obtained afterwards gives the targets of the whole episode
+        np.testing.assert_allclose(discounted_returns(len(action), DISCOUNT, rest_returns[0]),
+                                   discounted_returns(len(action) + len(rest), DISCOUNT)[:len(action)], rtol=1e-5)
+
+        # A finished simulation is restarted
+        self.assertGreater(len(rollout.collect(1)[3]), 0)
+        self.assertFalse(rollout.done)
+        self.assertLess(rollout.proto.iteration, iteration)
+
+
+def update(shared_net, optim, samples):
+    """ Body of `rl.worker` for one update, run in another process
+    """
+    net = PolicyValueNetwork()
+    net.load_state_dict(shared_net.state_dict())
+    net.zero_grad()
+    accumulate_gradient(net, *samples[:4], DISCOUNT, BATCH_SIZE, samples[4])
+    apply_gradient(shared_net, net, optim)
+
+
+class SharedAdamTest(unittest.TestCase):
+
+    def test_worker_update(self):
+        samples = make_rollout().collect(16)
+        self.assertGreaterEqual(len(samples[3]), 16)
+
+        torch.manual_seed(1)
+        shared_net = PolicyValueNetwork()
+        shared_net.share_memory()
+        optim = SharedAdam(shared_net.parameters())
+        optim.share_memory()
+
+        # Same update applied locally with a regular optimizer
+        expected = copy.deepcopy(shared_net)
+        expected.zero_grad()
+        accumulate_gradient(expected, *samples[:4], DISCOUNT, BATCH_SIZE, samples[4])
+        torch.optim.Adam(expected.parameters()).step()
+
+        process = mp.Process(target=update, args=(shared_net, optim, samples))
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+
+        # Parameters and moments were updated by the worker in shared memory
+        for shared_param, param in zip(shared_net.parameters(), expected.parameters()):
+            torch.testing.assert_close(shared_param.data, param.data)
+            self.assertEqual(float(optim.state[shared_param]['step']), 1.)
+            self.assertGreater(float(optim.state[shared_param]['exp_avg_sq'].abs().sum()), 0.)
+
+        # A second worker continues from the shared moments
+        process = mp.Process(target=update, args=(shared_net, optim, samples))
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+
+        for shared_param in shared_net.parameters():
+            self.assertEqual(float(optim.state[shared_param]['step']), 2.)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,24 +1,58 @@
 import multiprocessing
-import os
-import pickle
 import random
+import uuid
 
 import numpy as np
 import torch.nn.functional as F
 import torch.optim
 import torch.utils.data
 
-from learning.model import load_net, save_net, capture_state, path
+from learning.dataset import ShardedDataset, Snapshots, dataset_path, write_shard
+from learning.model import load_net, save_net, StateTracker
 from protocol import SnowballProtocol
 
 VERBOSE = True
 DISCOUNT = .99
 
 
+def record_step(proto, tracker, snapshots, state_index, sender, action):
+    """ Append adversary decisions taken in the last step of `proto`. Return the number of decisions
+    """
+    info = proto.history[-1]
+
+    if info['votes'] is None:
+        return 0
+
+    part_id, votes = info['q_participants'], info['votes']
+    adversary_votes = [v for pid, v in zip(part_id, votes) if proto.participant_objects[pid].adversary]
+
+    if adversary_votes:
+        # Capture state only once it is known that adversaries were queried
+        s, changed = tracker.capture()
+        ix = snapshots.append(s, changed)
+        # A copy, so samples don't keep the whole snapshot alive
+        f = s[info['from']].copy()
+
+        for v in adversary_votes:
+            state_index.append(ix)
+            sender.append(f)
+            action.append(v)
+
+    return len(adversary_votes)
+
+
 def get_samples(proto, take_percent=.01):
-    state, sender, action, value = [], [], [], []
+    """ Run a simulation and collect adversary decisions.
+
+        Returns state snapshots and, per sample, the index of its state snapshot, sender features,
+        action and discounted value. Every adversary queried in a step shares the same snapshot.
+    """
+    snapshots = Snapshots()
+    state_index, sender, action, value = [], [], [], []
 
     proto.reset()
+    tracker = StateTracker(proto.participant_objects)
+    proto.observers.append(tracker)
     done = False
 
     if VERBOSE:
@@ -29,25 +63,11 @@ def get_samples(proto, take_percent=.01):
         # Save only 1% of the sample to avoid bias
         save = random.uniform(0, 1) < take_percent
 
-        if save:
-            s = capture_state(proto)
-
         done = proto.step()
 
         if save:
-            info = proto.history[-1]
-
-            if info['votes'] is not None:
-                f = s[info['from']]
-
-                part_id, votes = info['q_participants'], info['votes']
-
-                for pid, v in zip(part_id, votes):
-                    if proto.participant_objects[pid].adversary:
-                        state.append(s)
-                        sender.append(f)
-                        action.append(v)
-                        value.append(proto.iteration)
+            count = record_step(proto, tracker, snapshots, state_index, sender, action)
+            value.extend([proto.iteration] * count)
 
         if VERBOSE and proto.iteration % 10000 == 0:
             print(proto.iteration)
@@ -57,28 +77,15 @@ def get_samples(proto, take_percent=.01):
         n = last_it - value[i] + 1
         value[i] = (1 - DISCOUNT ** n) / (1 - DISCOUNT)
 
-    return state, sender, action, np.array(value, dtype=np.float32)
+    return snapshots, state_index, sender, action, np.array(value, dtype=np.float32)
 
 
 def train(args):
-    states, sender, action, value = [], [], [], []
-    with open(os.path.join(path('dataset'), f'supervised-{args.adversary_strategy}.pkl'), 'rb') as f:
-        num_sim = 0
-        while True:
-            try:
-                states_x, sender_x, action_x, value_x = pickle.load(f)
-                num_sim += 1
-                states.extend(states_x)
-                sender.extend(sender_x)
-                action.extend(action_x)
-                value.extend(value_x)
-            except EOFError:
-                print("Number of simulations loaded:", num_sim)
-                print("Dataset entries:", len(states))
-                break
-
-    states = torch.Tensor(states)
-    dataset = torch.utils.data.DataLoader(list(zip(states, sender, action, value)), batch_size=32, shuffle=True)
+    data = ShardedDataset(dataset_path(f'supervised-{args.adversary_strategy}'))
+    print("Number of simulations loaded:", len(data.shards))
+    print("Dataset entries:", len(data))
+
+    dataset = torch.utils.data.DataLoader(data, batch_size=32, shuffle=True)
 
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     print("Device:", device)
@@ -111,25 +118,24 @@ def train(args):
 
 
 def create_dataset(args):
-    def build(tasks, lock, count):
+    directory = dataset_path(f'supervised-{args.adversary_strategy}')
+
+    def build(worker_id, tasks, count):
+        # Forked workers inherit the same random state
+        random.seed()
+
+        # Each worker writes its own shards, so no lock is needed
         for _ in iter(tasks.get, '<>'):
             args.record = True
             proto = SnowballProtocol(args)
 
-            states, sender, action, value = get_samples(proto)
-
-            lock.acquire()
-
-            if not os.path.exists(path('dataset')):
-                os.mkdir(path('dataset'))
-
-            count.value += 1
-
-            print("Saving simulation: ", count.value)
-            with open(os.path.join(path('dataset'), f'supervised-{args.adversary_strategy}.pkl'), 'ab') as f:
-                pickle.dump((states, sender, action, value), f)
+            snapshots, state_index, sender, action, value = get_samples(proto)
+            write_shard(directory, f'shard-{worker_id:03d}-{uuid.uuid4().hex}', snapshots, state_index, sender,
+                        action, value)
 
-            lock.release()
+            with count.get_lock():
+                count.value += 1
+                print("Saved simulation: ", count.value)
 
     num_process = multiprocessing.cpu_count()
     print("Number of cores:", num_process)
@@ -137,8 +143,7 @@ def create_dataset(args):
     [tasks.put(None) for _ in range(20)]
     [tasks.put('<>') for _ in range(num_process)]
 
-    lock = multiprocessing.Lock()
     count = multiprocessing.Value('i', 0)
 
     for i in range(num_process):
-        multiprocessing.Process(target=build, args=(tasks, lock, count)).start()
+        multiprocessing.Process(target=build, args=(i, tasks, count)).start()
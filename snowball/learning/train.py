@@ -1,53 +1,162 @@
-from snowball.adversary import Strategy
-from snowball.learning.model import capture_state
-from snowball.protocol import SnowballProtocol
+""" Off-policy training from a replay buffer.
 
+    Actor processes play simulations with an epsilon greedy version of the shared network and write
+    experiences to a replay buffer in shared memory. The learner samples batches from it and fits
+    action logits as Q-values (DQN) and the value head as critic, against a periodically updated
+    target network.
+"""
+import random
+import time
+from collections import namedtuple
 
-def rollout(net, num_participants, adversary_percent, prob, alpha, beta, k, part_iterations):
-    proto = SnowballProtocol(num_participants, adversary_percent, -1, prob, alpha, beta, k, part_iterations,
-                             record=True)
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+import torch.nn.functional as F
 
-    # Provide policy network to adversaries
-    for par in proto.participant_objects:
-        if par.adversary:
-            par.strategy = Strategy.RL
-            par.net = net
+import learning.model
+from learning.dataset import NUM_FEATURES
+from learning.rl import Rollout
+from learning.utils import ReplayBuffer
 
-    states = []
-    done = False
-    while not done:
-        states.append(capture_state(proto))
-        done = proto.step()
+# Columns of the replay buffer
+Experience = namedtuple('Experience', ['state', 'sender', 'action', 'reward', 'done', 'next_state', 'next_sender'])
 
-        if proto.iteration % 100 == 0:
-            print(proto.iteration)
 
-    states.append(capture_state(proto))
+def group_steps(snapshots, state_index, sender, action):
+    """ Decisions returned by `Rollout.collect` grouped by protocol step, as (state, sender, actions).
+        Adversaries asked in the same step share the state snapshot and the sender.
+    """
+    steps = []
+    last = None
 
-    experience = []  # tuples of the form (state, action, reward, done, next_state)
+    for ix, f, a in zip(state_index, sender, action):
+        if ix != last:
+            steps.append((snapshots[ix], f, []))
+            last = ix
+        steps[-1][2].append(a)
 
-    previous_state = None
-    previous_votes = []
+    return steps
 
-    for num, info in enumerate(proto.history):
-        if info['votes'] is None:  # Step performed by adversary. Skip.
-            continue
 
-        part_id, votes = info['q_participants'], info['votes']
-        adv_votes = [v for pid, v in zip(part_id, votes) if proto.participant_objects[pid].adversary]
+def rollout(simulation, limit=None, pending=None):
+    """ Continue `simulation` (a `Rollout`) for up to `limit` adversary decisions.
 
-        if adv_votes:  # Skip steps where not adversary was queried
-            for v in previous_votes:
-                sender = previous_state[info['from']]
-                experience.append(((previous_state, sender), v, +1, False, states[num]))
+        Every decision of a step transitions to the state of the next step where adversaries are asked.
+        Returns a list of `Experience` and the last step, still waiting for its next state, to be passed
+        as `pending` on the following call.
+    """
+    steps = [] if pending is None else [pending]
+    snapshots, state_index, sender, action, _ = simulation.collect(limit)
+    steps.extend(group_steps(snapshots, state_index, sender, action))
 
-            # Remember last state where an adversary answer a query
-            previous_state = states[num]
-            previous_votes = adv_votes
+    experience = [Experience(s, f, a, 1., False, next_s, next_f)
+                  for (s, f, actions), (next_s, next_f, _) in zip(steps, steps[1:]) for a in actions]
+    pending = steps[-1] if steps else None
 
-    if proto.consensus:
-        for v in previous_votes:
+    if simulation.done:
+        if pending is not None and simulation.proto.consensus:
             # This is the most relevant experience to learn useful policies since `done` = True
-            experience.append((previous_state, v, +1, True, states[-1]))
+            s, f, actions = pending
+            experience.extend(Experience(s, f, a, 1., True, s, f) for a in actions)
 
-    return experience
+        # Next call starts a new simulation
+        pending = None
+
+    return experience, pending
+
+
+def make_buffer(args):
+    state = ((args.num_participants, NUM_FEATURES), torch.float32)
+    sender = ((NUM_FEATURES,), torch.float32)
+
+    return ReplayBuffer(args.replay_size, state=state, sender=sender, action=((), torch.int64),
+                        reward=((), torch.float32), done=((), torch.float32), next_state=state, next_sender=sender)
+
+
+def add_experience(buffer, experience):
+    columns = Experience(*zip(*experience))
+    buffer.extend(**{name: np.stack(column) for name, column in columns._asdict().items()})
+
+
+def actor(actor_id, shared_net, buffer, stop, args):
+    # Forked actors inherit the same random state
+    random.seed()
+    torch.set_num_threads(1)
+
+    net = learning.model.PolicyValueNetwork()
+    net.load_state_dict(shared_net.state_dict())
+
+    simulation = Rollout(args, net, epsilon=args.epsilon)
+    pending = None
+
+    while not stop.is_set():
+        net.load_state_dict(shared_net.state_dict())
+        experience, pending = rollout(simulation, args.replay_chunk, pending)
+
+        if simulation.done:
+            print(f"Actor[{actor_id}]: Simulation over.", simulation.proto.snowball_map)
+
+        if experience:
+            add_experience(buffer, experience)
+
+
+def loss(net, target_net, batch, discount):
+    value, q = net(batch['state'], batch['sender'])
+    q = q.gather(1, batch['action'].unsqueeze(1)).squeeze(1)
+
+    with torch.no_grad():
+        next_value, next_q = target_net(batch['next_state'], batch['next_sender'])
+        not_done = 1. - batch['done']
+        q_target = batch['reward'] + discount * not_done * next_q.max(1)[0]
+        value_target = batch['reward'] + discount * not_done * next_value.squeeze(1)
+
+    return F.smooth_l1_loss(q, q_target) + F.mse_loss(value.squeeze(1), value_target)
+
+
+def train(args):
+    num_actors = args.replay_actors or mp.cpu_count()
+    print("Number of actors:", num_actors)
+
+    net = learning.model.load_net('replay')
+    net.share_memory()
+
+    target_net = learning.model.PolicyValueNetwork()
+    target_net.load_state_dict(net.state_dict())
+
+    buffer = make_buffer(args).share_memory()
+    stop = mp.Event()
+
+    actors = [mp.Process(target=actor, args=(i, net, buffer, stop, args)) for i in range(num_actors)]
+    for process in actors:
+        process.start()
+
+    # Learner is the only process updating parameters
+    optim = torch.optim.Adam(net.parameters())
+
+    while buffer.size < args.replay_batch_size:
+        time.sleep(.1)
+
+    last_checkpoint = time.time()
+
+    for update in range(1, args.replay_updates + 1):
+        batch = buffer.sample(args.replay_batch_size)
+
+        optim.zero_grad()
+        batch_loss = loss(net, target_net, batch, args.discount)
+        batch_loss.backward()
+        optim.step()
+
+        if update % args.target_interval == 0:
+            target_net.load_state_dict(net.state_dict())
+            print("Update:", update, "Loss:", float(batch_loss), "Buffer:", buffer.size)
+
+        if time.time() - last_checkpoint >= args.checkpoint_interval:
+            learning.model.save_net(net, 'replay')
+            last_checkpoint = time.time()
+
+    stop.set()
+    for process in actors:
+        process.join()
+
+    learning.model.save_net(net, 'replay')
@@ -0,0 +1,84 @@
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from snowball.learning.train import add_experience, make_buffer, rollout
+
+
+class FakeRollout:
+    """ `Rollout` returning prepared `collect` results
+    """
+
+    def __init__(self, calls, consensus=True):
+        self.calls = list(calls)
+        self.done = False
+        self.proto = SimpleNamespace(consensus=consensus)
+
+    def collect(self, limit=None):
+        snapshots, state_index, sender, action = self.calls.pop(0)
+        self.done = not self.calls
+        return snapshots, state_index, sender, action, 0.
+
+
+def states(*values):
+    return [np.full((4, 12), value, dtype=np.float32) for value in values]
+
+
+def senders(*values):
+    return [np.full(12, value, dtype=np.float32) for value in values]
+
+
+class RolloutTest(unittest.TestCase):
+
+    def _transitions(self, experience):
+        return [(int(e.state[0, 0]), int(e.sender[0]), e.action, e.done, int(e.next_state[0, 0]), int(e.next_sender[0]))
+                for e in experience]
+
+    def test_steps(self):
+        # Steps with states 0, 1 and 2. Two adversaries answer in step 0, in the first call, and in step 2,
+        # in the second call
+        simulation = FakeRollout([
+            (states(0, 1), [0, 0, 1], senders(10, 10, 11), [0, 1, 1]),
+            (states(2), [0, 0], senders(12, 12), [1, 0]),
+        ])
+
+        experience, pending = rollout(simulation)
+        # Decisions of a step move to the next step, never to the state of the same step
+        self.assertEqual(self._transitions(experience), [(0, 10, 0, False, 1, 11), (0, 10, 1, False, 1, 11)])
+        self.assertEqual(pending[2], [1])
+
+        experience, pending = rollout(simulation, pending=pending)
+        self.assertEqual(self._transitions(experience), [
+            (1, 11, 1, False, 2, 12),
+            # Consensus: the last step is terminal
+            (2, 12, 1, True, 2, 12),
+            (2, 12, 0, True, 2, 12)])
+        self.assertIsNone(pending)
+
+    def test_no_consensus(self):
+        simulation = FakeRollout([(states(0), [0], senders(10), [1])], consensus=False)
+
+        experience, pending = rollout(simulation)
+        self.assertEqual(experience, [])
+        self.assertIsNone(pending)
+
+    def test_buffer(self):
+        simulation = FakeRollout([(states(0, 1), [0, 1], senders(10, 11), [0, 1])])
+        experience, _ = rollout(simulation)
+
+        buffer = make_buffer(SimpleNamespace(num_participants=4, replay_size=8))
+        add_experience(buffer, experience)
+
+        # Columns are filled by name
+        self.assertEqual(buffer.size, 2)
+        self.assertEqual(buffer.columns['state'][:2, 0, 0].tolist(), [0., 1.])
+        self.assertEqual(buffer.columns['sender'][:2, 0].tolist(), [10., 11.])
+        self.assertEqual(buffer.columns['action'][:2].tolist(), [0, 1])
+        self.assertEqual(buffer.columns['done'][:2].tolist(), [0., 1.])
+        self.assertEqual(buffer.columns['next_state'][:2, 0, 0].tolist(), [1., 1.])
+        self.assertEqual(buffer.columns['next_sender'][:2, 0].tolist(), [11., 11.])
+
+
+if __name__ == "__main__":
+    unittest.main()
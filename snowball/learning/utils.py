@@ -1,31 +1,64 @@
-import numpy as np
+import contextlib
+
+import torch
+import torch.multiprocessing as mp
 
 
 class ReplayBuffer(object):
-    """ Cyclic buffer
+    """ Cyclic buffer of experiences stored column by column in preallocated tensors.
+
+        Columns are declared as `name=(shape, dtype)`, where `shape` is the shape of a single
+        experience. After `share_memory` the buffer can be filled by several processes at once.
     """
 
-    def __init__(self, max_size):
+    def __init__(self, max_size, **columns):
         self.max_size = max_size
-        self.buffer = []
-        self.pointer = 0
+        self.columns = {name: torch.zeros((max_size,) + tuple(shape), dtype=dtype)
+                        for name, (shape, dtype) in columns.items()}
+
+        # Next position to write and number of stored experiences
+        self.counters = torch.zeros(2, dtype=torch.int64)
+        self.lock = None
+
+    def share_memory(self):
+        for column in self.columns.values():
+            column.share_memory_()
+        self.counters.share_memory_()
+        self.lock = mp.Lock()
+        return self
+
+    @property
+    def pointer(self):
+        return int(self.counters[0])
 
     @property
     def size(self):
-        return len(self.buffer)
+        return int(self.counters[1])
+
+    def add(self, **experience):
+        self.extend(**{name: torch.as_tensor(value).unsqueeze(0) for name, value in experience.items()})
+
+    def extend(self, **batch):
+        """ Add a batch of experiences, one array with a leading batch dimension per column
+        """
+        batch = {name: torch.as_tensor(value) for name, value in batch.items()}
+        count = len(next(iter(batch.values())))
+
+        # Only the last `max_size` experiences would survive
+        skip = max(count - self.max_size, 0)
+
+        with self.lock or contextlib.nullcontext():
+            index = (self.pointer + torch.arange(skip, count)) % self.max_size
 
-    def add(self, experience):
-        if len(self.buffer) < self.max_size:
-            self.buffer.append(experience)
-            self.pointer += 1
-        else:
-            if self.pointer == self.max_size:
-                self.pointer = 0
+            for name, column in self.columns.items():
+                column[index] = batch[name][skip:].to(column.dtype)
 
-            self.buffer[self.pointer] = experience
-            self.pointer += 1
+            self.counters[0] = (self.pointer + count) % self.max_size
+            self.counters[1] = min(self.size + count, self.max_size)
 
     def sample(self, size):
-        replace_mode = size > len(self.buffer)
-        index = np.random.choice(self.size, size=size, replace=replace_mode)
-        return [self.buffer[idx] for idx in index]
+        """ Batch of `size` experiences picked uniformly at random (with replacement)
+        """
+        with self.lock or contextlib.nullcontext():
+            index = torch.randint(self.size, (size,))
+            return {name: column[index] for name, column in self.columns.items()}
@@ -0,0 +1,38 @@
+import unittest
+
+import numpy as np
+import torch
+
+from snowball.learning.utils import ReplayBuffer
+
+
+class ReplayBufferTest(unittest.TestCase):
+
+    def _buffer(self, max_size):
+        return ReplayBuffer(max_size, state=((3, 2), torch.float32), action=((), torch.int64))
+
+    def test_cyclic(self):
+        buffer = self._buffer(5)
+
+        buffer.add(state=np.zeros((3, 2)), action=0)
+        buffer.extend(state=np.ones((6, 3, 2)), action=np.arange(1, 7))
+
+        self.assertEqual(buffer.size, 5)
+        self.assertEqual(buffer.pointer, 2)
+        # Oldest experiences were overwritten
+        self.assertEqual(sorted(buffer.columns['action'].tolist()), [2, 3, 4, 5, 6])
+
+    def test_sample(self):
+        buffer = self._buffer(100).share_memory()
+        actions = np.arange(30)
+        buffer.extend(state=actions[:, None, None] * np.ones((30, 3, 2)), action=actions)
+
+        batch = buffer.sample(64)
+        self.assertEqual(batch['state'].shape, (64, 3, 2))
+        self.assertTrue((batch['action'] < 30).all())
+        # Columns of the same experience stay aligned
+        np.testing.assert_array_equal(batch['state'][:, 0, 0].numpy(), batch['action'].numpy())
+
+
+if __name__ == "__main__":
+    unittest.main()
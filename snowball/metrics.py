@@ -0,0 +1,231 @@
+""" Metrics of good participants kept up to date while a protocol runs.
+
+    `SnowballMetrics` is a histogram of good participants by (color, count, confidence), updated in constant time
+    after every query round as a `SnowballProtocol` observer and turned into an array only for snapshots.
+    `MetricsRecorder` writes a snapshot every `every` rounds to a directory: summary statistics as a row of
+    `metrics.csv` and the histogram as `snapshot-<rounds>.npz`. `MetricsView` draws snapshots, either live or
+    from such a directory.
+
+    The vectorized engine doesn't notify observers, so it has no metrics.
+"""
+import csv
+import glob
+import os
+import time
+from collections import Counter
+
+import numpy as np
+
+
+class SnowballMetrics:
+    def __init__(self, participants, num_colors, beta):
+        self.num_colors = num_colors
+        self.beta = beta
+
+        # Number of good participants by (color, count, confidence)
+        self.histogram = Counter()
+
+        # Bin of every good participant by id
+        self.bins = {}
+
+        # Query rounds of good participants observed
+        self.rounds = 0
+
+        for part in participants:
+            if not part.adversary:
+                self.add(part)
+
+    def add(self, part):
+        key = (int(part.color), part.count, part.confidence)
+        self.histogram[key] += 1
+        self.bins[part.self_id] = key
+
+    def update(self, part):
+        self.rounds += 1
+
+        # Empty bins are kept, there are at most a few per participant
+        self.histogram[self.bins[part.self_id]] -= 1
+        self.add(part)
+
+    def min_confidence(self):
+        return min(confidence for (_, _, confidence), participants in self.histogram.items() if participants)
+
+    def snapshot(self):
+        """ Histogram as an array [color, count, confidence] up to the highest confidence reached, and rounds
+            observed
+        """
+        keys = np.array(list(self.histogram), dtype=np.int64).reshape(-1, 3)
+        confidence = keys[:, 2].max() + 1 if len(keys) else 1
+
+        histogram = np.zeros((self.num_colors, max(self.beta, keys[:, 1].max(initial=0)) + 1, confidence),
+                             dtype=np.int64)
+        histogram[tuple(keys.T)] = list(self.histogram.values())
+        return {'rounds': self.rounds, 'histogram': histogram}
+
+
+def summary(snapshot):
+    """ Participants, mean count, mean confidence and finished participants of each color
+    """
+    histogram = snapshot['histogram']
+    num_colors, beta = histogram.shape[0], histogram.shape[1] - 1
+
+    counts = np.arange(histogram.shape[1])
+    confidences = np.arange(histogram.shape[2])
+
+    row = {'rounds': snapshot['rounds']}
+    for color in range(num_colors):
+        by_count = histogram[color].sum(axis=1)
+        by_confidence = histogram[color].sum(axis=0)
+        participants = by_count.sum()
+
+        row[f'participants_{color}'] = participants
+        row[f'count_mean_{color}'] = (by_count @ counts) / participants if participants else 0.
+        row[f'confidence_mean_{color}'] = (by_confidence @ confidences) / participants if participants else 0.
+        row[f'finished_{color}'] = by_count[beta]
+
+    return row
+
+
+class MetricsRecorder(SnowballMetrics):
+    """ Metrics writing a snapshot to `directory` every `every` rounds. Call `close` at the end of the run
+    """
+
+    def __init__(self, directory, every, participants, num_colors, beta):
+        super().__init__(participants, num_colors, beta)
+        self.directory = directory
+        self.every = every
+        self.start = time.perf_counter()
+
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(os.path.join(directory, 'metrics.csv'), 'w', newline='')
+        self.writer = None
+        self.written = None
+
+        self.write()
+
+    def update(self, part):
+        super().update(part)
+
+        if self.rounds % self.every == 0:
+            self.write()
+
+    def write(self):
+        snapshot = self.snapshot()
+        row = summary(snapshot)
+        row['wall_time'] = time.perf_counter() - self.start
+
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=list(row))
+            self.writer.writeheader()
+
+        self.writer.writerow(row)
+        self.file.flush()
+
+        np.savez_compressed(os.path.join(self.directory, f'snapshot-{self.rounds:012d}.npz'), **snapshot)
+        self.written = self.rounds
+
+    def close(self):
+        if self.written != self.rounds:
+            self.write()
+        self.file.close()
+
+
+def snapshot_paths(directory):
+    return sorted(glob.glob(os.path.join(directory, 'snapshot-*.npz')))
+
+
+def load_snapshot(path):
+    with np.load(path) as data:
+        return {'rounds': int(data['rounds']), 'histogram': data['histogram']}
+
+
+class MetricsView:
+    """ Color distribution, count and confidence distributions and their correlation, as in the
+        original animation, drawn from histogram snapshots. Artists are created once and updated.
+    """
+
+    def __init__(self, num_colors):
+        import matplotlib.pyplot as plt
+
+        self.plt = plt
+        self.figure = plt.figure()
+        # Binary Snowball draws True as red and False as blue
+        colors = ['blue', 'red'] if num_colors == 2 else [f'C{color}' for color in range(num_colors)]
+
+        self.color_ax = self.figure.add_subplot(221)
+        self.bars = self.color_ax.bar(range(num_colors), [0] * num_colors, color=colors)
+        self.color_ax.set_xticks(range(num_colors))
+
+        self.corr_ax = self.figure.add_subplot(222)
+        self.corr_ax.set_title("Count confidence correlation")
+        self.points = [self.corr_ax.scatter([], [], color=color) for color in colors]
+
+        self.count_ax = self.figure.add_subplot(223)
+        self.count_ax.set_title("Participants count distribution")
+        self.count_lines = [self.count_ax.plot([], [], color=color)[0] for color in colors]
+
+        self.confidence_ax = self.figure.add_subplot(224)
+        self.confidence_ax.set_title("Participants confidence distribution")
+        self.confidence_lines = [self.confidence_ax.plot([], [], color=color)[0] for color in colors]
+
+    def update(self, snapshot, title=None):
+        histogram = snapshot['histogram']
+        participants = histogram.sum()
+        by_color = histogram.sum(axis=(1, 2))
+
+        for bar, height in zip(self.bars, by_color):
+            bar.set_height(height)
+        self.color_ax.set_ylim(0, participants)
+        self.color_ax.set_title(title or f"Rounds: {snapshot['rounds']} {by_color.tolist()}")
+
+        # Fraction of good participants in each bin
+        for color, (count_line, confidence_line, points) in enumerate(
+                zip(self.count_lines, self.confidence_lines, self.points)):
+            count_line.set_data(np.arange(histogram.shape[1]), histogram[color].sum(axis=1) / participants)
+            confidence_line.set_data(np.arange(histogram.shape[2]), histogram[color].sum(axis=0) / participants)
+
+            count, confidence = np.nonzero(histogram[color])
+            points.set_offsets(np.stack([count, confidence], axis=1))
+            points.set_sizes(400 * histogram[color][count, confidence] / participants + 4)
+
+        for ax, xmax in ((self.count_ax, histogram.shape[1]), (self.confidence_ax, histogram.shape[2])):
+            ax.set_xlim(0, xmax)
+            ax.relim()
+            ax.autoscale_view(scalex=False)
+
+        self.corr_ax.set_xlim(-1, histogram.shape[1])
+        self.corr_ax.set_ylim(-1, histogram.shape[2])
+
+        self.figure.canvas.draw_idle()
+
+
+def show(directory, follow=False, interval=.1):
+    """ Play the snapshots in `directory`. With `follow`, keep waiting for new snapshots of a running experiment
+    """
+    view = None
+    shown = 0
+
+    while True:
+        paths = snapshot_paths(directory)
+
+        for path in paths[shown:]:
+            snapshot = load_snapshot(path)
+            if view is None:
+                view = MetricsView(snapshot['histogram'].shape[0])
+            view.update(snapshot)
+            view.plt.pause(interval)
+
+        shown = len(paths)
+
+        if not follow:
+            break
+
+        if view is None:
+            time.sleep(1.)
+        elif view.plt.fignum_exists(view.figure.number):
+            view.plt.pause(1.)
+        else:
+            break
+
+    if view is not None:
+        view.plt.show()
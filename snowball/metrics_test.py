@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from snowball.adversary import Strategy
+from snowball.metrics import MetricsRecorder, SnowballMetrics, load_snapshot, snapshot_paths
+from snowball.protocol import SnowballProtocol
+from snowball.testing import make_args, run_protocol
+
+
+def make_protocol(num_colors=2):
+    strategy = Strategy.INCREASE_CONFIDENCE if num_colors == 2 else Strategy.NON_ANSWER
+    return SnowballProtocol(make_args(200, .1, strategy, num_colors=num_colors, seed=0))
+
+
+def recount(proto):
+    histogram = np.zeros((proto.num_colors, proto.beta + 1, 1 + max(
+        part.confidence for part in proto.participant_objects if not part.adversary)), dtype=np.int64)
+    for part in proto.participant_objects:
+        if not part.adversary:
+            histogram[int(part.color), part.count, part.confidence] += 1
+    return histogram
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_incremental(self):
+        for num_colors in (2, 3):
+            proto = make_protocol(num_colors)
+            metrics = SnowballMetrics(proto.participant_objects, proto.num_colors, proto.beta)
+            proto.observers.append(metrics)
+
+            for _ in range(10):
+                for _ in range(500):
+                    if proto.step():
+                        break
+
+                np.testing.assert_array_equal(metrics.snapshot()['histogram'], recount(proto))
+
+    def test_recorder(self):
+        proto = make_protocol()
+
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = MetricsRecorder(directory, 1000, proto.participant_objects, proto.num_colors, proto.beta)
+            proto.observers.append(recorder)
+
+            run_protocol(proto)
+            recorder.close()
+
+            paths = snapshot_paths(directory)
+            self.assertEqual(len(paths), recorder.rounds // 1000 + 1 + bool(recorder.rounds % 1000))
+
+            histogram = load_snapshot(paths[-1])['histogram']
+            self.assertEqual(histogram.sum(axis=(1, 2)).tolist(), [proto.snowball_map[False], proto.snowball_map[True]])
+
+            with open(os.path.join(directory, 'metrics.csv')) as f:
+                self.assertEqual(len(f.readlines()), len(paths) + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
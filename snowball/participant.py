@@ -1,3 +1,4 @@
+import asyncio
 import random
 import time
 
@@ -5,26 +6,78 @@ SNOWBALL_SAMPLE_SIZE = 10
 SNOWBALL_ALPHA = 0.8
 SNOWBALL_BETA = 120
 
+# Colors of binary Snowball. As list indices False is 0 and True is 1
+BINARY_COLORS = (False, True)
+
+
+def color_values(num_colors):
+    """ Colors of Snowball with `num_colors` colors: booleans for binary Snowball, 0..num_colors-1 otherwise
+    """
+    return BINARY_COLORS if num_colors == 2 else tuple(range(num_colors))
+
+
+class ColorTally(list):
+    """ Live number of participants per color, updated by participants when their color changes
+    """
+
+    def __init__(self, num_colors=2):
+        super().__init__([0] * num_colors)
+        self.colors = color_values(num_colors)
+
+    def move(self, old, new):
+        if old is not None:
+            self[old] -= 1
+        if new is not None:
+            self[new] += 1
+
+    @property
+    def least_frequent(self):
+        # Lowest color on ties
+        return self.colors[min(range(len(self)), key=self.__getitem__)]
+
+    def as_map(self):
+        return dict(zip(self.colors, self))
+
 
 class SnowballParticipant:
-    def __init__(self, self_id, participants, alpha=SNOWBALL_ALPHA, beta=SNOWBALL_BETA, k=SNOWBALL_SAMPLE_SIZE):
+    def __init__(self, self_id, participants, alpha=SNOWBALL_ALPHA, beta=SNOWBALL_BETA, k=SNOWBALL_SAMPLE_SIZE,
+                 num_colors=2):
         assert len(participants) > k
 
-        self.color = None
+        # Tallies notified on every color change. See `SnowballProtocol.reset`
+        self.tallies = ()
+
+        self._color = None
         self.lastcolor = None
         self.self_id = self_id
         self.participants = participants
-        self.d = {True: 0, False: 0}
+        self.colors = color_values(num_colors)
+        # Number of successful queries per color
+        self.d = [0] * num_colors
         self.count = 0
 
         self.alpha = alpha
         self.beta = beta
         self.k = k
 
+    @property
+    def color(self):
+        return self._color
+
+    @color.setter
+    def color(self, color):
+        if color != self._color:
+            for tally in self.tallies:
+                tally.move(self._color, color)
+            self._color = color
+
     @property
     def confidence(self):
-        assert self.d[self.color] >= self.d[not self.color]
-        return abs(self.d[True] - self.d[False])
+        # Lead of the current color over the runner-up
+        best = self.d[self.color]
+        ranked = sorted(self.d)
+        assert best == ranked[-1]
+        return best - ranked[-2]
 
     def respond_to_query(self, from_id, color, participants_objects=None):
         if self.color is None:
@@ -50,21 +103,20 @@ class SnowballParticipant:
         return query_method(self.self_id, subset, self.color, lambda votes: self.snowball_iteration_post(subset, votes))
 
     def snowball_iteration_post(self, participants, votes):
-        current_votes = {False: 0, True: 0}
+        current_votes = [0] * len(self.colors)
 
         for v in votes:
             if v is not None:  # None stands for a node that didn't answer on timeout
                 current_votes[v] += 1
 
-        winning_vote = list(filter(
-            lambda x: current_votes[x] >= self.k * self.alpha,
-            current_votes.keys()))
+        # Most voted color, lowest on ties
+        winner = max(range(len(current_votes)), key=current_votes.__getitem__)
 
-        if len(winning_vote) == 0:
+        if current_votes[winner] < self.k * self.alpha:
             self.count = 0
             return participants, votes
 
-        vote = winning_vote[0]
+        vote = self.colors[winner]
 
         self.d[vote] += 1
 
@@ -84,3 +136,10 @@ class SnowballParticipant:
         while not self.is_finished():
             self.snowball_iteration(query_method)
             time.sleep(0.1)
+
+    async def snowball_async(self, query_method, interval=0.):
+        """ Coroutine version of `snowball`, where `query_method` is a coroutine function querying concurrently
+        """
+        while not self.is_finished():
+            await self.snowball_iteration(query_method)
+            await asyncio.sleep(interval)
@@ -0,0 +1,162 @@
+""" Low overhead instrumentation of protocol runs.
+
+    Nothing is measured by default. `enable` starts a `Profile` and `instrument`, `count` and
+    `instrument_generator` then replace functions and methods with wrappers that add their run time to a
+    timer or increase counters. Code that was not instrumented runs unchanged, so a disabled profile costs
+    nothing.
+
+    Only standard library modules are used, so Avalanche can import it as `snowball.profiling`.
+"""
+import contextlib
+import cProfile
+import functools
+import sys
+import time
+from collections import Counter
+
+# Active profile, set by `enable`
+profile = None
+
+
+class Profile:
+    """ Timers (calls and seconds) and counters of a run
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = Counter()
+        self.start = time.perf_counter()
+
+    def timer(self, label):
+        return self.timers.setdefault(label, [0, 0.])
+
+    def report(self):
+        wall_time = time.perf_counter() - self.start
+        lines = [f"Profile. Wall time: {wall_time:.3f}s",
+                 f"{'Timer':<48} {'Calls':>10} {'Total s':>10} {'Per call us':>12} {'% wall':>7}"]
+
+        # Nested timers are included in their callers, so percentages don't add up to 100
+        for label, (calls, seconds) in sorted(self.timers.items(), key=lambda item: -item[1][1]):
+            if calls:
+                lines.append(f"{label:<48} {calls:>10} {seconds:>10.3f} {seconds / calls * 1e6:>12.2f}"
+                             f" {seconds / wall_time * 100:>7.1f}")
+
+        if self.counters:
+            lines.append(f"{'Counter':<48} {'Value':>10}")
+            for label, value in sorted(self.counters.items()):
+                lines.append(f"{label:<48} {value:>10}")
+
+        return "\n".join(lines)
+
+
+def enable():
+    global profile
+    profile = Profile()
+    return profile
+
+
+def label_of(owner, name):
+    return f"{getattr(owner, '__name__', owner)}.{name}"
+
+
+def instrument(owner, name, label=None):
+    """ Time every call to attribute `name` of `owner`, a class or module, on timer `label`.
+        Does nothing while profiling is disabled.
+    """
+    if profile is None:
+        return
+
+    function = getattr(owner, name)
+    timer = profile.timer(label or label_of(owner, name))
+    perf_counter = time.perf_counter
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timer[0] += 1
+            timer[1] += perf_counter() - start
+
+    setattr(owner, name, wrapper)
+
+
+def count(owner, name, key):
+    """ Count calls to attribute `name` of `owner` on counter `key(*args, **kwargs)`, skipped if it is None.
+        Cheaper than `instrument` for functions called once per query.
+    """
+    if profile is None:
+        return
+
+    function = getattr(owner, name)
+    counters = profile.counters
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        counter = key(*args, **kwargs)
+        if counter is not None:
+            counters[counter] += 1
+        return function(*args, **kwargs)
+
+    setattr(owner, name, wrapper)
+
+
+def instrument_generator(owner, name, label=None):
+    """ Count calls to generator `name` of `owner` and items it yields, on counters `label.calls` and `label.items`.
+
+        Generators run interleaved with their consumer, so they are not timed.
+    """
+    if profile is None:
+        return
+
+    function = getattr(owner, name)
+    label = label or label_of(owner, name)
+    counters = profile.counters
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        counters[f"{label}.calls"] += 1
+        for item in function(*args, **kwargs):
+            counters[f"{label}.items"] += 1
+            yield item
+
+    setattr(owner, name, wrapper)
+
+
+@contextlib.contextmanager
+def sampling(path):
+    """ Profile the block with cProfile and dump stats to `path`, or with pyinstrument if `path` ends in .html
+    """
+    if path.endswith('.html'):
+        import pyinstrument
+
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(path, 'w') as f:
+                f.write(profiler.output_html())
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+
+
+@contextlib.contextmanager
+def session(dump=None, out=sys.stdout):
+    """ Run the block with an optional cProfile/pyinstrument dump to `dump`. If profiling is enabled, the
+        report is written to `out` when the block ends, even on errors or interruptions.
+    """
+    with sampling(dump) if dump else contextlib.nullcontext():
+        try:
+            yield profile
+        finally:
+            if profile is not None:
+                print(profile.report(), file=out)
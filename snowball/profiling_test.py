@@ -0,0 +1,48 @@
+import unittest
+
+from snowball import profiling
+
+
+class Node:
+
+    def step(self, value):
+        return value + 1
+
+    def walk(self, length):
+        yield from range(length)
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def tearDown(self):
+        profiling.profile = None
+
+    def test_disabled(self):
+        step = Node.step
+        profiling.instrument(Node, 'step')
+        self.assertIs(Node.step, step)
+
+    def test_report(self):
+        profile = profiling.enable()
+        original = (Node.step, Node.walk)
+
+        try:
+            profiling.instrument(Node, 'step')
+            profiling.count(Node, 'step', lambda node, value: 'odd' if value % 2 else None)
+            profiling.instrument_generator(Node, 'walk')
+
+            node = Node()
+            self.assertEqual([node.step(value) for value in range(5)], [1, 2, 3, 4, 5])
+            self.assertEqual(list(node.walk(3)) + list(node.walk(4)), [0, 1, 2, 0, 1, 2, 3])
+        finally:
+            Node.step, Node.walk = original
+
+        self.assertEqual(profile.timers['Node.step'][0], 5)
+        self.assertEqual(profile.counters['odd'], 2)
+        self.assertEqual(profile.counters['Node.walk.calls'], 2)
+        self.assertEqual(profile.counters['Node.walk.items'], 7)
+        self.assertIn('Node.step', profile.report())
+
+
+if __name__ == "__main__":
+    unittest.main()
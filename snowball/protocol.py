@@ -1,10 +1,13 @@
 import random
 
-from adversary import AugmentedSnowballParticipant
+from adversary import AugmentedSnowballParticipant, POLICY_STRATEGIES, load_strategy_net
+from history import History
+from learning.model import BatchedPolicy
+from participant import ColorTally
 
 
 class SnowballProtocol:
-    def __init__(self, args):
+    def __init__(self, args, net=None):
         self.participants = list(range(args.num_participants))
 
         self.adversaries_num = int(args.num_participants * args.adversary_percent)
@@ -13,34 +16,75 @@ class SnowballProtocol:
         self.alpha = args.snowball_alpha
         self.beta = args.snowball_beta
         self.k = args.snowball_k
+        self.num_colors = args.num_colors
 
         self.adversary_strategy = args.adversary_strategy
         self.balance = args.balance
         self.top_iterations = args.part_iterations * args.num_participants
 
         self.query_method = None
+        self.color_tally = None
+        self.honest_tally = None
         self.participant_objects = None
         self.running_participants = None
         self.iteration = 0
 
-        self.history = []
         self.record = args.record
+        # Steps are spilled to memory mapped files on `history_path` if given
+        self.history = History(self.k, args.history_path if self.record else None, num_colors=self.num_colors)
 
         self.net_name = args.net_name
+        self.net = net
+        self.policy = None
+
+        # Objects notified with `update(participant)` after a participant queried (and maybe changed)
+        self.observers = []
+
+        # Early termination checks, see `termination.py`, and the reason of the one that stopped the run
+        self.terminations = []
+        self.stop_reason = None
+
+        if self.adversary_strategy in POLICY_STRATEGIES:
+            # Participant features only describe binary Snowball
+            assert self.num_colors == 2, self.num_colors
+
+        if self.adversary_strategy in POLICY_STRATEGIES and self.net is None:
+            # A single network is shared by all adversaries
+            self.net = load_strategy_net(self.adversary_strategy, self.net_name)
 
         self.reset()
 
     def reset(self):
         self.history.clear()
         self.iteration = 0
+        self.stop_reason = None
 
         self.participant_objects = [
             AugmentedSnowballParticipant(i, self.participants, i >= self.good_num, self.adversary_strategy, self.alpha,
-                                         self.beta, self.k, self.net_name)
+                                         self.beta, self.k, self.net_name, self.net, self.num_colors)
             for i in self.participants]
 
+        # Color of every participant (seen by adversaries) and of honest participants only
+        self.color_tally = ColorTally(self.num_colors)
+        self.honest_tally = ColorTally(self.num_colors)
+
         for part in self.participant_objects:
-            part.color = random.uniform(0, 1) > self.balance
+            part.color_tally = self.color_tally
+            part.tallies = (self.color_tally,) if part.adversary else (self.color_tally, self.honest_tally)
+
+            if self.num_colors == 2:
+                part.color = random.uniform(0, 1) > self.balance
+            else:
+                # `balance` only applies to binary Snowball
+                part.color = random.randrange(self.num_colors)
+
+        self.policy = None
+        self.observers = []
+        if self.adversary_strategy in POLICY_STRATEGIES:
+            self.policy = BatchedPolicy(self.net, self.participant_objects)
+            self.observers.append(self.policy)
+            for part in self.participant_objects:
+                part.policy = self.policy
 
         def query_method(part_id, participants, color, callback):
             return callback(
@@ -52,18 +96,17 @@ class SnowballProtocol:
 
     @property
     def snowball_map(self):
-        sb = {True: 0, False: 0}
-        for part in self.participant_objects:
-            if not part.adversary:
-                sb[part.color] += 1
-        return sb
+        return self.honest_tally.as_map()
 
     @property
     def consensus(self):
-        sb = self.snowball_map
-        return sb[True] == 0 or sb[False] == 0
+        # Every honest participant has the same color
+        return max(self.honest_tally) == sum(self.honest_tally)
 
     def remove_adversaries(self):
+        self.observers = [observer for observer in self.observers if observer is not self.policy]
+        self.policy = None
+
         self.running_participants = list(filter(lambda x: not x.adversary, self.running_participants))
 
         par_obj = []
@@ -79,15 +122,26 @@ class SnowballProtocol:
         for par in self.participant_objects:
             par.participants = par_id
 
+    def terminated(self, part):
+        for termination in self.terminations:
+            self.stop_reason = termination.check(self, part)
+            if self.stop_reason is not None:
+                return True
+        return False
+
     def log(self, from_id, queried_participants, votes):
         if self.record:
-            self.history.append({
-                'from': from_id,
-                'q_participants': queried_participants,
-                'votes': votes
-            })
+            self.history.append(from_id, queried_participants, votes)
 
     def step(self):
+        done = self.advance()
+
+        if done and self.record:
+            self.history.flush()
+
+        return done
+
+    def advance(self):
         part = random.choice(self.running_participants)
         self.iteration += 1
 
@@ -99,6 +153,13 @@ class SnowballProtocol:
         q_participants, votes = part.snowball_iteration(self.query_method)
         self.log(part.self_id, q_participants, votes)
 
+        # Only the participant that queried might have changed its state
+        for observer in self.observers:
+            observer.update(part)
+
+        if self.terminations and self.terminated(part):
+            return True
+
         if part.is_finished():
             self.running_participants.remove(part)
 
@@ -1,6 +1,8 @@
 import unittest
 
+from snowball.adversary import Strategy
 from snowball.protocol import SnowballProtocol
+from snowball.testing import make_args, run_protocol
 
 VERBOSE = False
 
@@ -11,18 +13,39 @@ class BasicSnowballTest(unittest.TestCase):
         super(BasicSnowballTest, self).__init__(*args, **kwargs)
 
     def _one_test(self, num_participants, prob):
-        proto = SnowballProtocol(num_participants, 0., -1, prob, .8, 120, 10, float('inf'))
-
-        done = False
-        while not done:
-            done = proto.step()
+        args = make_args(num_participants, 0., -1, balance=prob, part_iterations=float('inf'))
+        proto = run_protocol(SnowballProtocol(args))
 
         self.assertTrue(proto.consensus)
+        self._check_tally(proto)
 
         if VERBOSE:
             print("Iterations:", proto.iteration)
             print("Snowball Map:", proto.snowball_map)
 
+    def _check_tally(self, proto):
+        honest = {color: 0 for color in proto.color_tally.colors}
+        total = {color: 0 for color in proto.color_tally.colors}
+        for part in proto.participant_objects:
+            total[part.color] += 1
+            if not part.adversary:
+                honest[part.color] += 1
+
+        self.assertEqual(proto.snowball_map, honest)
+        self.assertEqual(proto.color_tally.as_map(), total)
+
+    def test_tally_adversarial(self):
+        proto = run_protocol(SnowballProtocol(make_args(200, .19, Strategy.TRY_BALANCE, part_iterations=50)))
+
+        self._check_tally(proto)
+
+    def test_multi_valued(self):
+        for strategy in [Strategy.TRY_BALANCE, Strategy.EQUAL_SPLIT]:
+            proto = run_protocol(SnowballProtocol(make_args(200, .1, strategy, part_iterations=50, num_colors=3)))
+
+            self._check_tally(proto)
+            self.assertEqual(sorted(proto.snowball_map), [0, 1, 2])
+
     def test_sanity(self):
         self._one_test(100, 0.5)
         self._one_test(1000, 0.5)
@@ -5,6 +5,9 @@ def get_arg_parser():
     parser = argparse.ArgumentParser(description='Snowball Framework')
     parser.add_argument('--no_cuda', action='store_true', default=False)
     parser.add_argument('--verbose', action='store_true', default=False)
+    # Timers and counters of hot paths (see `instrument`) and cProfile/pyinstrument (.html) dump
+    parser.add_argument('--profile', action='store_true', default=False)
+    parser.add_argument('--profile_dump', type=str, default=None)
 
     snowball_parameters = parser.add_argument_group('parameters')
     snowball_parameters.add_argument('--num_participants', type=int, default=2000)
@@ -15,8 +18,21 @@ def get_arg_parser():
     snowball_parameters.add_argument('--snowball_beta', type=int, default=120)
     snowball_parameters.add_argument('--snowball_k', type=int, default=10)
     snowball_parameters.add_argument('--part_iterations', type=int, default=1000)
+    snowball_parameters.add_argument('--num_colors', type=int, default=2)
     snowball_parameters.add_argument('--net_name', type=str, default='nn')
-    snowball_parameters.set_defaults(record=False)
+    snowball_parameters.add_argument('--seed', type=int, default=None)
+    snowball_parameters.add_argument('--history_path', type=str, default=None)
+    # Network of the events and async engines. Times are in seconds, simulated for the events engine
+    snowball_parameters.add_argument('--latency', type=str, choices=['constant', 'uniform', 'exponential', 'lognormal'],
+                                     default='exponential')
+    snowball_parameters.add_argument('--latency_mean', type=float, default=.05)
+    snowball_parameters.add_argument('--timeout', type=float, default=.5)
+    snowball_parameters.add_argument('--query_interval', type=float, default=0.)
+    snowball_parameters.add_argument('--transport', type=str, choices=['memory', 'udp'], default='memory')
+    # Stop runs whose outcome is decided (up to --decided_risk), or also those that stay split. See `termination.py`
+    snowball_parameters.add_argument('--early_stop', type=str, choices=['decided', 'stalled'], default=None)
+    snowball_parameters.add_argument('--decided_risk', type=float, default=1e-9)
+    snowball_parameters.set_defaults(record=False, engine='scalar', batch_size=32, decrees=1, metrics_dir=None)
 
     subparser = parser.add_subparsers()
 
@@ -26,40 +42,129 @@ def get_arg_parser():
     experiment.add_argument('--verbose_every', type=int, default=5000)
     experiment.add_argument('--iterations_per_frame', type=int, default=5000)
     experiment.add_argument('--remove_after', type=int, default=None)
+    experiment.add_argument('--engine', type=str, choices=['scalar', 'vectorized', 'events', 'async'], default='scalar')
+    experiment.add_argument('--batch_size', type=int, default=32)
+    experiment.add_argument('--decrees', type=int, default=1)
+    # Headless recording of metrics snapshots, see `metrics.py`
+    experiment.add_argument('--metrics_dir', type=str, default=None)
+    experiment.add_argument('--metrics_every', type=int, default=5000)
+
+    metrics = subparser.add_parser('metrics')
+    metrics.set_defaults(action='metrics')
+    metrics.add_argument('metrics_dir', type=str)
+    metrics.add_argument('--follow', action='store_true', default=False)
+    metrics.add_argument('--interval', type=float, default=.1)
 
     learning = subparser.add_parser('learning')
     learning.set_defaults(action='learning')
     learning.add_argument('--create_dataset', action='store_true', default=False)
     learning.add_argument('--train_supervised', action='store_true', default=False)
     learning.add_argument('--num_epochs', type=int, default=32)
+    learning.add_argument('--export_policy', action='store_true', default=False)
+    learning.add_argument('--quantize', action='store_true', default=False)
+
+    sweep = subparser.add_parser('sweep')
+    sweep.set_defaults(action='sweep')
+    sweep.add_argument('--participants', type=int, nargs='+', default=None)
+    sweep.add_argument('--percents', type=float, nargs='+', default=[0., .05, .1, .15, .17, .18, .19, .20])
+    sweep.add_argument('--strategies', type=str, nargs='+', default=['INCREASE_CONFIDENCE', 'EQUAL_SPLIT', 'NON_ANSWER'])
+    sweep.add_argument('--ks', type=int, nargs='+', default=None)
+    sweep.add_argument('--alphas', type=float, nargs='+', default=None)
+    sweep.add_argument('--betas', type=int, nargs='+', default=None)
+    sweep.add_argument('--seeds', type=int, nargs='+', default=list(range(5)))
+    sweep.add_argument('--output', type=str, default='log/sweep.csv')
+    sweep.add_argument('--workers', type=int, default=None)
+    sweep.add_argument('--chunksize', type=int, default=1)
+    sweep.add_argument('--engine', type=str, choices=['scalar', 'vectorized', 'events', 'async'], default='scalar')
+    sweep.add_argument('--batch_size', type=int, default=32)
+    sweep.add_argument('--decrees', type=int, default=1)
 
     rl = subparser.add_parser('rl')
     rl.set_defaults(action='rl')
     rl.add_argument('--rl_updates', type=int, default=1024)
     rl.add_argument('--discount', type=float, default=.99)
+    rl.add_argument('--rl_workers', type=int, default=None)
+    rl.add_argument('--rl_batch_size', type=int, default=32)
+    rl.add_argument('--rl_nstep', type=int, default=None)
+    rl.add_argument('--rl_lock', action='store_true', default=False)
+    rl.add_argument('--checkpoint_interval', type=float, default=60.)
+
+    replay = subparser.add_parser('replay')
+    replay.set_defaults(action='replay')
+    replay.add_argument('--replay_updates', type=int, default=10000)
+    replay.add_argument('--replay_size', type=int, default=1024)
+    replay.add_argument('--replay_batch_size', type=int, default=64)
+    replay.add_argument('--replay_actors', type=int, default=None)
+    replay.add_argument('--replay_chunk', type=int, default=64)
+    replay.add_argument('--epsilon', type=float, default=.1)
+    replay.add_argument('--target_interval', type=int, default=100)
+    replay.add_argument('--discount', type=float, default=.99)
+    replay.add_argument('--checkpoint_interval', type=float, default=60.)
 
     return parser
 
 
-if __name__ == '__main__':
-    parser = get_arg_parser()
-    args = parser.parse_args()
+def instrument():
+    """ Time hot paths of every engine and count query responses (honest or by adversary strategy) and network calls
+    """
+    import adversary
+    import events
+    import history
+    import learning.model
+    import participant
+    import profiling
+    import protocol
+    import vectorized
 
-    if not hasattr(args, 'action'):
-        parser.print_help()
-        exit(0)
+    strategies = {value: name for name, value in vars(adversary.Strategy).items() if not name.startswith('_')}
+
+    def query_key(part, from_id, color, participants_objects=None, iteration=None):
+        return f"responses.adversary.{strategies[part.strategy]}" if part.adversary else "responses.honest"
+
+    profiling.instrument(protocol.SnowballProtocol, 'step')
+    profiling.instrument(protocol.SnowballProtocol, 'log')
+    profiling.instrument(participant.SnowballParticipant, 'snowball_iteration_post')
+    profiling.count(adversary.AugmentedSnowballParticipant, 'respond_to_query', query_key)
+    profiling.instrument(history.History, 'append')
+
+    # Every call evaluates the network
+    profiling.instrument(adversary, 'pick_action', 'network.pick_action')
+    for name in ['reload', 'refresh', 'embed_state', 'greedy_actions', 'value']:
+        profiling.instrument(learning.model.BatchedPolicy, name, f'network.BatchedPolicy.{name}')
+
+    for name in ['step', 'get_subsets', 'adversary_votes', 'snowball_iteration_post']:
+        profiling.instrument(vectorized.VectorizedSnowballProtocol, name)
 
+    for name in ['start_round', 'end_round', 'query']:
+        profiling.instrument(events.EventSnowballProtocol, name)
+
+
+def main(parser, args):
     if args.action == 'experiment':
         import experiment
         import adversary
 
         args.adversary_strategy = getattr(adversary.Strategy, args.adversary_strategy)
 
-        if args.no_plt:
+        if args.decrees > 1 and args.engine != 'vectorized':
+            parser.error("--decrees requires --engine vectorized")
+
+        if args.engine == 'vectorized' and args.metrics_dir is not None:
+            parser.error("--metrics_dir doesn't support --engine vectorized")
+
+        if args.engine == 'vectorized' and args.early_stop:
+            parser.error("--early_stop doesn't support --engine vectorized")
+
+        if args.no_plt or args.metrics_dir is not None or args.engine != 'scalar' or args.num_colors != 2:
             experiment.snowball(args)
         else:
             experiment.snowball_plt(args)
 
+    elif args.action == 'metrics':
+        import metrics
+
+        metrics.show(args.metrics_dir, args.follow, args.interval)
+
     elif args.action == 'learning':
         import learning.supervised
         import adversary
@@ -72,7 +177,50 @@ if __name__ == '__main__':
         elif args.train_supervised:
             learning.supervised.train(args)
 
+        elif args.export_policy:
+            import learning.model
+
+            learning.model.export_policy(learning.model.load_net(args.net_name), args.net_name, args.quantize)
+
+    elif args.action == 'sweep':
+        import arena
+
+        if args.decrees > 1 and args.engine != 'vectorized':
+            parser.error("--decrees requires --engine vectorized")
+
+        if args.engine == 'vectorized' and args.early_stop:
+            parser.error("--early_stop doesn't support --engine vectorized")
+
+        if arena.table_columns(args.output) not in (None, arena.COLUMNS):
+            parser.error(f"{args.output} has the columns of another version of the sweep, use a new --output")
+
+        arena.main(args)
+
     elif args.action == 'rl':
         import learning.rl
 
         learning.rl.train(args)
+
+    elif args.action == 'replay':
+        import learning.train
+
+        learning.train.train(args)
+
+
+if __name__ == '__main__':
+    parser = get_arg_parser()
+    args = parser.parse_args()
+
+    if not hasattr(args, 'action'):
+        parser.print_help()
+        exit(0)
+
+    import profiling
+
+    if args.profile:
+        # Worker processes of sweeps and training are not measured
+        profiling.enable()
+        instrument()
+
+    with profiling.session(args.profile_dump):
+        main(parser, args)
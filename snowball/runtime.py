@@ -0,0 +1,297 @@
+""" Real time Snowball runtime on asyncio.
+
+    Every good participant is a coroutine (`SnowballParticipant.snowball_async`) sending its `k` queries
+    concurrently and waiting at most `timeout` seconds for the responses. All participants share one event
+    loop and queries travel over a transport: in process with delays from a latency (see `events.make_latency`),
+    or as datagrams over the UDP loopback interface.
+
+    Transports return one future per query instead of running a task per query, so thousands of participants
+    can share the loop.
+"""
+import asyncio
+import itertools
+import socket
+import struct
+import time
+
+import numpy as np
+
+from events import make_latency, percentiles
+from history import decode_vote, encode_vote
+from protocol import SnowballProtocol
+
+# Datagrams: (request id, sender, queried participant, color) and (request id, vote)
+REQUEST = struct.Struct('<Qiib')
+RESPONSE = struct.Struct('<Qb')
+
+# Socket buffers for the queries in flight. The kernel may use smaller ones
+SOCKET_BUFFER = 1 << 22
+
+
+def resolve(future, vote):
+    # Futures of timed out queries are already cancelled
+    if not future.done():
+        future.set_result(vote)
+
+
+class MemoryTransport:
+    """ Queries answered in process after waiting the delays given by `latency`
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.proto = None
+        self.loop = None
+
+    async def open(self, proto):
+        self.proto = proto
+        self.loop = asyncio.get_running_loop()
+
+    def close(self):
+        pass
+
+    def query(self, from_id, to_ids, color):
+        """ Send a query from `from_id` to each of `to_ids`. Returns one future with the vote per query
+        """
+        futures = []
+        for to_id, query_delay, response_delay in zip(to_ids, *self.latency(from_id, to_ids)):
+            future = self.loop.create_future()
+            self.loop.call_later(query_delay, self.arrive, future, from_id, to_id, color, response_delay)
+            futures.append(future)
+        return futures
+
+    def arrive(self, future, from_id, to_id, color, response_delay):
+        if future.done():
+            return
+
+        vote = self.proto.respond(from_id, to_id, color)
+        if response_delay:
+            self.loop.call_later(response_delay, resolve, future, vote)
+        else:
+            future.set_result(vote)
+
+
+class ServerProtocol(asyncio.DatagramProtocol):
+    """ Answers queries to every participant of `proto`
+    """
+
+    def __init__(self, proto):
+        self.proto = proto
+        self.colors = proto.color_tally.colors
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        request_id, from_id, to_id, color = REQUEST.unpack(data)
+        vote = self.proto.respond(from_id, to_id, decode_vote(color, self.colors))
+        self.transport.sendto(RESPONSE.pack(request_id, encode_vote(vote)), address)
+
+
+class ClientProtocol(asyncio.DatagramProtocol):
+    """ Resolves futures of pending requests with the votes received
+    """
+
+    def __init__(self, pending, colors):
+        self.pending = pending
+        self.colors = colors
+
+    def datagram_received(self, data, address):
+        request_id, vote = RESPONSE.unpack(data)
+        future = self.pending.get(request_id)
+
+        # Responses arriving after the timeout are dropped
+        if future is not None:
+            resolve(future, decode_vote(vote, self.colors))
+
+
+class UdpTransport:
+    """ Queries sent as datagrams over the loopback interface.
+
+        A single server endpoint answers for all participants and a single client endpoint sends all queries.
+    """
+
+    def __init__(self, host='127.0.0.1'):
+        self.host = host
+        self.server = None
+        self.client = None
+        self.loop = None
+        # Futures of requests waiting for a response
+        self.pending = {}
+        self.request_ids = itertools.count()
+
+    async def open(self, proto):
+        self.loop = asyncio.get_running_loop()
+        colors = proto.color_tally.colors
+
+        self.server, _ = await self.loop.create_datagram_endpoint(lambda: ServerProtocol(proto),
+                                                                  local_addr=(self.host, 0))
+        address = self.server.get_extra_info('sockname')
+        self.client, _ = await self.loop.create_datagram_endpoint(lambda: ClientProtocol(self.pending, colors),
+                                                                  remote_addr=address)
+
+        for endpoint in (self.server, self.client):
+            sock = endpoint.get_extra_info('socket')
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER)
+
+    def close(self):
+        for endpoint in (self.client, self.server):
+            if endpoint is not None:
+                endpoint.close()
+        self.pending.clear()
+
+    def query(self, from_id, to_ids, color):
+        """ Send a query from `from_id` to each of `to_ids`. Returns one future with the vote per query
+        """
+        color = encode_vote(color)
+        futures = []
+
+        for to_id in to_ids:
+            request_id = next(self.request_ids)
+            future = self.loop.create_future()
+            self.pending[request_id] = future
+            # Also forget requests cancelled on timeout
+            future.add_done_callback(lambda _, request_id=request_id: self.pending.pop(request_id, None))
+            self.client.sendto(REQUEST.pack(request_id, from_id, to_id, color))
+            futures.append(future)
+
+        return futures
+
+
+def make_transport(args):
+    if args.transport == 'memory':
+        return MemoryTransport(make_latency(args.latency, args.latency_mean, np.random.default_rng(args.seed)))
+    elif args.transport == 'udp':
+        return UdpTransport()
+    else:
+        raise AssertionError(args.transport)
+
+
+class AsyncSnowballProtocol(SnowballProtocol):
+    """ Snowball with good participants running concurrently in real time on an asyncio event loop.
+
+        `step` runs the whole simulation in a new event loop, until every good participant finished or
+        `part_iterations` rounds per good participant were completed. Timed out queries are `None` votes.
+        Times are wall clock seconds since the start of the run.
+    """
+
+    def __init__(self, args, net=None, transport=None):
+        self.transport = transport or make_transport(args)
+        self.timeout = args.timeout
+        self.query_interval = args.query_interval
+
+        self.start_time = None
+        self.wall_time = 0.
+        self.finality = None
+        self.round_times = None
+        self.timeouts = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.over = None
+
+        super().__init__(args, net)
+        self.top_iterations = args.part_iterations * self.good_num
+
+    def reset(self):
+        super().reset()
+
+        self.wall_time = 0.
+        self.timeouts = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # Wall time each good participant finished at and duration of every round
+        self.finality = {}
+        self.round_times = []
+
+    def respond(self, from_id, to_id, color):
+        return self.participant_objects[to_id].respond_to_query(
+            from_id, color, self.participant_objects, iteration=self.iteration)
+
+    async def query(self, part_id, participants, color, callback):
+        start = time.perf_counter()
+        futures = self.transport.query(part_id, participants, color)
+
+        self.in_flight += len(futures)
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        responses = asyncio.gather(*futures)
+        # Queries in flight are cancelled when the run is over. Retrieve the error so it isn't reported
+        responses.add_done_callback(lambda responses: responses.cancelled() or responses.exception())
+
+        try:
+            await asyncio.wait_for(responses, self.timeout)
+        except asyncio.TimeoutError:
+            # Queries without response were cancelled
+            pass
+        finally:
+            self.in_flight -= len(futures)
+
+        cancelled = [future.cancelled() for future in futures]
+        self.timeouts += sum(cancelled)
+        votes = [None if timeout else future.result() for future, timeout in zip(futures, cancelled)]
+        result = callback(votes)
+
+        self.end_round(self.participant_objects[part_id], participants, votes)
+        self.round_times.append(time.perf_counter() - start)
+        return result
+
+    def end_round(self, part, participants, votes):
+        self.iteration += 1
+        self.log(part.self_id, participants, votes)
+
+        for observer in self.observers:
+            observer.update(part)
+
+        if self.terminations and self.terminated(part):
+            self.over.set()
+            return
+
+        if part.is_finished():
+            self.finality[part.self_id] = time.perf_counter() - self.start_time
+            self.running_participants.remove(part)
+
+        if self.iteration == self.top_iterations:
+            self.over.set()
+
+    async def run(self):
+        self.over = asyncio.Event()
+        await self.transport.open(self)
+        self.start_time = time.perf_counter()
+
+        tasks = [asyncio.ensure_future(part.snowball_async(self.query, self.query_interval))
+                 for part in self.participant_objects if not part.adversary]
+        finished = asyncio.gather(*tasks)
+        out_of_iterations = asyncio.ensure_future(self.over.wait())
+
+        try:
+            await asyncio.wait([finished, out_of_iterations], return_when=asyncio.FIRST_COMPLETED)
+            if finished.done():
+                # Raise errors of participants
+                finished.result()
+        finally:
+            self.wall_time = time.perf_counter() - self.start_time
+
+            for task in tasks + [out_of_iterations]:
+                task.cancel()
+            await asyncio.gather(finished, out_of_iterations, return_exceptions=True)
+            self.transport.close()
+
+    def step(self):
+        asyncio.run(self.run())
+
+        if self.record:
+            self.history.flush()
+
+        return True
+
+    def round_percentiles(self, q=(50, 90, 99, 100)):
+        """ Wall time of query rounds, as {percentile: seconds}
+        """
+        return percentiles(self.round_times, q)
+
+    def finality_percentiles(self, q=(50, 90, 99, 100)):
+        """ Wall time until good participants finished, as {percentile: seconds}
+        """
+        return percentiles(self.finality.values(), q)
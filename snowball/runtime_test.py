@@ -0,0 +1,45 @@
+import unittest
+
+from snowball.adversary import Strategy
+from snowball.runtime import AsyncSnowballProtocol
+from snowball.testing import make_args
+
+NETWORK = dict(transport='memory', latency='constant', latency_mean=0., timeout=1., snowball_beta=20)
+
+
+class AsyncSnowballTest(unittest.TestCase):
+
+    def _check_finished(self, proto):
+        self.assertTrue(proto.consensus)
+        self.assertEqual(len(proto.finality), proto.good_num)
+        self.assertEqual(len(proto.round_times), proto.iteration)
+        self.assertLessEqual(max(proto.finality.values()), proto.wall_time)
+
+    def test_memory(self):
+        proto = AsyncSnowballProtocol(make_args(100, .1, Strategy.INCREASE_CONFIDENCE, **NETWORK))
+        self.assertTrue(proto.step())
+
+        self._check_finished(proto)
+        # Every good participant queries at once
+        self.assertEqual(proto.max_in_flight, proto.good_num * proto.k)
+
+    def test_udp(self):
+        proto = AsyncSnowballProtocol(make_args(50, .1, Strategy.INCREASE_CONFIDENCE, **dict(NETWORK, transport='udp')))
+        proto.step()
+
+        self._check_finished(proto)
+
+    def test_timeout(self):
+        # Responses arrive after the timeout
+        args = make_args(20, 0., Strategy.INCREASE_CONFIDENCE,
+                         **dict(NETWORK, latency_mean=.02, timeout=.01, part_iterations=3))
+        proto = AsyncSnowballProtocol(args)
+        proto.step()
+
+        self.assertGreaterEqual(proto.iteration, proto.top_iterations)
+        self.assertEqual(proto.timeouts, proto.k * proto.iteration)
+        self.assertFalse(proto.finality)
+
+
+if __name__ == "__main__":
+    unittest.main()
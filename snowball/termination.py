@@ -0,0 +1,171 @@
+""" Early termination of Snowball runs whose outcome is already known.
+
+    Terminations are registered in `SnowballProtocol.terminations` and checked after every query round of a good
+    participant with `check(proto, part)`, which returns the reason to stop (stored as `proto.stop_reason`) or None.
+    Checks are constant time, or scan the participants only every `interval` rounds.
+
+    The outcome of a run is `proto.consensus` when it stops. `Decided` only stops runs whose outcome can no longer
+    change before the iteration budget runs out (up to `risk`), while `Stalled` is a heuristic for networks kept split.
+"""
+import math
+
+import numpy as np
+
+# Reasons to stop
+CONSENSUS = 'consensus'
+SAFETY_VIOLATION = 'safety_violation'
+STALLED = 'stalled'
+
+
+def quorum_probability(num_participants, adversaries_num, k, alpha):
+    """ Probability that a query of a good participant samples enough adversaries to reach quorum on their own
+    """
+    quorum = math.ceil(k * alpha)
+    others = num_participants - 1
+    return sum(math.comb(adversaries_num, j) * math.comb(others - adversaries_num, k - j)
+               for j in range(quorum, k + 1)) / math.comb(others, k)
+
+
+def binomial_tail(n, p, m):
+    """ Chernoff upper bound of P(Binomial(n, p) >= m)
+    """
+    if m > n or p == 0.:
+        return 0.
+
+    a = m / n
+    if a <= p:
+        return 1.
+    if a == 1.:
+        return p ** n
+
+    divergence = a * math.log(a / p) + (1 - a) * math.log((1 - a) / (1 - p))
+    return math.exp(-n * divergence)
+
+
+def remaining_rounds(proto):
+    return proto.top_iterations - proto.iteration
+
+
+class Decided:
+    """ Stops as soon as the outcome is decided:
+
+        - Safety violation: good participants finished with different colors. Finished participants never change
+          color, so there is no consensus at the end.
+        - Consensus: all good participants have the same color. They vote for it, so only adversaries can bring
+          another color to quorum, and a participant with confidence (lead) `l` changes color only after `l + 1` such
+          queries. This can't happen if adversaries are fewer than the quorum or if no participant has enough rounds
+          left. Otherwise the probability that any good participant changes color before the budget runs out is
+          bounded (union and Chernoff bounds) and compared with `risk`.
+
+        Rounds in flight when the color of a participant changes (events and async engines) may carry older votes,
+        so consensus is only checked once every running good participant completed a round after the last change.
+    """
+
+    def __init__(self, proto, risk=0., interval=None):
+        self.risk = risk
+        self.interval = interval or len(proto.participant_objects)
+
+        self.finished_colors = set()
+        self.quorum_probability = quorum_probability(len(proto.participant_objects), proto.adversaries_num, proto.k,
+                                                     proto.alpha)
+
+        # Good participants that didn't complete a round since the good participants became unanimous
+        self.waiting = None
+        self.rounds = 0
+
+    def check(self, proto, part):
+        self.rounds += 1
+
+        if part.is_finished():
+            self.finished_colors.add(part.color)
+            if len(self.finished_colors) > 1:
+                return SAFETY_VIOLATION
+
+        tally = proto.honest_tally
+        if max(tally) != proto.good_num:
+            self.waiting = None
+            return None
+
+        if self.waiting is None:
+            self.waiting = {running.self_id for running in proto.running_participants if not running.adversary}
+
+        self.waiting.discard(part.self_id)
+        if self.waiting:
+            return None
+
+        if self.quorum_probability == 0.:
+            return CONSENSUS
+
+        if self.rounds % self.interval:
+            return None
+
+        lead = min(good.confidence for good in proto.participant_objects if not good.adversary)
+        if proto.good_num * binomial_tail(remaining_rounds(proto), self.quorum_probability, lead + 1) <= self.risk:
+            return CONSENSUS
+
+        return None
+
+
+class Stalled:
+    """ Stops networks kept split, where consensus is out of reach for the rest of the budget. Every `interval`
+        rounds it samples the share of good participants on the majority color and the lowest confidence among the
+        others. The run is stalled when, over the last `patience` samples, extrapolating the majority share with an
+        upper bound of its trend doesn't reach unanimity before the budget runs out, while the lowest confidence of
+        the minority is positive and grows, so no participant of the minority is about to change color.
+
+        This is a heuristic: the extrapolation is linear and assumes the trend holds.
+    """
+
+    def __init__(self, proto, interval=None, patience=10, z=3.):
+        self.interval = interval or 5 * len(proto.participant_objects)
+        self.patience = patience
+        self.z = z
+
+        self.shares = []
+        self.minority_confidences = []
+        self.rounds = 0
+
+    def check(self, proto, part):
+        self.rounds += 1
+        if self.rounds % self.interval:
+            return None
+
+        tally = proto.honest_tally
+        majority = max(range(len(tally)), key=tally.__getitem__)
+
+        self.shares.append(tally[majority] / proto.good_num)
+        self.minority_confidences.append(min((good.confidence for good in proto.participant_objects
+                                              if not good.adversary and good.color != majority), default=None))
+
+        del self.shares[:-self.patience]
+        del self.minority_confidences[:-self.patience]
+
+        if len(self.shares) < self.patience or None in self.minority_confidences:
+            return None
+
+        # Every participant of the minority keeps away from changing color
+        confidences = self.minority_confidences
+        if confidences[0] == 0 or confidences[-1] == confidences[0] or \
+                any(later < earlier for earlier, later in zip(confidences, confidences[1:])):
+            return None
+
+        # Least squares slope of the share per sample and its standard error
+        x = np.arange(self.patience)
+        slope, intercept = np.polyfit(x, self.shares, 1)
+        residuals = np.asarray(self.shares) - (slope * x + intercept)
+        error = math.sqrt((residuals @ residuals) / (self.patience - 2) / ((x - x.mean()) @ (x - x.mean())))
+
+        samples_left = remaining_rounds(proto) / self.interval
+        if self.shares[-1] + max(slope + self.z * error, 0.) * samples_left < 1.:
+            return STALLED
+
+        return None
+
+
+def make_terminations(args, proto):
+    if args.early_stop == 'decided':
+        return [Decided(proto, args.decided_risk)]
+    elif args.early_stop == 'stalled':
+        return [Decided(proto, args.decided_risk), Stalled(proto)]
+    else:
+        raise AssertionError(args.early_stop)
@@ -0,0 +1,63 @@
+import random
+import unittest
+
+from snowball.adversary import Strategy
+from snowball.events import EventSnowballProtocol
+from snowball.protocol import SnowballProtocol
+from snowball.termination import binomial_tail, make_terminations, quorum_probability
+from snowball.testing import make_args, run_protocol
+
+
+class TerminationTest(unittest.TestCase):
+
+    def test_bounds(self):
+        self.assertEqual(quorum_probability(100, 7, 10, .8), 0.)
+        self.assertGreater(quorum_probability(100, 8, 10, .8), 0.)
+
+        self.assertEqual(binomial_tail(10, .5, 11), 0.)
+        self.assertEqual(binomial_tail(10, .5, 2), 1.)
+        # Exact tail is 11 / 1024
+        self.assertGreaterEqual(binomial_tail(10, .5, 9), 11 / 1024)
+
+    def test_consensus(self):
+        # Without adversaries a unanimous network can't change
+        args = make_args(200, 0., Strategy.INCREASE_CONFIDENCE, seed=0, early_stop='decided')
+        random.seed(0)
+        proto = SnowballProtocol(args)
+        proto.terminations = make_terminations(args, proto)
+        run_protocol(proto)
+
+        self.assertEqual(proto.stop_reason, 'consensus')
+        self.assertTrue(proto.consensus)
+        self.assertTrue(proto.running_participants)
+
+    def test_same_outcome(self):
+        for strategy, percent, seed in [(Strategy.EQUAL_SPLIT, .1, 0), (Strategy.INCREASE_CONFIDENCE, .25, 1)]:
+            args = make_args(200, percent, strategy, seed=seed, early_stop='stalled')
+
+            protos = []
+            for early_stop in (False, True):
+                random.seed(seed)
+                proto = SnowballProtocol(args)
+                if early_stop:
+                    proto.terminations = make_terminations(args, proto)
+                protos.append(run_protocol(proto))
+
+            full, stopped = protos
+            self.assertIsNone(full.stop_reason)
+            self.assertIsNotNone(stopped.stop_reason)
+            self.assertLess(stopped.iteration, full.iteration)
+            self.assertEqual(stopped.consensus, full.consensus)
+
+    def test_events(self):
+        args = make_args(200, 0., Strategy.INCREASE_CONFIDENCE, seed=0, early_stop='decided', latency='constant')
+        proto = EventSnowballProtocol(args)
+        proto.terminations = make_terminations(args, proto)
+        run_protocol(proto)
+
+        self.assertEqual(proto.stop_reason, 'consensus')
+        self.assertTrue(proto.consensus)
+
+
+if __name__ == "__main__":
+    unittest.main()
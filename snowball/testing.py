@@ -0,0 +1,25 @@
+""" Helpers shared by the tests of the protocol engines
+"""
+from snowball.run import get_arg_parser
+
+
+def make_args(num_participants, adversary_percent, strategy, **options):
+    """ Arguments of a simulation. `options` replace the defaults of `run.get_arg_parser` by name
+    """
+    args = get_arg_parser().parse_args([
+        '--num_participants', str(num_participants),
+        '--adversary_percent', str(adversary_percent)])
+    args.adversary_strategy = strategy
+
+    for name, value in options.items():
+        assert hasattr(args, name), name
+        setattr(args, name, value)
+
+    return args
+
+
+def run_protocol(proto):
+    done = False
+    while not done:
+        done = proto.step()
+    return proto
@@ -0,0 +1,315 @@
+import numpy as np
+
+from adversary import POLICY_STRATEGIES, Strategy
+from participant import color_values
+
+NO_COLOR = -1
+
+
+class VectorizedSnowballProtocol:
+    """ Snowball simulation with all participant state stored in NumPy arrays.
+
+        Instead of advancing one participant per call, every `step` schedules a batch of
+        `batch_size` distinct running participants and resolves all their queries at once
+        against the colors at the start of the batch. With a batch small compared to the
+        number of participants this matches the scalar `SnowballProtocol` in distribution.
+
+        Every participant runs `decrees` independent binary Snowball instances at once. A query
+        carries the colors of all instances and is answered with one vote per instance, as in the
+        batched queries of Avalanche. Participant state has one column per instance, an instance
+        stops changing once it is finished and a participant keeps querying while any of its
+        instances is running. Each decree is over once decided or after `top_iterations` of its own
+        iterations, and the simulation ends when every decree is over.
+    """
+
+    def __init__(self, args):
+        self.num_participants = args.num_participants
+        self.participants = list(range(args.num_participants))
+
+        self.adversaries_num = int(args.num_participants * args.adversary_percent)
+        self.good_num = args.num_participants - self.adversaries_num
+
+        self.alpha = args.snowball_alpha
+        self.beta = args.snowball_beta
+        self.k = args.snowball_k
+
+        assert self.num_participants > self.k
+
+        self.adversary_strategy = args.adversary_strategy
+        self.balance = args.balance
+        self.top_iterations = args.part_iterations * args.num_participants
+        self.batch_size = args.batch_size
+        self.decrees = args.decrees
+        self.num_colors = args.num_colors
+        self.colors = color_values(self.num_colors)
+
+        # First vote counter of each (sender, decree) of a batch, as used by `snowball_iteration_post`
+        offsets = np.arange(self.batch_size * self.decrees) * (self.num_colors + 1)
+        self.vote_offsets = offsets.reshape(-1, 1, self.decrees)
+
+        if self.adversary_strategy in POLICY_STRATEGIES:
+            raise AssertionError(self.adversary_strategy)
+
+        self.rng = np.random.default_rng(args.seed)
+
+        # Participants [good_num, num_participants) are adversaries, as in `SnowballProtocol`
+        self.adversary = np.arange(self.num_participants) >= self.good_num
+
+        self.color = None
+        self.lastcolor = None
+        self.d = None
+        self.count = None
+        self.finished = None
+        self.finished_count = None
+        self.flat = None
+        self.running = None
+        self.decided = None
+        self.over = None
+        self.active = None
+        self.decree_iteration = None
+        self.iteration = 0
+        # Early termination (`termination.py`) needs observers, which this engine doesn't have
+        self.stop_reason = None
+
+        self.reset()
+
+    def reset(self):
+        n, m = self.num_participants, self.decrees
+        self.iteration = 0
+
+        # Arrays have one row per participant and one column per decree. Colors are 0..num_colors-1,
+        # with 0 for False and 1 for True on binary Snowball
+        if self.num_colors == 2:
+            self.color = (self.rng.uniform(0, 1, (n, m)) > self.balance).astype(np.int8)
+        else:
+            # `balance` only applies to binary Snowball
+            self.color = self.rng.integers(0, self.num_colors, (n, m)).astype(np.int8)
+        self.lastcolor = np.full((n, m), NO_COLOR, dtype=np.int8)
+        # d[:, :, c] is the number of successful queries for color c
+        self.d = np.zeros((n, m, self.num_colors), dtype=np.int32)
+        self.count = np.zeros((n, m), dtype=np.int32)
+        self.finished = np.zeros((n, m), dtype=bool)
+        # Number of participants that finished each decree
+        self.finished_count = np.zeros(m, dtype=np.int64)
+        # Flat views with one entry per (participant, decree) cell, at index participant * decrees + decree
+        self.flat = (self.color.reshape(-1), self.lastcolor.reshape(-1), self.count.reshape(-1),
+                      self.finished.reshape(-1), self.d.reshape(-1, self.num_colors))
+        # Participants with a decree still running
+        self.running = np.ones(n, dtype=bool)
+
+        # Decrees finished by every good participant
+        self.decided = np.zeros(m, dtype=bool)
+        # Decrees no longer simulated: decided or out of iterations
+        self.over = np.zeros(m, dtype=bool)
+        self.active = ~self.over
+        # Iterations of each decree: steps of adversaries and of senders still running that decree.
+        # This is what `iteration` would count on a simulation of that decree alone
+        self.decree_iteration = np.zeros(m, dtype=np.int64)
+
+    @property
+    def running_participants(self):
+        # Adversaries never reach consensus so they are always running
+        return np.flatnonzero(self.running)
+
+    @staticmethod
+    def tally(color, num_colors):
+        """ Number of participants with each color, one row per decree
+        """
+        decrees = color.shape[1]
+        index = color + num_colors * np.arange(decrees) if decrees > 1 else color
+        return np.bincount(index.ravel(), minlength=decrees * num_colors).reshape(decrees, num_colors)
+
+    @property
+    def color_counts(self):
+        """ Number of good participants with each color, one row per decree
+        """
+        return self.tally(self.color[:self.good_num], self.num_colors)
+
+    @property
+    def decree_consensus(self):
+        return self.color_counts.max(axis=1) == self.good_num
+
+    @property
+    def snowball_map(self):
+        # Summed over decrees
+        return dict(zip(self.colors, self.color_counts.sum(axis=0).tolist()))
+
+    @property
+    def consensus(self):
+        return bool(self.decree_consensus.all())
+
+    @property
+    def confidence(self):
+        # Lead of the current color over the runner-up
+        d = np.sort(self.d, axis=2)
+        return d[:, :, -1] - d[:, :, -2]
+
+    def get_subsets(self, senders):
+        """ Sample `k` distinct participants for every sender, never including the sender itself
+        """
+        b = len(senders)
+        subsets = self.rng.integers(0, self.num_participants - 1, size=(b, self.k))
+        redo = np.arange(b)
+
+        while True:
+            rows = np.sort(subsets[redo], axis=1)
+            redo = redo[(rows[:, 1:] == rows[:, :-1]).any(axis=1)]
+            if len(redo) == 0:
+                break
+            subsets[redo] = self.rng.integers(0, self.num_participants - 1, size=(len(redo), self.k))
+
+        # Same trick as `avalanche.sample`: shift values to skip the sender
+        subsets += subsets >= senders[:, None]
+        return subsets
+
+    def least_frequent(self):
+        """ Least frequent color of each decree
+        """
+        # Adversaries inspect every participant color, including their own. Lowest color on ties
+        if self.num_colors == 2:
+            true_count = self.color.sum(axis=0, dtype=np.int64)
+            return (true_count < self.num_participants - true_count).astype(np.int8)
+
+        return self.tally(self.color, self.num_colors).argmin(axis=1).astype(np.int8)
+
+    def split(self, senders, size, offset=0):
+        """ Color of each sender when senders are split in consecutive groups of `size` ids, one per color
+        """
+        group = np.maximum(senders % (size * self.num_colors) - offset, 0) // size
+        return group.astype(np.int8)[:, None]
+
+    def adversary_votes(self, senders, colors):
+        """ Votes of an adversary queried by each sender, with `NO_COLOR` standing for no answer.
+
+            `colors` are the sender colors, one row per sender and one column per decree. Votes
+            are returned with the same shape or one that broadcasts to it.
+        """
+        strategy = self.adversary_strategy
+
+        if strategy == Strategy.TRY_BALANCE:
+            return self.least_frequent()
+
+        elif strategy == Strategy.INCREASE_CONFIDENCE:
+            return colors
+
+        elif strategy == Strategy.EQUAL_SPLIT:
+            split = self.num_colors - 1 - senders % self.num_colors
+            return split.astype(np.int8)[:, None]
+
+        elif strategy == Strategy.NON_ANSWER:
+            least_frequent = self.least_frequent()
+            return np.where(colors == least_frequent, colors, NO_COLOR).astype(np.int8)
+
+        elif strategy == Strategy.BREAK_LIVENESS:
+            if self.iteration < 100000:
+                return self.least_frequent()
+            else:
+                return colors
+
+        elif strategy == Strategy.BREAK_SAFETY:
+            if self.iteration < 100000:
+                return self.split(senders, 100)
+
+            # Decrees where any of the first participants finished
+            late_split = self.split(senders, 100, offset=10)
+            return np.where(self.finished[:10].any(axis=0), self.num_colors - 1, late_split).astype(np.int8)
+
+        else:
+            raise AssertionError(strategy)
+
+    def snowball_iteration_post(self, senders, votes):
+        """ Update every running decree of `senders` given `votes` of shape (senders, k, decrees).
+            Return whether some sender finished a decree.
+        """
+        b, _, m = votes.shape
+        c = self.num_colors + 1
+        color, lastcolor, count, finished, d = self.flat
+
+        cells = senders[:, None] * m + np.arange(m) if m > 1 else senders[:, None]
+
+        # Votes per color, with missing votes (`NO_COLOR`) counted on column 0. Shape: (senders, decrees, colors + 1)
+        index = self.vote_offsets[:b] + (votes + 1)
+        current_votes = np.bincount(index.ravel(), minlength=b * m * c).reshape(b, m, c)[:, :, 1:]
+
+        # Most voted color, lowest on ties, as the scalar engine
+        winner = current_votes.argmax(axis=2)
+        threshold = self.k * self.alpha
+
+        # Finished decrees don't change anymore
+        running = ~finished[cells] & self.active
+        won = (current_votes.max(axis=2) >= threshold) & running
+
+        count[cells[running & ~won]] = 0
+
+        cells = cells[won]
+        vote = winner[won].astype(np.int8)
+
+        d[cells, vote] += 1
+
+        current = color[cells]
+        color[cells] = np.where(d[cells, vote] > d[cells, current], vote, current)
+
+        cell_count = np.where(vote == lastcolor[cells], count[cells] + 1, 0)
+        count[cells] = cell_count
+        lastcolor[cells] = vote
+
+        done = cells[cell_count >= self.beta]
+        if len(done) == 0:
+            return False
+
+        finished[done] = True
+        self.finished_count += np.bincount(done % m, minlength=m)
+
+        rows = done // m
+        self.running[rows] = (~self.finished[rows] & self.active).any(axis=1)
+        return True
+
+    def step(self):
+        running = self.running_participants
+        remaining = self.top_iterations - int(self.decree_iteration.min(initial=self.top_iterations, where=self.active))
+        batch = min(self.batch_size, len(running), remaining)
+
+        scheduled = self.rng.choice(running, size=batch, replace=False)
+        self.iteration += batch
+
+        # Adversarial queries affect in no way the state but they are counted toward number of iterations
+        senders = scheduled[~self.adversary[scheduled]]
+
+        if self.decrees > 1:
+            decree_steps = (~self.finished[senders]).sum(axis=0) + (len(scheduled) - len(senders))
+            self.decree_iteration += decree_steps * self.active
+            # Decrees with fewer iterations left than the batch stop at their budget
+            np.minimum(self.decree_iteration, self.top_iterations, out=self.decree_iteration)
+        else:
+            # Every scheduled participant is running the only decree
+            self.decree_iteration += batch
+
+        finished = False
+
+        if len(senders) > 0:
+            subsets = self.get_subsets(senders)
+            colors = self.color[senders]
+
+            votes = self.color[subsets]
+            queried_adversary = self.adversary[subsets]
+
+            if queried_adversary.any():
+                rows, _ = np.nonzero(queried_adversary)
+                votes[queried_adversary] = self.adversary_votes(senders[rows], colors[rows])
+
+            finished = self.snowball_iteration_post(senders, votes)
+
+        # Decrees run at different speeds, so any of them can reach its budget before the slowest one
+        exhausted = self.active & (self.decree_iteration >= self.top_iterations)
+
+        if finished or exhausted.any():
+            # All good participants are committed to some value. Adversaries never finish
+            self.decided = self.finished_count == self.good_num
+            over = self.decided | (self.decree_iteration >= self.top_iterations)
+
+            if (over != self.over).any():
+                self.over = over
+                self.active = ~over
+                self.running = (~self.finished & self.active).any(axis=1)
+
+        return not self.active.any()
@@ -0,0 +1,143 @@
+import random
+import unittest
+
+import numpy as np
+
+from snowball.adversary import Strategy
+from snowball.protocol import SnowballProtocol
+from snowball.testing import make_args, run_protocol
+from snowball.vectorized import VectorizedSnowballProtocol
+
+# Batches small compared to the number of participants, see `VectorizedSnowballProtocol`
+DEFAULTS = dict(part_iterations=300, batch_size=16)
+
+
+def run_seeded(args, count):
+    """ Run `count` simulations of both engines with fixed seeds
+    """
+    random.seed(0)
+    scalar = [run_protocol(SnowballProtocol(args)) for _ in range(count)]
+
+    vector = []
+    for seed in range(count):
+        args.seed = seed
+        vector.append(run_protocol(VectorizedSnowballProtocol(args)))
+
+    args.seed = None
+    return scalar, vector
+
+
+class VectorizedSnowballTest(unittest.TestCase):
+
+    def test_sanity(self):
+        for prob in [.5, .7, .9]:
+            args = make_args(500, 0., Strategy.INCREASE_CONFIDENCE, **DEFAULTS)
+            args.balance = prob
+            args.part_iterations = 10 ** 6
+            proto = run_protocol(VectorizedSnowballProtocol(args))
+
+            self.assertTrue(proto.consensus)
+            self.assertTrue(proto.finished[:proto.good_num].all())
+
+    def test_subsets(self):
+        proto = VectorizedSnowballProtocol(make_args(20, 0., Strategy.INCREASE_CONFIDENCE, **DEFAULTS))
+        senders = np.arange(20)
+
+        for _ in range(50):
+            subsets = proto.get_subsets(senders)
+            self.assertEqual(subsets.shape, (20, proto.k))
+            self.assertFalse((subsets == senders[:, None]).any())
+            self.assertTrue((subsets < 20).all())
+
+            for row in subsets:
+                self.assertEqual(len(set(row)), proto.k)
+
+    def test_iteration_budget(self):
+        args = make_args(100, .19, Strategy.EQUAL_SPLIT, part_iterations=10, batch_size=7)
+        proto = run_protocol(VectorizedSnowballProtocol(args))
+        self.assertLessEqual(proto.iteration, proto.top_iterations)
+
+    def test_matches_scalar(self):
+        # Adversaries few enough that every run ends well before the budget
+        for strategy, percent in [(Strategy.INCREASE_CONFIDENCE, .1), (Strategy.EQUAL_SPLIT, .05),
+                                  (Strategy.NON_ANSWER, .05)]:
+            args = make_args(100, percent, strategy, **dict(DEFAULTS, part_iterations=3000))
+
+            scalar, vector = run_seeded(args, 20)
+
+            for proto in scalar + vector:
+                self.assertTrue(proto.consensus)
+                self.assertLess(proto.iteration, proto.top_iterations)
+
+            # Quartiles of iterations
+            scalar_iterations = np.percentile([proto.iteration for proto in scalar], [25, 50, 75])
+            vector_iterations = np.percentile([proto.iteration for proto in vector], [25, 50, 75])
+
+            np.testing.assert_allclose(vector_iterations, scalar_iterations, rtol=.1)
+
+    def test_colors(self):
+        for strategy in [Strategy.INCREASE_CONFIDENCE, Strategy.EQUAL_SPLIT]:
+            args = make_args(100, .1, strategy, **DEFAULTS)
+            args.num_colors = 3
+            args.snowball_alpha = .6
+
+            scalar, vector = run_seeded(args, 10)
+
+            self.assertTrue(all(proto.color.max() < 3 for proto in vector))
+
+            scalar_iterations = np.mean([proto.iteration for proto in scalar])
+            vector_iterations = np.mean([proto.iteration for proto in vector])
+
+            self.assertLess(abs(scalar_iterations - vector_iterations), .25 * scalar_iterations)
+
+    def test_decrees(self):
+        # Every decree ends before the budget
+        args = make_args(100, .1, Strategy.INCREASE_CONFIDENCE, **dict(DEFAULTS, part_iterations=3000))
+
+        single = []
+        for seed in range(10):
+            args.seed = seed
+            single.append(run_protocol(VectorizedSnowballProtocol(args)))
+
+        for proto in single:
+            self.assertTrue(proto.consensus)
+            self.assertEqual(proto.decree_iteration[0], proto.iteration)
+
+        args.seed = 0
+        args.decrees = 20
+        multi = run_protocol(VectorizedSnowballProtocol(args))
+
+        self.assertEqual(multi.color.shape, (100, 20))
+        self.assertTrue(multi.decree_consensus.all())
+        self.assertTrue(multi.consensus)
+        self.assertLess(multi.decree_iteration.max(), multi.top_iterations)
+        self.assertLessEqual(multi.decree_iteration.max(), multi.iteration)
+
+        single_iterations = np.mean([proto.iteration for proto in single])
+        self.assertLess(abs(multi.decree_iteration.mean() - single_iterations), .1 * single_iterations)
+
+    def test_decree_budget(self):
+        # Decrees with finished participants count fewer iterations, so the others reach the budget first
+        args = make_args(100, .1, Strategy.EQUAL_SPLIT, **dict(DEFAULTS, part_iterations=150, decrees=20, seed=0))
+        proto = VectorizedSnowballProtocol(args)
+
+        colors = {}
+        exhausted_at = {}
+        done = False
+        while not done:
+            done = proto.step()
+
+            # Decrees stop changing as soon as they are out of iterations
+            exhausted = proto.decree_iteration >= proto.top_iterations
+            self.assertFalse((proto.active & exhausted).any())
+
+            for decree in np.flatnonzero(exhausted):
+                colors.setdefault(decree, proto.color[:, decree].copy())
+                exhausted_at.setdefault(decree, proto.iteration)
+                np.testing.assert_array_equal(proto.color[:, decree], colors[decree])
+
+        self.assertGreater(len(set(exhausted_at.values())), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,15 +1,16 @@
 #!/usr/bin/env python
+import os
 import sys
-import random
 import time
-from itertools import count
 
+import numpy as np
 import pylab
-from matplotlib.pyplot import pause
 import matplotlib.colors as col
-import networkx as nx
+from matplotlib.collections import LineCollection
 from tqdm import tqdm
 
+from eventlog import EventReader, Kind
+
 
 pylab.ion()
 
@@ -29,113 +30,211 @@ class DAGHandler:
     # Use -1 to set global point of view (in this case a block is accepted if at least one participant accepted it)
     POV = 0
 
+    # Blocks drawn at most, the newest ones, and accepted blocks drawn before the first undecided one
+    WINDOW = 200
+    CONTEXT = 50
+
     def __init__(self):
+        # Map: block_id -> position. Blocks are placed from left to right in arrival order, see `coordinates`
         self.blocks = {}
-        self.position = 0
+        self.colors = bytearray()
+
+        # Edges as (child position, parent position) sorted by child, and index of the first edge of each block
+        self.edges = []
+        self.first_edge = []
+
+        # Position of the first block not accepted
+        self.frontier = 0
+
+        self.figure = None
+        self.nodes = None
+        self.lines = None
 
-        self.graph = nx.DiGraph()
+    def position(self, blockId):
+        """ Position of a block. Blocks not seen yet, as the genesis or parents when the log doesn't have
+            Receive-Block events, are added without parents
+        """
+        position = self.blocks.get(blockId)
+
+        if position is None:
+            position = self.blocks[blockId] = len(self.colors)
+            self.colors.append(EMPTY)
+            self.first_edge.append(len(self.edges))
+
+        return position
 
     def receiveBlock(self, blockId, parents):
         if blockId in self.blocks:
             return False
 
-        self.blocks[blockId] = parents
-
-        x = self.position * 3
-        y = self.position * 21 % 100
-        self.position += 1
-
-        self.graph.add_node(blockId, position=(x, y), color=EMPTY)
+        # Parents first, so they are placed before the block
+        parents = [self.position(parent) for parent in parents]
+        position = self.position(blockId)
 
         for parent in parents:
-            self.graph.add_edge(blockId, parent)
+            self.edges.append((position, parent))
 
         return True
 
     def accept(self, blockId):
-        self.graph.node[blockId]['color'] |= ACCEPTED
+        self.colors[self.position(blockId)] |= ACCEPTED
+
+        while self.frontier < len(self.colors) and self.colors[self.frontier] & ACCEPTED:
+            self.frontier += 1
+
         return True
 
-    def update(self, line):
-        # Parse line
-        node, report = line.split(':')
-        nodeId = int(node.split()[1])
-        command, *_args = report.split()
-        args = ' '.join(_args)
+    def update(self, event):
+        nodeId = event.node
+
+        # Created blocks and conflicts are the same for every node, so the DAG can be drawn from logs
+        # without Receive-Block events
+        if event.kind == Kind.CREATE_BLOCK:
+            return self.receiveBlock(event.block, event.ids)
+
+        elif event.kind == Kind.CREATE_CONFLICT:
+            conflict_set = (event.block,) + event.ids
 
-        # Proccess line only depending on target point of view
+            for blockid in conflict_set:
+                self.colors[self.position(blockid)] |= CONFLICT
+
+            return True
+
+        # Proccess event only depending on target point of view
         if (DAGHandler.POV >= 0 and nodeId == DAGHandler.POV) or\
             DAGHandler.POV == -1 or\
             nodeId == -1:
 
-            if command == 'Accept-Block':
+            if event.kind == Kind.ACCEPT_BLOCK:
                 # Mark this block as accepted
-                blockId = int(args)
-                return self.accept(blockId)
+                return self.accept(event.block)
 
-            elif command == 'Receive-Block' or command == 'Create-Block':
+            elif event.kind == Kind.RECEIVE_BLOCK:
                 # Add this block to the DAG
-                blockId, *_parents = args.split()
-                blockId = int(blockId)
-                parents = eval(' '.join(_parents))
-                return self.receiveBlock(blockId, parents)
-
-            elif command == 'Create-Conflict':
-                conflict_set = list(map(int, args.split()))
-
-                for blockid in conflict_set:
-                    self.graph.node[blockid]['color'] |= CONFLICT
-
-                return True
+                return self.receiveBlock(event.block, event.ids)
 
         return False
 
-    def draw(self):
-        positions = nx.get_node_attributes(self.graph, 'position')
-        colors = [self.graph.node[u]['color'] for u in self.graph.node]
-        nx.draw_networkx(self.graph, with_labels=False, pos=positions, node_color=colors, cmap=colormask, vmin=0, vmax=3, node_size=100, width=.1)
-        pause(0.00001)
+    @staticmethod
+    def coordinates(positions):
+        return np.stack([positions * 3, positions * 21 % 100], axis=1).astype(float)
 
+    def window(self):
+        """ Positions [start, end) of the blocks drawn
+        """
+        end = len(self.colors)
+        return max(0, end - DAGHandler.WINDOW, self.frontier - DAGHandler.CONTEXT), end
 
-def watch(path):
+    def draw(self):
+        """ Update the artists with the blocks in the window. Cost only depends on the window size
+        """
+        if self.figure is None:
+            self.figure, axes = pylab.subplots()
+            self.lines = LineCollection([], colors='k', linewidths=.1, zorder=1)
+            axes.add_collection(self.lines)
+            self.nodes = axes.scatter([], [], c=[], cmap=colormask, vmin=0, vmax=3, s=100, zorder=2)
+            axes.set_ylim(-5, 105)
+            axes.set_axis_off()
+
+        start, end = self.window()
+        if start == end:
+            return
+
+        self.nodes.set_offsets(self.coordinates(np.arange(start, end)))
+        self.nodes.set_array(np.frombuffer(self.colors, dtype=np.uint8)[start:end])
+
+        # Edges to parents outside of the window are cut at the border
+        edges = np.array(self.edges[self.first_edge[start]:], dtype=int).reshape(-1, 2)
+        self.lines.set_segments(np.stack([self.coordinates(edges[:, 0]), self.coordinates(edges[:, 1])], axis=1))
+
+        self.nodes.axes.set_xlim(start * 3 - 3, end * 3)
+        self.figure.canvas.draw_idle()
+        self.figure.canvas.flush_events()
+
+
+def watch(path, interval=.1, poll=.05, idle_timeout=10.):
+    """ Follow the event log at `path`, redrawing at most every `interval` seconds.
+        Stops after `idle_timeout` seconds without new events.
+    """
     handler = DAGHandler()
 
-    idle = 0
-    changes = 0
+    last_event = time.perf_counter()
+    last_draw = 0.
+    changed = False
 
     pylab.show()
 
-    with open(path) as f:
-        for _ in tqdm(count()):
-            if idle > 20:
+    with open(path, 'rb') as f, tqdm(unit=' events') as progress:
+        reader = EventReader(f)
+
+        while True:
+            events = reader.read()
+            now = time.perf_counter()
+
+            if events:
+                last_event = now
+                progress.update(len(events))
+
+                for event in events:
+                    if handler.update(event):
+                        changed = True
+
+            elif now - last_event > idle_timeout:
                 break
-            line = f.readline()
-            if line:
-                idle = 0
-                _, log = line.split('|')
-                out = handler.update(log.strip())
-
-                if out:
-                    changes += 1
-                    if changes == 10:
-                        handler.draw()
-                        changes = 0
-            else:
-                idle += 1
-                time.sleep(.5)
+
+            if changed and now - last_draw >= interval:
+                handler.draw()
+                last_draw = now
+                changed = False
+
+            if not events:
+                time.sleep(poll)
+
+    if changed:
+        handler.draw()
+
+
+def run_log(run_id, root, timeout=10., poll=.1):
+    """ Event log of the last run started with `run_id`, waiting up to `timeout` seconds for it.
+        The simulation creates its log with the first event, in a directory with a suffix if the id was taken
+    """
+    from logger import run_directory
+
+    deadline = time.perf_counter() + timeout
+
+    while True:
+        run = run_directory(run_id, root)
+        path = run and os.path.join(run, 'avalanche.events')
+
+        if path is not None and os.path.exists(path) or time.perf_counter() >= deadline:
+            return path
+        time.sleep(poll)
 
 
 def main():
-    if len(sys.argv) > 1:
-        try:
-            logid = int(sys.argv[1])
-            path = f'logs/avalanche-{logid}.log'
-        except ValueError:
-            path = sys.argv[1]
+    """ Watch a log file, the log of a run id, or of the last run started
+    """
+    from logger import LOG_ROOT, latest_run_directory
+
+    if len(sys.argv) > 1 and os.path.isfile(sys.argv[1]):
+        path = sys.argv[1]
+    elif len(sys.argv) > 1:
+        path = run_log(sys.argv[1], LOG_ROOT)
+        if path is None:
+            print("No run", sys.argv[1], "in", LOG_ROOT)
+            return
     else:
-        from logger import find_id
-        logid = find_id() - 1
-        path = f'logs/avalanche-{logid}.log'
+        run = latest_run_directory()
+        if run is None:
+            print("No runs in", LOG_ROOT)
+            return
+        path = os.path.join(run, 'avalanche.events')
+
+        # The simulation creates its log with the first event
+        for _ in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(.1)
 
     print("Watching:", path)
     watch(path)
@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+
+import matplotlib
+matplotlib.use('Agg')
+
+from eventlog import EventWriter, Kind, Level, LEVELS, read_events
+from logger import make_run_directory
+from watch import ACCEPTED, CONFLICT, DAGHandler, run_log
+
+
+def write_log(path, level):
+    """ Log of 3 nodes as written by avalanche.py: every node receives the genesis, node 1 creates a chain of
+        blocks and a conflict, the others receive them and node 0 accepts the chain
+    """
+    writer = EventWriter(path)
+
+    def log(node, kind, block, ids=()):
+        if LEVELS[kind] <= level:
+            writer.write(node, kind, block, ids)
+
+    for node in range(3):
+        log(node, Kind.RECEIVE_BLOCK, 0)
+
+    parent = 0
+    for block in range(1, 6):
+        log(1, Kind.CREATE_BLOCK, block, [parent])
+        for node in (0, 2):
+            log(node, Kind.RECEIVE_BLOCK, block, [parent])
+        parent = block
+
+    log(1, Kind.CREATE_BLOCK, 6, [5])
+    log(1, Kind.CREATE_BLOCK, 7, [5])
+    log(1, Kind.CREATE_CONFLICT, 6, [7])
+
+    for block in range(6):
+        log(0, Kind.ACCEPT_BLOCK, block)
+
+    writer.close()
+
+
+class WatchTest(unittest.TestCase):
+
+    def replay(self, level):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'avalanche.events')
+            write_log(path, level)
+
+            handler = DAGHandler()
+            for event in read_events(path):
+                handler.update(event)
+            handler.draw()
+
+        return handler
+
+    def test_levels(self):
+        for level in (Level.CREATE, Level.ACCEPT, Level.ALL):
+            handler = self.replay(level)
+
+            # Blocks are placed after their parents, the genesis first
+            self.assertEqual(handler.blocks, {block: block for block in range(8)})
+            self.assertEqual(sorted(handler.edges), [(1, 0), (2, 1), (3, 2), (4, 3), (5, 4), (6, 5), (7, 5)])
+            self.assertEqual([bool(color & CONFLICT) for color in handler.colors], [False] * 6 + [True] * 2)
+
+            accepted = [bool(color & ACCEPTED) for color in handler.colors]
+            if level >= Level.ACCEPT:
+                self.assertEqual(accepted, [True] * 6 + [False] * 2)
+                self.assertEqual(handler.frontier, 6)
+            else:
+                self.assertEqual(accepted, [False] * 8)
+
+    def test_run_log(self):
+        with tempfile.TemporaryDirectory() as root:
+            self.assertIsNone(run_log('run', root, timeout=0.))
+
+            previous = make_run_directory('run', root)
+            write_log(os.path.join(previous, 'avalanche.events'), Level.ALL)
+
+            # A new run reusing the id logs to another directory, which is followed instead of the finished run
+            current = make_run_directory('run', root)
+            path = os.path.join(current, 'avalanche.events')
+            self.assertNotEqual(current, previous)
+            self.assertEqual(run_log('run', root, timeout=.2, poll=.05), path)
+            self.assertFalse(os.path.exists(path))
+
+            write_log(path, Level.CREATE)
+            self.assertEqual(run_log('run', root), path)
+
+
+if __name__ == "__main__":
+    unittest.main()